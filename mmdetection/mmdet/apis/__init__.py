@@ -1,8 +1,14 @@
 from .env import init_dist, get_root_logger, set_random_seed
 from .train import train_detector
 from .inference import init_detector, inference_detector, show_result, show_gt
+from .ensemble_scheduler import EnsembleScheduler
+from .result_spool import (ResultSpool, SpooledResults,
+                           collect_spooled_results, dump_results,
+                           get_spool_dir, pending_loader)
 
 __all__ = [
     'init_dist', 'get_root_logger', 'set_random_seed', 'train_detector',
-    'init_detector', 'inference_detector', 'show_result'
+    'init_detector', 'inference_detector', 'show_result', 'EnsembleScheduler',
+    'ResultSpool', 'SpooledResults', 'collect_spooled_results',
+    'dump_results', 'get_spool_dir', 'pending_loader'
 ]
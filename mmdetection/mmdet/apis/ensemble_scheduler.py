@@ -0,0 +1,255 @@
+import queue
+import threading
+import traceback
+
+import mmcv
+import torch
+import torch.multiprocessing as mp
+from mmcv.runner import load_checkpoint
+
+from mmdet.core import fuse_results
+from mmdet.models import build_detector
+from mmdet.models.detectors.ensemble_model import EnsembleModel
+
+
+def _unwrap_batch(data):
+    """Images and metas of a test batch of the data loader, without the
+    DataContainers of the metas, so that they can be sent to the workers."""
+    return data['img'], [meta.data[0] for meta in data['img_meta']]
+
+
+def _build_model(model_cfg, test_cfg, device):
+    cfg = mmcv.Config.fromfile(model_cfg['config'])
+    cfg.model.pretrained = None
+    model = build_detector(
+        cfg.model,
+        train_cfg=None,
+        test_cfg=test_cfg if test_cfg is not None else cfg.test_cfg)
+    load_checkpoint(model, model_cfg['checkpoint'], map_location='cpu')
+    return model.to(device).eval()
+
+
+def _worker_loop(model_idx, model_cfg, device, test_cfg, feat_cache,
+                 num_threads, in_queue, out_queue):
+    """Test the batches of ``in_queue`` with one model on ``device``.
+
+    The augmentations of an image are merged by the model alone
+    (:meth:`EnsembleModel.aug_test`), the results of each batch are put in
+    ``out_queue`` as ``(batch_idx, model_idx, results)``, an exception as
+    ``(None, model_idx, traceback)``. A ``None`` batch stops the worker.
+    """
+    try:
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        device = torch.device(device)
+        if device.type == 'cuda':
+            torch.cuda.set_device(device)
+        model = EnsembleModel(
+            [_build_model(model_cfg, test_cfg, device)],
+            feat_cache=feat_cache)
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            batch_idx, imgs, img_metas = item
+            with torch.no_grad():
+                # through forward, which normalizes uint8 images
+                results = model(
+                    [img.to(device) for img in imgs],
+                    img_metas,
+                    return_loss=False,
+                    rescale=True)
+            out_queue.put((batch_idx, model_idx, results))
+    except Exception:
+        out_queue.put((None, model_idx, traceback.format_exc()))
+
+
+class EnsembleScheduler(object):
+    """Model-parallel test of an ensemble, one worker process per model.
+
+    Every model is built and run in its own process, on its own device
+    (GPU, or CPU for CPU workers). The batches of the data loader are sent
+    to all the workers through bounded queues, so at most ``queue_size``
+    batches wait for the slowest model and it sets the pace of the others.
+    The results of each model stream back to the main process, where the
+    results of a batch are fused by :func:`fuse_results` as soon as every
+    model has tested it.
+
+    Since the models do not share proposals, they are merged by late
+    fusion: each model merges its own augmentations
+    (:meth:`EnsembleModel.aug_test`, which maps the flipped ones back) and
+    the models are fused like the runs of
+    :meth:`EnsembleModel.late_fusion_test`.
+
+    The workers are started by the first :meth:`run` and kept (with their
+    models) for the next ones until :meth:`close`, so that several data
+    loaders (e.g. the shards of a test set) are tested with a single model
+    startup.
+
+    Args:
+        model_cfgs (list[dict]): ``config`` and ``checkpoint`` paths of each
+            model.
+        devices (list[str]): device of each model, e.g. 'cuda:1' or 'cpu'.
+        test_cfg (dict, optional): test config of all the models, that of
+            the config of each model by default.
+        fusion (dict, optional): arguments of :func:`fuse_results` and
+            ``model_weights``. 'wbf' fusion by default.
+        feat_cache (dict, optional): arguments of the feature cache of each
+            worker.
+        queue_size (int): max number of batches waiting for each worker.
+        num_threads (int, optional): torch threads of each worker, for CPU
+            workers.
+    """
+
+    def __init__(self,
+                 model_cfgs,
+                 devices,
+                 test_cfg=None,
+                 fusion=None,
+                 feat_cache=None,
+                 queue_size=2,
+                 num_threads=None):
+        assert len(model_cfgs) == len(devices)
+        self.model_cfgs = model_cfgs
+        self.devices = devices
+        self.test_cfg = test_cfg
+        fusion = dict(fusion) if fusion is not None else dict(method='wbf')
+        self.model_weights = fusion.pop('model_weights', None)
+        if self.model_weights is None:
+            self.model_weights = [1.] * len(model_cfgs)
+        assert len(self.model_weights) == len(model_cfgs)
+        if test_cfg is not None:
+            fusion.setdefault('max_per_img', test_cfg.rcnn.max_per_img)
+            fusion.setdefault('mask_thr', test_cfg.rcnn.mask_thr_binary)
+        self.fusion = fusion
+        self.feat_cache = feat_cache
+        self.queue_size = queue_size
+        self.num_threads = num_threads
+        self._workers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        """Start the worker processes, which build their model."""
+        if self._workers is not None:
+            return
+        ctx = mp.get_context('spawn')
+        self._in_queues = [
+            ctx.Queue(self.queue_size) for _ in range(len(self.model_cfgs))
+        ]
+        self._out_queue = ctx.Queue()
+        self._workers = []
+        for i, (model_cfg, device) in enumerate(
+                zip(self.model_cfgs, self.devices)):
+            worker = ctx.Process(
+                target=_worker_loop,
+                args=(i, model_cfg, device, self.test_cfg, self.feat_cache,
+                      self.num_threads, self._in_queues[i], self._out_queue),
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def close(self, terminate=False):
+        """Stop the worker processes."""
+        if self._workers is None:
+            return
+        for in_queue, worker in zip(self._in_queues, self._workers):
+            if terminate:
+                worker.terminate()
+            else:
+                in_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = None
+
+    def _merge(self, model_results):
+        """Fuse the results of the models of a batch, image by image."""
+        if len(model_results) == 1:
+            return model_results[0]
+        return [
+            fuse_results(list(img_results), self.model_weights, **self.fusion)
+            for img_results in zip(*model_results)
+        ]
+
+    @staticmethod
+    def _put(in_queue, item, stop):
+        # blocks while the worker is queue_size batches behind
+        while not stop.is_set():
+            try:
+                in_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _feed(self, data_loader, in_queues, out_queue, stop):
+        try:
+            for batch_idx, data in enumerate(data_loader):
+                item = (batch_idx, ) + _unwrap_batch(data)
+                for in_queue in in_queues:
+                    self._put(in_queue, item, stop)
+                if stop.is_set():
+                    return
+        except Exception:
+            out_queue.put((None, None, traceback.format_exc()))
+
+    def run(self, data_loader, callback=None):
+        """Test the batches of ``data_loader`` (not shuffled).
+
+        Args:
+            data_loader (DataLoader): test data loader.
+            callback (callable, optional): called with the index and the
+                fused results of each batch, in the order they complete.
+
+        Returns:
+            list: fused results of all the images, in the dataset order.
+        """
+        self.start()
+        workers, out_queue = self._workers, self._out_queue
+        num_models = len(self.model_cfgs)
+        stop = threading.Event()
+        feeder = threading.Thread(
+            target=self._feed,
+            args=(data_loader, self._in_queues, out_queue, stop))
+        feeder.daemon = True
+        feeder.start()
+
+        num_batches = len(data_loader)
+        pending = {}
+        batch_results = [None] * num_batches
+        num_done = 0
+        try:
+            while num_done < num_batches:
+                try:
+                    batch_idx, model_idx, results = out_queue.get(timeout=10)
+                except queue.Empty:
+                    for i, worker in enumerate(workers):
+                        if not worker.is_alive():
+                            raise RuntimeError(
+                                'worker of model {} died with exit code '
+                                '{}'.format(i, worker.exitcode))
+                    continue
+                if batch_idx is None:
+                    raise RuntimeError('{} failed:\n{}'.format(
+                        'data loader' if model_idx is None else
+                        'worker of model {}'.format(model_idx), results))
+                model_results = pending.setdefault(batch_idx,
+                                                   [None] * num_models)
+                model_results[model_idx] = results
+                if any(r is None for r in model_results):
+                    continue
+                del pending[batch_idx]
+                batch_results[batch_idx] = self._merge(model_results)
+                num_done += 1
+                if callback is not None:
+                    callback(batch_idx, batch_results[batch_idx])
+        finally:
+            stop.set()
+            if num_done < num_batches:
+                # the workers may be stuck with the batches of this run
+                self.close(terminate=True)
+            feeder.join()
+        return [result for results in batch_results for result in results]
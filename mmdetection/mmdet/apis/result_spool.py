@@ -0,0 +1,281 @@
+import glob
+import os
+import os.path as osp
+import pickle
+import re
+import shutil
+import tempfile
+
+import mmcv
+import torch
+import torch.distributed as dist
+from mmcv.runner import get_dist_info
+from torch.utils.data import DataLoader, Sampler
+
+
+class _IndexSampler(Sampler):
+    """Samples the given dataset indices, in order."""
+
+    def __init__(self, indices):
+        self.indices = indices
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class ResultSpool(object):
+    """Test results spooled to disk by chunks, by every rank.
+
+    Each rank appends the results of its images with :meth:`add`, they are
+    written every ``chunk_size`` images to a chunk file of the rank
+    (``rank{r}_{k}.pkl``, written to a temporary file and renamed, so that a
+    chunk is either complete or missing). A chunk holds two pickles, the
+    dataset indices then the results, so the indices done are read without
+    loading the results. Rank 0 merges the chunks of all the ranks in
+    dataset order with :meth:`iter_results`, loading a chunk when its first
+    result is needed and dropping it after its last one.
+
+    The spool of a killed test is resumed by testing only the images not in
+    :meth:`done_indices`, whatever the number of ranks of both runs.
+
+    Args:
+        spool_dir (str): directory of the chunks, created if needed.
+        num_images (int): size of the dataset, a spool of another size is
+            an error.
+        rank (int): rank writing the chunks.
+        chunk_size (int): number of results per chunk.
+    """
+
+    def __init__(self, spool_dir, num_images, rank=0, chunk_size=32):
+        self.spool_dir = spool_dir
+        self.num_images = num_images
+        self.rank = rank
+        self.chunk_size = chunk_size
+        mmcv.mkdir_or_exist(spool_dir)
+        self._check_meta()
+        self._buffer = []
+        chunk_ids = [
+            int(re.match(r'rank\d+_(\d+)\.pkl$', osp.basename(f)).group(1))
+            for f in glob.glob(
+                osp.join(spool_dir, 'rank{}_*.pkl'.format(rank)))
+        ]
+        self._next_chunk = max(chunk_ids) + 1 if chunk_ids else 0
+
+    def _check_meta(self):
+        meta_file = osp.join(self.spool_dir, 'spool.json')
+        meta = dict(num_images=self.num_images)
+        if osp.isfile(meta_file):
+            if mmcv.load(meta_file) != meta:
+                raise ValueError(
+                    '{} holds the results of another dataset ({}), remove it '
+                    'or use another directory'.format(
+                        self.spool_dir, mmcv.load(meta_file)))
+        elif self.rank == 0:
+            tmp_file = '{}.tmp{}'.format(meta_file, os.getpid())
+            mmcv.dump(meta, tmp_file, file_format='json')
+            os.replace(tmp_file, meta_file)
+
+    def _chunk_files(self):
+        return sorted(glob.glob(osp.join(self.spool_dir, 'rank*_*.pkl')))
+
+    def add(self, idx, result):
+        """Add the result of image ``idx`` of the dataset."""
+        self._buffer.append((idx, result))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the results added since the last chunk."""
+        if not self._buffer:
+            return
+        indices, results = zip(*self._buffer)
+        chunk_file = osp.join(
+            self.spool_dir, 'rank{}_{:06d}.pkl'.format(self.rank,
+                                                       self._next_chunk))
+        tmp_file = chunk_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(list(indices), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(list(results), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, chunk_file)
+        self._next_chunk += 1
+        self._buffer = []
+
+    def _chunk_indices(self):
+        chunk_indices = {}
+        for chunk_file in self._chunk_files():
+            with open(chunk_file, 'rb') as f:
+                chunk_indices[chunk_file] = pickle.load(f)
+        return chunk_indices
+
+    def done_indices(self):
+        """Indices of the images whose result is in a chunk."""
+        return {
+            idx
+            for indices in self._chunk_indices().values() for idx in indices
+        }
+
+    def iter_results(self):
+        """Results of all the images, in dataset order.
+
+        Raises:
+            ValueError: if an image has no result.
+        """
+        location = [None] * self.num_images
+        remaining = {}
+        for chunk_file, indices in self._chunk_indices().items():
+            remaining[chunk_file] = 0
+            for i, idx in enumerate(indices):
+                # images padded by the sampler may be tested twice
+                if location[idx] is None:
+                    location[idx] = (chunk_file, i)
+                    remaining[chunk_file] += 1
+        missing = [idx for idx, loc in enumerate(location) if loc is None]
+        if missing:
+            raise ValueError('{} images have no result in {}, e.g. {}'.format(
+                len(missing), self.spool_dir, missing[:10]))
+        loaded = {}
+        for chunk_file, i in location:
+            if chunk_file not in loaded:
+                with open(chunk_file, 'rb') as f:
+                    pickle.load(f)
+                    loaded[chunk_file] = pickle.load(f)
+            yield loaded[chunk_file][i]
+            remaining[chunk_file] -= 1
+            if remaining[chunk_file] == 0:
+                del loaded[chunk_file]
+
+    def remove(self):
+        shutil.rmtree(self.spool_dir)
+
+
+def get_spool_dir(tmpdir=None):
+    """``tmpdir``, or a temporary directory created by rank 0 and broadcast
+    to the other ranks."""
+    if tmpdir is not None:
+        return tmpdir
+    rank, world_size = get_dist_info()
+    if world_size == 1:
+        return tempfile.mkdtemp()
+    MAX_LEN = 512
+    # 32 is whitespace
+    dir_tensor = torch.full((MAX_LEN, ), 32, dtype=torch.uint8, device='cuda')
+    if rank == 0:
+        tmpdir = tempfile.mkdtemp()
+        tmpdir = torch.tensor(
+            bytearray(tmpdir.encode()), dtype=torch.uint8, device='cuda')
+        dir_tensor[:len(tmpdir)] = tmpdir
+    dist.broadcast(dir_tensor, 0)
+    return dir_tensor.cpu().numpy().tobytes().decode().rstrip()
+
+
+def pending_loader(data_loader, spool):
+    """A loader like ``data_loader`` over the images of this rank not done
+    yet in ``spool``.
+
+    The images not done are split between the ranks like the
+    ``DistributedSampler`` of the test loaders (every ``world_size``-th
+    image), but without padding.
+
+    Returns:
+        tuple: (data loader, dataset indices of its images in order).
+    """
+    rank, world_size = get_dist_info()
+    done = spool.done_indices()
+    if world_size > 1:
+        # every rank reads the chunks before any rank writes a new one, so
+        # they split the same images
+        dist.barrier()
+    pending = [
+        idx for idx in range(len(data_loader.dataset)) if idx not in done
+    ]
+    indices = pending[rank::world_size]
+    loader = DataLoader(
+        data_loader.dataset,
+        batch_size=data_loader.batch_size,
+        sampler=_IndexSampler(indices),
+        num_workers=data_loader.num_workers,
+        collate_fn=data_loader.collate_fn,
+        pin_memory=data_loader.pin_memory)
+    return loader, indices
+
+
+class SpooledResults(object):
+    """Results of a spool in dataset order, read chunk by chunk while they
+    are iterated (:meth:`ResultSpool.iter_results`), e.g. by
+    :func:`dump_results`.
+
+    Args:
+        spool (ResultSpool): the spool, complete.
+        remove (bool): remove the spool once the results are iterated (or
+            on :meth:`close`), e.g. a temporary one.
+    """
+
+    def __init__(self, spool, remove=False):
+        self.spool = spool
+        self.remove = remove
+
+    def __len__(self):
+        return self.spool.num_images
+
+    def __iter__(self):
+        for result in self.spool.iter_results():
+            yield result
+        self.close()
+
+    def close(self):
+        """Remove the spool if ``remove``, the results are not read again.
+        """
+        if self.remove and osp.isdir(self.spool.spool_dir):
+            self.spool.remove()
+
+
+def collect_spooled_results(spool, remove=False):
+    """Flush the chunks of every rank, then merge them on rank 0.
+
+    Args:
+        spool (ResultSpool): spool of this rank.
+        remove (bool): see :class:`SpooledResults`.
+
+    Returns:
+        SpooledResults: results of the dataset on rank 0, None on the other
+            ranks. Call ``list()`` on them to keep them all in memory.
+    """
+    spool.flush()
+    _, world_size = get_dist_info()
+    if world_size > 1:
+        dist.barrier()
+    if spool.rank != 0:
+        return None
+    return SpooledResults(spool, remove)
+
+
+def dump_results(results, out_file):
+    """Write results (a list or any iterable, e.g. :class:`SpooledResults`)
+    to a pickle file of their list, one at a time.
+
+    The file is that of ``mmcv.dump(list(results), out_file)`` (it is read
+    with ``mmcv.load``), but the list is written as its pickle opcodes: an
+    empty list, then each result pickled alone and appended. Protocol 3
+    names its memo entries explicitly, so the results do not share them.
+    The file is written to a temporary file and renamed, it is either
+    complete or missing.
+
+    Returns:
+        int: number of results written.
+    """
+    tmp_file = '{}.tmp{}'.format(out_file, os.getpid())
+    num_results = 0
+    with open(tmp_file, 'wb') as f:
+        f.write(pickle.PROTO + b'\x03' + pickle.EMPTY_LIST)
+        for result in results:
+            data = pickle.dumps(result, protocol=3)
+            # without its PROTO header and STOP
+            f.write(data[2:-1])
+            f.write(pickle.APPEND)
+            num_results += 1
+        f.write(pickle.STOP)
+    os.replace(tmp_file, out_file)
+    return num_results
@@ -4,7 +4,8 @@ from .class_names import (voc_classes, imagenet_det_classes,
 from .coco_utils import coco_eval, fast_eval_recall, results2json
 from .eval_hooks import (DistEvalHook, DistEvalmAPHook, CocoDistEvalRecallHook,
                          CocoDistEvalmAPHook)
-from .mean_ap import average_precision, eval_map, print_map_summary
+from .mean_ap import (average_precision, eval_map, eval_tpfp, accumulate_map,
+                      print_map_summary)
 from .recall import (eval_recalls, print_recall_summary, plot_num_recall,
                      plot_iou_recall)
 
@@ -13,6 +14,7 @@ __all__ = [
     'coco_classes', 'dataset_aliases', 'get_classes', 'coco_eval',
     'fast_eval_recall', 'results2json', 'DistEvalHook', 'DistEvalmAPHook',
     'CocoDistEvalRecallHook', 'CocoDistEvalmAPHook', 'average_precision',
-    'eval_map', 'print_map_summary', 'eval_recalls', 'print_recall_summary',
-    'plot_num_recall', 'plot_iou_recall'
+    'eval_map', 'eval_tpfp', 'accumulate_map', 'print_map_summary',
+    'eval_recalls', 'print_recall_summary', 'plot_num_recall',
+    'plot_iou_recall'
 ]
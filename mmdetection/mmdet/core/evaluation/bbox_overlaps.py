@@ -20,30 +20,22 @@ def bbox_overlaps(bboxes1, bboxes2, mode='iou'):
     bboxes2 = bboxes2.astype(np.float32)
     rows = bboxes1.shape[0]
     cols = bboxes2.shape[0]
-    ious = np.zeros((rows, cols), dtype=np.float32)
     if rows * cols == 0:
-        return ious
-    exchange = False
-    if bboxes1.shape[0] > bboxes2.shape[0]:
-        bboxes1, bboxes2 = bboxes2, bboxes1
-        ious = np.zeros((cols, rows), dtype=np.float32)
-        exchange = True
+        return np.zeros((rows, cols), dtype=np.float32)
     area1 = (bboxes1[:, 2] - bboxes1[:, 0] + 1) * (
         bboxes1[:, 3] - bboxes1[:, 1] + 1)
     area2 = (bboxes2[:, 2] - bboxes2[:, 0] + 1) * (
         bboxes2[:, 3] - bboxes2[:, 1] + 1)
-    for i in range(bboxes1.shape[0]):
-        x_start = np.maximum(bboxes1[i, 0], bboxes2[:, 0])
-        y_start = np.maximum(bboxes1[i, 1], bboxes2[:, 1])
-        x_end = np.minimum(bboxes1[i, 2], bboxes2[:, 2])
-        y_end = np.minimum(bboxes1[i, 3], bboxes2[:, 3])
-        overlap = np.maximum(x_end - x_start + 1, 0) * np.maximum(
-            y_end - y_start + 1, 0)
-        if mode == 'iou':
-            union = area1[i] + area2 - overlap
-        else:
-            union = area1[i] if not exchange else area2
-        ious[i, :] = overlap / union
-    if exchange:
-        ious = ious.T
-    return ious
+    # broadcast (rows, 1) against (cols, ), with the float32 operations of
+    # a loop over the rows, so the ious are the same to the last bit
+    x_start = np.maximum(bboxes1[:, None, 0], bboxes2[:, 0])
+    y_start = np.maximum(bboxes1[:, None, 1], bboxes2[:, 1])
+    x_end = np.minimum(bboxes1[:, None, 2], bboxes2[:, 2])
+    y_end = np.minimum(bboxes1[:, None, 3], bboxes2[:, 3])
+    overlap = np.maximum(x_end - x_start + 1, 0) * np.maximum(
+        y_end - y_start + 1, 0)
+    if mode == 'iou':
+        union = area1[:, None] + area2 - overlap
+    else:
+        union = area1[:, None]
+    return overlap / union
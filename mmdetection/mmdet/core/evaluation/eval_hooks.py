@@ -11,7 +11,7 @@ from pycocotools.cocoeval import COCOeval
 from torch.utils.data import Dataset
 
 from .coco_utils import results2json, fast_eval_recall
-from .mean_ap import eval_map
+from .mean_ap import accumulate_map, eval_map, eval_tpfp
 from mmdet import datasets
 
 
@@ -29,14 +29,13 @@ class DistEvalHook(Hook):
                     type(dataset)))
         self.interval = interval
 
-    def after_train_epoch(self, runner):
-        if not self.every_n_epochs(runner, self.interval):
-            return
-        runner.model.eval()
-        results = [None for _ in range(len(self.dataset))]
+    def _test(self, runner, inds):
+        """Results of the images ``inds`` of the dataset, tested by this
+        rank, the progress of all the ranks is shown by rank 0."""
+        results = []
         if runner.rank == 0:
             prog_bar = mmcv.ProgressBar(len(self.dataset))
-        for idx in range(runner.rank, len(self.dataset), runner.world_size):
+        for idx in inds:
             data = self.dataset[idx]
             data_gpu = scatter(
                 collate([data], samples_per_gpu=1),
@@ -46,12 +45,22 @@ class DistEvalHook(Hook):
             with torch.no_grad():
                 result = runner.model(
                     return_loss=False, rescale=True, **data_gpu)
-            results[idx] = result
+            results.append(result)
 
             batch_size = runner.world_size
             if runner.rank == 0:
                 for _ in range(batch_size):
                     prog_bar.update()
+        return results
+
+    def after_train_epoch(self, runner):
+        if not self.every_n_epochs(runner, self.interval):
+            return
+        runner.model.eval()
+        results = [None for _ in range(len(self.dataset))]
+        inds = range(runner.rank, len(self.dataset), runner.world_size)
+        for idx, result in zip(inds, self._test(runner, inds)):
+            results[idx] = result
 
         if runner.rank == 0:
             print('\n')
@@ -74,31 +83,148 @@ class DistEvalHook(Hook):
         raise NotImplementedError
 
 
+def _dist_device():
+    """Device of the tensors of the collectives: the current GPU with NCCL,
+    which only handles CUDA tensors, the CPU with the other backends."""
+    if dist.get_backend() == 'nccl':
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device('cpu')
+
+
+def _all_gather_rows(array, world_size):
+    """Rows of a float64 array of every rank, of any number of rows,
+    gathered by all_gather of tensors (padded to the same size)."""
+    device = _dist_device()
+    tensor = torch.from_numpy(array).to(device)
+    num_rows = torch.tensor([tensor.shape[0]], device=device)
+    all_num_rows = [torch.zeros_like(num_rows) for _ in range(world_size)]
+    dist.all_gather(all_num_rows, num_rows)
+    all_num_rows = [int(n.item()) for n in all_num_rows]
+    padded = tensor.new_zeros((max(all_num_rows), tensor.shape[1]))
+    padded[:tensor.shape[0]] = tensor
+    gathered = [torch.empty_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    return np.vstack([
+        rows[:n].cpu().numpy() for rows, n in zip(gathered, all_num_rows)
+    ])
+
+
 class DistEvalmAPHook(DistEvalHook):
+    """mAP of the validation set, evaluated by all the ranks.
 
-    def evaluate(self, runner, results):
+    Each rank tests its images and calculates their tp and fp
+    (:func:`eval_tpfp`), then only the label, image index, score, tp and fp
+    of each det bbox and the gt numbers are gathered, as tensors. Rank 0
+    merges them and accumulates the mAP (:func:`accumulate_map`), the same
+    as that of :func:`eval_map` on the results of all the images.
+
+    Args:
+        dataset (Dataset or dict): validation dataset.
+        interval (int): evaluation interval, in epochs.
+        nproc (int): number of processes calculating the tp and fp of the
+            classes, on each rank.
+    """
+
+    def __init__(self, dataset, interval=1, nproc=1):
+        super(DistEvalmAPHook, self).__init__(dataset, interval=interval)
+        self.nproc = nproc
+
+    def _get_gts(self, inds):
         gt_bboxes = []
         gt_labels = []
         gt_ignore = [] if self.dataset.with_crowd else None
-        for i in range(len(self.dataset)):
+        for i in inds:
             ann = self.dataset.get_ann_info(i)
             bboxes = ann['bboxes']
             labels = ann['labels']
             if gt_ignore is not None:
                 ignore = np.concatenate([
-                    np.zeros(bboxes.shape[0], dtype=np.bool),
-                    np.ones(ann['bboxes_ignore'].shape[0], dtype=np.bool)
+                    np.zeros(bboxes.shape[0], dtype=bool),
+                    np.ones(ann['bboxes_ignore'].shape[0], dtype=bool)
                 ])
                 gt_ignore.append(ignore)
                 bboxes = np.vstack([bboxes, ann['bboxes_ignore']])
                 labels = np.concatenate([labels, ann['labels_ignore']])
             gt_bboxes.append(bboxes)
             gt_labels.append(labels)
+        return gt_bboxes, gt_labels, gt_ignore
+
+    def _dataset_name(self):
         # If the dataset is VOC2007, then use 11 points mAP evaluation.
         if hasattr(self.dataset, 'year') and self.dataset.year == 2007:
-            ds_name = 'voc07'
+            return 'voc07'
+        return self.dataset.CLASSES
+
+    def _gather_tpfps(self, cls_tpfps, inds, runner):
+        """Merge the tp and fp of the images of every rank, on rank 0.
+
+        The det bboxes are gathered as rows of (label, image index, score,
+        tp, fp), sorted by label and image index like those of the results
+        of all the images.
+        """
+        num_classes = len(self.dataset.CLASSES)
+        inds = np.array(inds, dtype=np.int64)
+        rows = [np.zeros((0, 5))]
+        num_gts = np.zeros(num_classes, dtype=np.int64)
+        for label, (img_inds, scores, tp, fp, cls_num_gts) in enumerate(
+                cls_tpfps):
+            rows.append(
+                np.column_stack([
+                    np.full(len(scores), label), inds[img_inds], scores,
+                    tp[0], fp[0]
+                ]))
+            num_gts[label] = cls_num_gts[0]
+        rows = _all_gather_rows(np.vstack(rows), runner.world_size)
+        num_gts = torch.from_numpy(num_gts).to(_dist_device())
+        dist.all_reduce(num_gts)
+        if runner.rank != 0:
+            return None
+        num_gts = num_gts.cpu().numpy()
+        # stable, the det bboxes of an image stay in the order of its result
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+        bounds = np.searchsorted(rows[:, 0], np.arange(num_classes + 1))
+        cls_tpfps = []
+        for label in range(num_classes):
+            cls_rows = rows[bounds[label]:bounds[label + 1]]
+            # the scores of the results of the detectors are float32
+            cls_tpfps.append(
+                (cls_rows[:, 1].astype(np.int64),
+                 cls_rows[:, 2].astype(np.float32),
+                 cls_rows[None, :, 3].astype(np.float32),
+                 cls_rows[None, :, 4].astype(np.float32),
+                 num_gts[label:label + 1]))
+        return cls_tpfps
+
+    def after_train_epoch(self, runner):
+        if not self.every_n_epochs(runner, self.interval):
+            return
+        runner.model.eval()
+        inds = range(runner.rank, len(self.dataset), runner.world_size)
+        results = self._test(runner, inds)
+        if results:
+            gt_bboxes, gt_labels, gt_ignore = self._get_gts(inds)
+            cls_tpfps = eval_tpfp(
+                results,
+                gt_bboxes,
+                gt_labels,
+                gt_ignore=gt_ignore,
+                scale_ranges=None,
+                iou_thr=0.5,
+                dataset=self._dataset_name(),
+                nproc=self.nproc)
         else:
-            ds_name = self.dataset.CLASSES
+            cls_tpfps = []
+        cls_tpfps = self._gather_tpfps(cls_tpfps, inds, runner)
+        if runner.rank == 0:
+            print('\n')
+            mean_ap, _ = accumulate_map(
+                cls_tpfps, dataset=self._dataset_name(), print_summary=True)
+            runner.log_buffer.output['mAP'] = mean_ap
+            runner.log_buffer.ready = True
+
+    def evaluate(self, runner, results):
+        gt_bboxes, gt_labels, gt_ignore = self._get_gts(
+            range(len(self.dataset)))
         mean_ap, eval_results = eval_map(
             results,
             gt_bboxes,
@@ -106,8 +232,9 @@ class DistEvalmAPHook(DistEvalHook):
             gt_ignore=gt_ignore,
             scale_ranges=None,
             iou_thr=0.5,
-            dataset=ds_name,
-            print_summary=True)
+            dataset=self._dataset_name(),
+            print_summary=True,
+            nproc=self.nproc)
         runner.log_buffer.output['mAP'] = mean_ap
         runner.log_buffer.ready = True
 
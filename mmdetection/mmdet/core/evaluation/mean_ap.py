@@ -1,3 +1,5 @@
+from multiprocessing import Pool
+
 import mmcv
 import numpy as np
 from terminaltables import AsciiTable
@@ -32,8 +34,8 @@ def average_precision(recalls, precisions, mode='area'):
         ones = np.ones((num_scales, 1), dtype=recalls.dtype)
         mrec = np.hstack((zeros, recalls, ones))
         mpre = np.hstack((zeros, precisions, zeros))
-        for i in range(mpre.shape[1] - 1, 0, -1):
-            mpre[:, i - 1] = np.maximum(mpre[:, i - 1], mpre[:, i])
+        # precision envelope, the max of the precisions at higher recalls
+        mpre = np.maximum.accumulate(mpre[:, ::-1], axis=1)[:, ::-1]
         for i in range(num_scales):
             ind = np.where(mrec[i, 1:] != mrec[i, :-1])[0]
             ap[i] = np.sum(
@@ -95,42 +97,43 @@ def tpfp_imagenet(det_bboxes,
                           default_iou_thr)
     # sort all detections by scores in descending order
     sort_inds = np.argsort(-det_bboxes[:, -1])
+    # different from PASCAL VOC: a det bbox matches its best overlapped gt
+    # among those not matched yet by a det bbox of higher score, so each
+    # match depends on the previous ones, but not on the area range.
+    # Only the det bboxes with a gt over the threshold are visited.
+    valid = ious >= iou_thrs
+    matched_gt = np.full(num_dets, -1, dtype=np.int64)
+    gt_covered = np.zeros(num_gts, dtype=bool)
+    for i in sort_inds[valid[sort_inds].any(axis=1)]:
+        available = valid[i] & ~gt_covered
+        if available.any():
+            # the first gt of max iou, like a strict > over the gts
+            j = np.where(available, ious[i], -1).argmax()
+            matched_gt[i] = j
+            gt_covered[j] = True
+    matched = matched_gt >= 0
+    if area_ranges != [(None, None)]:
+        det_areas = (det_bboxes[:, 2] - det_bboxes[:, 0] + 1) * (
+            det_bboxes[:, 3] - det_bboxes[:, 1] + 1)
     for k, (min_area, max_area) in enumerate(area_ranges):
-        gt_covered = np.zeros(num_gts, dtype=bool)
         # if no area range is specified, gt_area_ignore is all False
         if min_area is None:
             gt_area_ignore = np.zeros_like(gt_ignore, dtype=bool)
         else:
             gt_areas = gt_w * gt_h
             gt_area_ignore = (gt_areas < min_area) | (gt_areas >= max_area)
-        for i in sort_inds:
-            max_iou = -1
-            matched_gt = -1
-            # find best overlapped available gt
-            for j in range(num_gts):
-                # different from PASCAL VOC: allow finding other gts if the
-                # best overlaped ones are already matched by other det bboxes
-                if gt_covered[j]:
-                    continue
-                elif ious[i, j] >= iou_thrs[j] and ious[i, j] > max_iou:
-                    max_iou = ious[i, j]
-                    matched_gt = j
-            # there are 4 cases for a det bbox:
-            # 1. it matches a gt, tp = 1, fp = 0
-            # 2. it matches an ignored gt, tp = 0, fp = 0
-            # 3. it matches no gt and within area range, tp = 0, fp = 1
-            # 4. it matches no gt but is beyond area range, tp = 0, fp = 0
-            if matched_gt >= 0:
-                gt_covered[matched_gt] = 1
-                if not (gt_ignore[matched_gt] or gt_area_ignore[matched_gt]):
-                    tp[k, i] = 1
-            elif min_area is None:
-                fp[k, i] = 1
-            else:
-                bbox = det_bboxes[i, :4]
-                area = (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
-                if area >= min_area and area < max_area:
-                    fp[k, i] = 1
+        gt_ignored = gt_ignore.astype(bool) | gt_area_ignore
+        # there are 4 cases for a det bbox:
+        # 1. it matches a gt, tp = 1, fp = 0
+        # 2. it matches an ignored gt, tp = 0, fp = 0
+        # 3. it matches no gt and within area range, tp = 0, fp = 1
+        # 4. it matches no gt but is beyond area range, tp = 0, fp = 0
+        tp[k, matched & ~gt_ignored[matched_gt]] = 1
+        if min_area is None:
+            fp[k, ~matched] = 1
+        else:
+            fp[k, ~matched & (det_areas >= min_area) &
+               (det_areas < max_area)] = 1
     return tp, fp
 
 
@@ -147,7 +150,6 @@ def tpfp_default(det_bboxes, gt_bboxes, gt_ignore, iou_thr, area_ranges=None):
         tuple: (tp, fp), two arrays whose elements are 0 and 1
     """
     num_dets = det_bboxes.shape[0]
-    num_gts = gt_bboxes.shape[0]
     if area_ranges is None:
         area_ranges = [(None, None)]
     num_scales = len(area_ranges)
@@ -170,8 +172,18 @@ def tpfp_default(det_bboxes, gt_bboxes, gt_ignore, iou_thr, area_ranges=None):
     ious_max = ious.max(axis=1)
     ious_argmax = ious.argmax(axis=1)
     sort_inds = np.argsort(-det_bboxes[:, -1])
+    # a det bbox over the threshold matches its best overlapped gt, it is
+    # a tp if it is the first one of the score order to match it, else a
+    # fp, whatever the area range
+    matched = ious_max >= iou_thr
+    matched_inds = sort_inds[matched[sort_inds]]
+    _, first = np.unique(ious_argmax[matched_inds], return_index=True)
+    is_first = np.zeros(num_dets, dtype=bool)
+    is_first[matched_inds[first]] = True
+    if area_ranges != [(None, None)]:
+        det_areas = (det_bboxes[:, 2] - det_bboxes[:, 0] + 1) * (
+            det_bboxes[:, 3] - det_bboxes[:, 1] + 1)
     for k, (min_area, max_area) in enumerate(area_ranges):
-        gt_covered = np.zeros(num_gts, dtype=bool)
         # if no area range is specified, gt_area_ignore is all False
         if min_area is None:
             gt_area_ignore = np.zeros_like(gt_ignore, dtype=bool)
@@ -179,23 +191,16 @@ def tpfp_default(det_bboxes, gt_bboxes, gt_ignore, iou_thr, area_ranges=None):
             gt_areas = (gt_bboxes[:, 2] - gt_bboxes[:, 0] + 1) * (
                 gt_bboxes[:, 3] - gt_bboxes[:, 1] + 1)
             gt_area_ignore = (gt_areas < min_area) | (gt_areas >= max_area)
-        for i in sort_inds:
-            if ious_max[i] >= iou_thr:
-                matched_gt = ious_argmax[i]
-                if not (gt_ignore[matched_gt] or gt_area_ignore[matched_gt]):
-                    if not gt_covered[matched_gt]:
-                        gt_covered[matched_gt] = True
-                        tp[k, i] = 1
-                    else:
-                        fp[k, i] = 1
-                # otherwise ignore this detected bbox, tp = 0, fp = 0
-            elif min_area is None:
-                fp[k, i] = 1
-            else:
-                bbox = det_bboxes[i, :4]
-                area = (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
-                if area >= min_area and area < max_area:
-                    fp[k, i] = 1
+        # det bboxes matching an ignored gt are ignored, tp = 0, fp = 0
+        counted = matched & ~(
+            gt_ignore.astype(bool) | gt_area_ignore)[ious_argmax]
+        tp[k, counted & is_first] = 1
+        fp[k, counted & ~is_first] = 1
+        if min_area is None:
+            fp[k, ~matched] = 1
+        else:
+            fp[k, ~matched & (det_areas >= min_area) &
+               (det_areas < max_area)] = 1
     return tp, fp
 
 
@@ -217,15 +222,100 @@ def get_cls_results(det_results, gt_bboxes, gt_labels, gt_ignore, class_id):
     return cls_dets, cls_gts, cls_gt_ignore
 
 
-def eval_map(det_results,
-             gt_bboxes,
-             gt_labels,
-             gt_ignore=None,
-             scale_ranges=None,
-             iou_thr=0.5,
-             dataset=None,
-             print_summary=True):
-    """Evaluate mAP of a dataset.
+def _group_dets(det_results, num_classes):
+    """Det bboxes of each class, by image.
+
+    Returns:
+        tuple: for each class, ``{img_idx: det_bboxes}`` of the images with
+            det bboxes of this class, in image order, and the dtype of all
+            its det bboxes stacked, the empty ones included.
+    """
+    cls_dets = [dict() for _ in range(num_classes)]
+    cls_dtypes = [set() for _ in range(num_classes)]
+    for j, dets in enumerate(det_results):
+        for i, det in enumerate(dets):
+            if det.shape[0] > 0:
+                cls_dets[i][j] = det
+            cls_dtypes[i].add(det.dtype)
+    return cls_dets, [np.result_type(*dtypes) for dtypes in cls_dtypes]
+
+
+def _group_gts(gt_bboxes, gt_labels, gt_ignore, num_classes):
+    """Gt bboxes and ignore indicators of each class, by image.
+
+    Returns:
+        list[dict]: for each class, ``{img_idx: (bboxes, ignore)}`` of the
+            images with gts of this class, in image order.
+    """
+    cls_gts = [dict() for _ in range(num_classes)]
+    for j, (bboxes, labels) in enumerate(zip(gt_bboxes, gt_labels)):
+        if bboxes.shape[0] == 0:
+            continue
+        for label in np.unique(labels):
+            if not 1 <= label <= num_classes:
+                continue
+            cls_inds = labels == label
+            if gt_ignore is None:
+                ignore = np.zeros(np.count_nonzero(cls_inds), dtype=np.int32)
+            else:
+                ignore = gt_ignore[j][cls_inds]
+            cls_gts[label - 1][j] = (bboxes[cls_inds, :], ignore)
+    return cls_gts
+
+
+def _cls_tpfp(args):
+    """TP and FP of the det bboxes of a class, in image order.
+
+    The det bboxes of the class are given for the images with some, the
+    tp and fp of the other images are empty.
+    """
+    cls_dets, det_dtype, cls_gts, tpfp_func, iou_thr, area_ranges = args
+    num_scales = len(area_ranges) if area_ranges is not None else 1
+    no_gts = (np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int32))
+    # calculate tp and fp for each image
+    img_inds = [np.zeros(0, dtype=np.int64)]
+    tp = [np.zeros((num_scales, 0), dtype=np.float32)]
+    fp = [np.zeros((num_scales, 0), dtype=np.float32)]
+    for j, dets in cls_dets.items():
+        gts, ignore = cls_gts.get(j, no_gts)
+        img_tp, img_fp = tpfp_func(dets, gts, ignore, iou_thr, area_ranges)
+        img_inds.append(np.full(dets.shape[0], j, dtype=np.int64))
+        tp.append(img_tp)
+        fp.append(img_fp)
+    # calculate gt number of each scale, gts ignored or beyond scale
+    # are not counted
+    num_gts = np.zeros(num_scales, dtype=int)
+    for bbox, ignore in cls_gts.values():
+        if area_ranges is None:
+            num_gts[0] += np.sum(np.logical_not(ignore))
+        else:
+            gt_areas = (bbox[:, 2] - bbox[:, 0] + 1) * (
+                bbox[:, 3] - bbox[:, 1] + 1)
+            for k, (min_area, max_area) in enumerate(area_ranges):
+                num_gts[k] += np.sum(
+                    np.logical_not(ignore) & (gt_areas >= min_area) &
+                    (gt_areas < max_area))
+    scores = np.concatenate(
+        [np.zeros(0, dtype=det_dtype)] +
+        [dets[:, -1] for dets in cls_dets.values()]).astype(
+            det_dtype, copy=False)
+    return (np.concatenate(img_inds), scores, np.hstack(tp), np.hstack(fp),
+            num_gts)
+
+
+def eval_tpfp(det_results,
+              gt_bboxes,
+              gt_labels,
+              gt_ignore=None,
+              scale_ranges=None,
+              iou_thr=0.5,
+              dataset=None,
+              nproc=1):
+    """Calculate the tp and fp of the det bboxes of some images.
+
+    The tp and fp of disjoint sets of images (e.g. the shards of several
+    ranks) are merged by concatenating those of each class and sorting them
+    by image index (stable), then accumulated by :func:`accumulate_map`.
 
     Args:
         det_results (list): a list of list, [[cls1_det, cls2_det, ...], ...]
@@ -235,13 +325,14 @@ def eval_map(det_results,
         gt_ignore (list): gt ignore indicators of each image, a list of K array
         scale_ranges (list, optional): [(min1, max1), (min2, max2), ...]
         iou_thr (float): IoU threshold
-        dataset (None or str or list): dataset name or dataset classes, there
-            are minor differences in metrics for different datsets, e.g.
-            "voc07", "imagenet_det", etc.
-        print_summary (bool): whether to print the mAP summary
+        dataset (None or str or list): dataset name or dataset classes
+        nproc (int): number of processes evaluating the classes
 
     Returns:
-        tuple: (mAP, [dict, dict, ...])
+        list[tuple]: for each class, (img_inds, scores, tp, fp, num_gts),
+            the image index (in ``det_results``) and score of each det
+            bbox, in image order, its tp and fp of each scale of shape
+            (num_scales, num_dets) and the gt number of each scale.
     """
     assert len(det_results) == len(gt_bboxes) == len(gt_labels)
     if gt_ignore is not None:
@@ -250,43 +341,46 @@ def eval_map(det_results,
             assert len(gt_labels[i]) == len(gt_ignore[i])
     area_ranges = ([(rg[0]**2, rg[1]**2) for rg in scale_ranges]
                    if scale_ranges is not None else None)
-    num_scales = len(scale_ranges) if scale_ranges is not None else 1
-    eval_results = []
     num_classes = len(det_results[0])  # positive class num
     gt_labels = [
         label if label.ndim == 1 else label[:, 0] for label in gt_labels
     ]
-    for i in range(num_classes):
-        # get gt and det bboxes of this class
-        cls_dets, cls_gts, cls_gt_ignore = get_cls_results(
-            det_results, gt_bboxes, gt_labels, gt_ignore, i)
-        # calculate tp and fp for each image
-        tpfp_func = (
-            tpfp_imagenet if dataset in ['det', 'vid'] else tpfp_default)
-        tpfp = [
-            tpfp_func(cls_dets[j], cls_gts[j], cls_gt_ignore[j], iou_thr,
-                      area_ranges) for j in range(len(cls_dets))
-        ]
-        tp, fp = tuple(zip(*tpfp))
-        # calculate gt number of each scale, gts ignored or beyond scale
-        # are not counted
-        num_gts = np.zeros(num_scales, dtype=int)
-        for j, bbox in enumerate(cls_gts):
-            if area_ranges is None:
-                num_gts[0] += np.sum(np.logical_not(cls_gt_ignore[j]))
-            else:
-                gt_areas = (bbox[:, 2] - bbox[:, 0] + 1) * (
-                    bbox[:, 3] - bbox[:, 1] + 1)
-                for k, (min_area, max_area) in enumerate(area_ranges):
-                    num_gts[k] += np.sum(
-                        np.logical_not(cls_gt_ignore[j]) &
-                        (gt_areas >= min_area) & (gt_areas < max_area))
+    tpfp_func = tpfp_imagenet if dataset in ['det', 'vid'] else tpfp_default
+    cls_dets, cls_dtypes = _group_dets(det_results, num_classes)
+    cls_gts = _group_gts(gt_bboxes, gt_labels, gt_ignore, num_classes)
+    tasks = [(cls_dets[i], cls_dtypes[i], cls_gts[i], tpfp_func, iou_thr,
+              area_ranges) for i in range(num_classes)]
+    if nproc > 1:
+        with Pool(nproc) as pool:
+            return pool.map(_cls_tpfp, tasks, chunksize=1)
+    return [_cls_tpfp(task) for task in tasks]
+
+
+def accumulate_map(cls_tpfps,
+                   scale_ranges=None,
+                   dataset=None,
+                   print_summary=True):
+    """Calculate mAP from the tp and fp of each class.
+
+    Args:
+        cls_tpfps (list[tuple]): tp and fp of each class, see
+            :func:`eval_tpfp`.
+        scale_ranges (list, optional): [(min1, max1), (min2, max2), ...]
+        dataset (None or str or list): dataset name or dataset classes
+        print_summary (bool): whether to print the mAP summary
+
+    Returns:
+        tuple: (mAP, [dict, dict, ...])
+    """
+    num_scales = len(scale_ranges) if scale_ranges is not None else 1
+    mode = 'area' if dataset != 'voc07' else '11points'
+    eval_results = []
+    for _, scores, tp, fp, num_gts in cls_tpfps:
         # sort all det bboxes by score, also sort tp and fp
-        cls_dets = np.vstack(cls_dets)
-        num_dets = cls_dets.shape[0]
-        sort_inds = np.argsort(-cls_dets[:, -1])
-        tp = np.hstack(tp)[:, sort_inds]
-        fp = np.hstack(fp)[:, sort_inds]
+        num_dets = scores.shape[0]
+        sort_inds = np.argsort(-scores)
+        tp = tp[:, sort_inds]
+        fp = fp[:, sort_inds]
         # calculate recall and precision with tp and fp
         tp = np.cumsum(tp, axis=1)
         fp = np.cumsum(fp, axis=1)
@@ -298,7 +392,6 @@ def eval_map(det_results,
             recalls = recalls[0, :]
             precisions = precisions[0, :]
             num_gts = num_gts.item()
-        mode = 'area' if dataset != 'voc07' else '11points'
         ap = average_precision(recalls, precisions, mode)
         eval_results.append({
             'num_gts': num_gts,
@@ -329,6 +422,49 @@ def eval_map(det_results,
     return mean_ap, eval_results
 
 
+def eval_map(det_results,
+             gt_bboxes,
+             gt_labels,
+             gt_ignore=None,
+             scale_ranges=None,
+             iou_thr=0.5,
+             dataset=None,
+             print_summary=True,
+             nproc=1):
+    """Evaluate mAP of a dataset.
+
+    The tp and fp of the classes are calculated independently, by ``nproc``
+    processes.
+
+    Args:
+        det_results (list): a list of list, [[cls1_det, cls2_det, ...], ...]
+        gt_bboxes (list): ground truth bboxes of each image, a list of K*4
+            array.
+        gt_labels (list): ground truth labels of each image, a list of K array
+        gt_ignore (list): gt ignore indicators of each image, a list of K array
+        scale_ranges (list, optional): [(min1, max1), (min2, max2), ...]
+        iou_thr (float): IoU threshold
+        dataset (None or str or list): dataset name or dataset classes, there
+            are minor differences in metrics for different datsets, e.g.
+            "voc07", "imagenet_det", etc.
+        print_summary (bool): whether to print the mAP summary
+        nproc (int): number of processes evaluating the classes
+
+    Returns:
+        tuple: (mAP, [dict, dict, ...])
+    """
+    cls_tpfps = eval_tpfp(
+        det_results,
+        gt_bboxes,
+        gt_labels,
+        gt_ignore=gt_ignore,
+        scale_ranges=scale_ranges,
+        iou_thr=iou_thr,
+        dataset=dataset,
+        nproc=nproc)
+    return accumulate_map(cls_tpfps, scale_ranges, dataset, print_summary)
+
+
 def print_map_summary(mean_ap, results, dataset=None):
     """Print mAP and results of each class.
 
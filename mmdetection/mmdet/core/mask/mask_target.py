@@ -19,6 +19,12 @@ def mask_target_single(pos_proposals, pos_assigned_gt_inds, gt_masks, cfg):
     if num_pos > 0:
         proposals_np = pos_proposals.cpu().numpy()
         pos_assigned_gt_inds = pos_assigned_gt_inds.cpu().numpy()
+        if not isinstance(gt_masks, np.ndarray):
+            # RLEMasks, the targets of all the proposals at once
+            mask_targets = gt_masks.crop_and_resize(
+                proposals_np, pos_assigned_gt_inds, mask_size)
+            return torch.from_numpy(mask_targets).float().to(
+                pos_proposals.device)
         for i in range(num_pos):
             gt_mask = gt_masks[pos_assigned_gt_inds[i]]
             bbox = proposals_np[i, :].astype(np.int32)
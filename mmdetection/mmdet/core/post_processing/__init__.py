@@ -1,8 +1,10 @@
-from .bbox_nms import multiclass_nms
+from .bbox_nms import batched_nms, multiclass_nms
+from .box_fusion import fuse_bboxes, fuse_masks, fuse_results, flip_result
 from .merge_augs import (merge_aug_proposals, merge_aug_bboxes,
                          merge_aug_scores, merge_aug_masks)
 
 __all__ = [
-    'multiclass_nms', 'merge_aug_proposals', 'merge_aug_bboxes',
-    'merge_aug_scores', 'merge_aug_masks'
+    'batched_nms', 'multiclass_nms', 'merge_aug_proposals', 'merge_aug_bboxes',
+    'merge_aug_scores', 'merge_aug_masks', 'fuse_bboxes', 'fuse_masks',
+    'fuse_results', 'flip_result'
 ]
@@ -3,6 +3,78 @@ import torch
 from mmdet.ops.nms import nms_wrapper
 
 
+def batched_nms(bboxes, scores, labels, iou_thr, max_boxes_per_call=None):
+    """NMS of boxes of several classes at once, each class independently.
+
+    The boxes of each class are shifted by a class offset larger than the
+    extent of all the boxes, so that boxes of different classes never
+    overlap and a single NMS call handles all the classes. To bound the
+    quadratic cost of the op (and the offsets), classes are packed into
+    calls of at most ``max_boxes_per_call`` boxes (a class larger than that
+    gets its own call). On CPU the shifted boxes are in double precision,
+    so they are exactly the shifted float boxes and the kept boxes are the
+    same as with one call per class (up to the rounding of IoUs equal to
+    ``iou_thr``); the CUDA op only takes float boxes, so their coordinates
+    are rounded to the precision of the offsets.
+
+    Args:
+        bboxes (Tensor): shape (n, 4).
+        scores (Tensor): shape (n, ).
+        labels (Tensor): shape (n, ), class of each box, sorted.
+        iou_thr (float): NMS IoU threshold.
+        max_boxes_per_call (int): max number of boxes per NMS call, 4000 on
+            CUDA and 512 on CPU (where the op is sequential) by default.
+
+    Returns:
+        Tensor: indices of the kept boxes, sorted by class, and in each class
+            in the order of the NMS op.
+    """
+    if bboxes.numel() == 0:
+        return labels.new_zeros((0, ))
+    if max_boxes_per_call is None:
+        max_boxes_per_call = 4000 if bboxes.is_cuda else 512
+    num_classes = int(labels.max()) + 1
+    counts = torch.bincount(labels, minlength=num_classes).tolist()
+    # greedy packing of consecutive classes into calls, slot of each class
+    # in its call
+    group_sizes, slots = [], []
+    slot = 0
+    for count in counts:
+        if count == 0:
+            slots.append(0)
+            continue
+        if not group_sizes or group_sizes[-1] + count > max_boxes_per_call:
+            group_sizes.append(0)
+            slot = 0
+        slots.append(slot)
+        slot += 1
+        group_sizes[-1] += count
+    slots = labels.new_tensor(slots)
+
+    dtype = bboxes.dtype if bboxes.is_cuda else torch.float64
+    bboxes = bboxes.to(dtype)
+    # boxes of consecutive slots are apart by at least 1 pixel more than
+    # the extent of the boxes
+    extent = float(bboxes.max() - bboxes.min()) + 2
+    offsets = slots[labels].to(dtype) * extent
+    dets = torch.cat([bboxes + offsets[:, None], scores[:, None].to(dtype)],
+                     dim=1)
+    keep = []
+    start = 0
+    # labels are sorted, so the boxes of a call are contiguous
+    for size in group_sizes:
+        if size > 0:
+            _, group_keep = nms_wrapper.nms(dets[start:start + size], iou_thr)
+            keep.append(group_keep + start)
+        start += size
+    keep = torch.cat(keep)
+    # the op may keep the boxes of the classes of a call interleaved,
+    # classes are put back in order, stable within a class
+    _, order = (labels[keep] * len(keep) +
+                torch.arange(len(keep), device=keep.device)).sort()
+    return keep[order]
+
+
 def multiclass_nms(multi_bboxes,
                    multi_scores,
                    score_thr,
@@ -11,6 +83,10 @@ def multiclass_nms(multi_bboxes,
                    score_factors=None):
     """NMS for multi-class bboxes.
 
+    Boxes above ``score_thr`` of all the classes are selected at once, and
+    for ``nms`` (the default type) suppressed by :func:`batched_nms`, other
+    types (e.g. ``soft_nms``) are applied class by class.
+
     Args:
         multi_bboxes (Tensor): shape (n, #class*4) or (n, 4)
         multi_scores (Tensor): shape (n, #class)
@@ -27,38 +103,50 @@ def multiclass_nms(multi_bboxes,
             are 0-based.
     """
     num_classes = multi_scores.shape[1]
-    bboxes, labels = [], []
     nms_cfg_ = nms_cfg.copy()
     nms_type = nms_cfg_.pop('type', 'nms')
-    nms_op = getattr(nms_wrapper, nms_type)
-    for i in range(1, num_classes):
-        cls_inds = multi_scores[:, i] > score_thr
-        if not cls_inds.any():
-            continue
-        # get bboxes and scores of this class
-        if multi_bboxes.shape[1] == 4:
-            _bboxes = multi_bboxes[cls_inds, :]
-        else:
-            _bboxes = multi_bboxes[cls_inds, i * 4:(i + 1) * 4]
-        _scores = multi_scores[cls_inds, i]
-        if score_factors is not None:
-            _scores *= score_factors[cls_inds]
-        cls_dets = torch.cat([_bboxes, _scores[:, None]], dim=1)
-        cls_dets, _ = nms_op(cls_dets, **nms_cfg_)
-        cls_labels = multi_bboxes.new_full(
-            (cls_dets.shape[0], ), i - 1, dtype=torch.long)
-        bboxes.append(cls_dets)
-        labels.append(cls_labels)
-    if bboxes:
-        bboxes = torch.cat(bboxes)
-        labels = torch.cat(labels)
-        if bboxes.shape[0] > max_num:
-            _, inds = bboxes[:, -1].sort(descending=True)
-            inds = inds[:max_num]
-            bboxes = bboxes[inds]
-            labels = labels[inds]
+    max_boxes_per_call = nms_cfg_.pop('max_boxes_per_call', None)
+
+    # (class, box) of the candidates, sorted by class then box like the
+    # outputs of one NMS per class
+    valid = multi_scores[:, 1:].t() > score_thr
+    cls_inds, box_inds = torch.nonzero(valid).t()
+    if multi_bboxes.shape[1] == 4:
+        bboxes = multi_bboxes[box_inds]
+    else:
+        bboxes = multi_bboxes.view(-1, num_classes, 4)[box_inds, cls_inds + 1]
+    scores = multi_scores[box_inds, cls_inds + 1]
+    if score_factors is not None:
+        scores = scores * score_factors[box_inds]
+
+    if nms_type == 'nms':
+        keep = batched_nms(bboxes, scores, cls_inds,
+                           max_boxes_per_call=max_boxes_per_call, **nms_cfg_)
+        bboxes = torch.cat([bboxes[keep], scores[keep, None]], dim=1)
+        labels = cls_inds[keep]
     else:
-        bboxes = multi_bboxes.new_zeros((0, 5))
-        labels = multi_bboxes.new_zeros((0, ), dtype=torch.long)
+        nms_op = getattr(nms_wrapper, nms_type)
+        dets, labels = [], []
+        counts = torch.bincount(cls_inds, minlength=num_classes - 1).tolist()
+        start = 0
+        for i, count in enumerate(counts):
+            if count == 0:
+                continue
+            inds = slice(start, start + count)
+            start += count
+            cls_dets = torch.cat([bboxes[inds], scores[inds, None]], dim=1)
+            cls_dets, _ = nms_op(cls_dets, **nms_cfg_)
+            dets.append(cls_dets)
+            labels.append(cls_inds.new_full((cls_dets.shape[0], ), i))
+        if dets:
+            bboxes = torch.cat(dets)
+            labels = torch.cat(labels)
+        else:
+            bboxes = multi_bboxes.new_zeros((0, 5))
+            labels = multi_bboxes.new_zeros((0, ), dtype=torch.long)
 
+    if max_num > 0 and bboxes.shape[0] > max_num:
+        _, inds = bboxes[:, -1].topk(max_num)
+        bboxes = bboxes[inds]
+        labels = labels[inds]
     return bboxes, labels
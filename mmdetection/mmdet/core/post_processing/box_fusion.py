@@ -0,0 +1,255 @@
+import numpy as np
+import pycocotools.mask as mask_util
+
+from ..evaluation.bbox_overlaps import bbox_overlaps
+
+
+def _iou(bbox, bboxes):
+    """IoUs of a box with boxes, (n, ), same convention as bbox_overlaps."""
+    x1 = np.maximum(bbox[0], bboxes[:, 0])
+    y1 = np.maximum(bbox[1], bboxes[:, 1])
+    x2 = np.minimum(bbox[2], bboxes[:, 2])
+    y2 = np.minimum(bbox[3], bboxes[:, 3])
+    overlap = np.maximum(x2 - x1 + 1, 0) * np.maximum(y2 - y1 + 1, 0)
+    area = (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
+    areas = (bboxes[:, 2] - bboxes[:, 0] + 1) * (
+        bboxes[:, 3] - bboxes[:, 1] + 1)
+    return overlap / (area + areas - overlap)
+
+
+def _wbf_clusters(bboxes, weights, iou_thr):
+    """Clusters of weighted box fusion, boxes sorted by decreasing score.
+
+    A box joins the fused box it overlaps most if their IoU is above
+    ``iou_thr`` (the fused box, the average of its boxes by ``weights``, is
+    then updated), else it starts a new one.
+    """
+    clusters = []
+    fused = np.zeros((0, 4), dtype=np.float64)
+    for i in range(len(bboxes)):
+        if len(fused):
+            ious = _iou(bboxes[i], fused)
+            j = int(ious.argmax())
+            if ious[j] > iou_thr:
+                clusters[j].append(i)
+                members = clusters[j]
+                fused[j] = (weights[members, None] * bboxes[members]).sum(
+                    0) / max(weights[members].sum(), 1e-12)
+                continue
+        clusters.append([i])
+        fused = np.vstack([fused, bboxes[i:i + 1]])
+    return clusters
+
+
+def _soft_merge_clusters(bboxes, weights, iou_thr):
+    """Clusters of soft merging, boxes sorted by decreasing score.
+
+    Like NMS, the top box suppresses the boxes it overlaps by more than
+    ``iou_thr``, but they are merged into it instead of being discarded.
+    """
+    ious = bbox_overlaps(bboxes, bboxes)
+    remaining = np.ones(len(bboxes), dtype=bool)
+    clusters = []
+    for i in range(len(bboxes)):
+        if not remaining[i]:
+            continue
+        members = np.flatnonzero(remaining & (ious[i] > iou_thr))
+        members = np.union1d(members, [i])
+        remaining[members] = False
+        clusters.append(members.tolist())
+    return clusters
+
+
+def fuse_bboxes(dets,
+                labels,
+                run_inds,
+                run_weights,
+                method='wbf',
+                iou_thr=0.55,
+                skip_thr=0.):
+    """Fuse the detections of several runs (models, augmentations).
+
+    The boxes of each class are clustered (:func:`_wbf_clusters` or
+    :func:`_soft_merge_clusters`), a fused box is the average of its
+    cluster weighted by score and run weight, and its score is the average
+    over all the runs, weighted by run, of the best score of each run in the
+    cluster (0 for the runs without a box in it), so that boxes found by a
+    single run are down-weighted.
+
+    Args:
+        dets (ndarray): (n, 5) boxes and scores of all the runs.
+        labels (ndarray): (n, ) class of each box.
+        run_inds (ndarray): (n, ) run of each box.
+        run_weights (Sequence[float]): weight of each run.
+        method (str): 'wbf' or 'soft_merge'.
+        iou_thr (float): IoU threshold of the clusters.
+        skip_thr (float): boxes with lower scores are not fused.
+
+    Returns:
+        tuple: (fused dets (k, 5), their labels (k, ), the indices of the
+            boxes of each cluster).
+    """
+    assert method in ('wbf', 'soft_merge')
+    cluster_fn = _wbf_clusters if method == 'wbf' else _soft_merge_clusters
+    run_weights = np.asarray(run_weights, dtype=np.float64)
+    box_weights = run_weights[run_inds]
+    fused_dets, fused_labels, clusters = [], [], []
+    for label in np.unique(labels):
+        inds = np.flatnonzero((labels == label) & (dets[:, 4] >= skip_thr))
+        if len(inds) == 0:
+            continue
+        inds = inds[np.argsort(-dets[inds, 4], kind='mergesort')]
+        bboxes = dets[inds, :4].astype(np.float64)
+        scores = dets[inds, 4].astype(np.float64)
+        weights = scores * box_weights[inds]
+        for members in cluster_fn(bboxes, weights, iou_thr):
+            members = np.array(members)
+            bbox = (weights[members, None] * bboxes[members]).sum(0) / max(
+                weights[members].sum(), 1e-12)
+            best = np.zeros(len(run_weights))
+            np.maximum.at(best, run_inds[inds[members]], scores[members])
+            score = (best * run_weights).sum() / run_weights.sum()
+            fused_dets.append(np.append(bbox, score))
+            fused_labels.append(label)
+            clusters.append(inds[members])
+    if not fused_dets:
+        return (np.zeros((0, 5), dtype=np.float32),
+                np.zeros((0, ), dtype=np.int64), [])
+    return (np.array(fused_dets, dtype=np.float32),
+            np.array(fused_labels, dtype=np.int64), clusters)
+
+
+def fuse_masks(rles, weights, mask_thr=0.5):
+    """Average instance masks, weighted, and binarize at ``mask_thr``.
+
+    Args:
+        rles (list[dict]): COCO RLEs of the masks, of the same size.
+        weights (ndarray): weight of each mask.
+
+    Returns:
+        dict: COCO RLE of the fused mask.
+    """
+    if len(rles) == 1:
+        return rles[0]
+    h, w = rles[0]['size']
+    # the masks are decoded whole, but only the union of their boxes is
+    # averaged and thresholded
+    boxes = mask_util.toBbox(rles)
+    x1, y1 = np.floor(boxes[:, :2].min(0)).astype(int)
+    x2, y2 = np.ceil((boxes[:, :2] + boxes[:, 2:]).max(0)).astype(int)
+    if x2 <= x1 or y2 <= y1:
+        return rles[0]
+    weights = np.asarray(weights, dtype=np.float32) / np.sum(weights)
+    average = np.zeros((y2 - y1, x2 - x1), dtype=np.float32)
+    for rle, weight in zip(rles, weights):
+        average += weight * mask_util.decode(rle)[y1:y2, x1:x2]
+    mask = np.zeros((h, w), dtype=np.uint8, order='F')
+    mask[y1:y2, x1:x2] = average >= mask_thr
+    return mask_util.encode(mask)
+
+
+def flip_result(result, img_meta):
+    """Map the result of a horizontally flipped augmentation back to the
+    unflipped image.
+
+    ``simple_test`` with rescale only rescales its detections to the
+    original image, they stay mirrored when the input was flipped. Boxes
+    are flipped like :func:`bbox_mapping_back` (in the scaled image, then
+    rescaled) and masks like :func:`merge_aug_masks`.
+
+    Args:
+        result: bbox_result or (bbox_result, segm_result) of a flipped
+            augmentation, in the original image.
+        img_meta (dict): meta of the augmentation, with ``img_shape`` and
+            ``scale_factor``.
+
+    Returns:
+        The result in the unflipped image, same format.
+    """
+    with_mask = isinstance(result, tuple)
+    bbox_result = result[0] if with_mask else result
+    # flipped x = right - x in the original image
+    right = (img_meta['img_shape'][1] - 1) / img_meta['scale_factor']
+    flipped_bboxes = []
+    for bboxes in bbox_result:
+        flipped = bboxes.copy()
+        flipped[:, 0] = right - bboxes[:, 2]
+        flipped[:, 2] = right - bboxes[:, 0]
+        flipped_bboxes.append(flipped)
+    if not with_mask:
+        return flipped_bboxes
+    flipped_segms = [[
+        mask_util.encode(
+            np.asfortranarray(mask_util.decode(rle)[:, ::-1]))
+        for rle in cls_segms
+    ] for cls_segms in result[1]]
+    return flipped_bboxes, flipped_segms
+
+
+def fuse_results(results,
+                 run_weights=None,
+                 method='wbf',
+                 iou_thr=0.55,
+                 skip_thr=0.,
+                 mask_thr=0.5,
+                 max_per_img=100):
+    """Fuse the results of an image by several runs (late fusion).
+
+    Every run (a model, possibly on an augmentation of the image) outputs
+    its own detections in the original image, e.g. by ``simple_test`` (the
+    results of flipped inputs mapped back by :func:`flip_result`), the
+    boxes are fused by :func:`fuse_bboxes` and the masks of each cluster by
+    :func:`fuse_masks`, weighted like the boxes.
+
+    Args:
+        results (list): result of each run, bbox_result or (bbox_result,
+            segm_result), in the format of ``simple_test`` with rescale.
+        run_weights (Sequence[float], optional): weight of each run, equal
+            by default.
+        method (str): 'wbf' (weighted box fusion) or 'soft_merge'.
+        iou_thr (float): IoU threshold of the clusters.
+        skip_thr (float): boxes with lower scores are not fused.
+        mask_thr (float): threshold of the averaged masks.
+        max_per_img (int): max number of fused detections, all if <= 0.
+
+    Returns:
+        bbox_result or (bbox_result, segm_result), the fused result.
+    """
+    with_mask = isinstance(results[0], tuple)
+    bbox_results = [r[0] if with_mask else r for r in results]
+    num_classes = len(bbox_results[0])
+    if run_weights is None:
+        run_weights = [1.] * len(results)
+    assert len(run_weights) == len(results)
+
+    dets = np.concatenate(
+        [np.vstack(r).reshape(-1, 5) for r in bbox_results])
+    labels = np.concatenate([
+        np.full(len(bboxes), i, dtype=np.int64) for r in bbox_results
+        for i, bboxes in enumerate(r)
+    ])
+    run_inds = np.concatenate([
+        np.full(sum(len(bboxes) for bboxes in r), k, dtype=np.int64)
+        for k, r in enumerate(bbox_results)
+    ])
+    fused_dets, fused_labels, clusters = fuse_bboxes(
+        dets, labels, run_inds, run_weights, method, iou_thr, skip_thr)
+    if max_per_img > 0 and len(fused_dets) > max_per_img:
+        keep = np.argsort(-fused_dets[:, 4], kind='mergesort')[:max_per_img]
+        keep.sort()
+        fused_dets = fused_dets[keep]
+        fused_labels = fused_labels[keep]
+        clusters = [clusters[i] for i in keep]
+    bbox_result = [fused_dets[fused_labels == i] for i in range(num_classes)]
+    if not with_mask:
+        return bbox_result
+
+    # masks in the order of the boxes
+    rles = [rle for r in results for cls_segms in r[1] for rle in cls_segms]
+    run_weights = np.asarray(run_weights, dtype=np.float64)
+    segm_result = [[] for _ in range(num_classes)]
+    for label, members in zip(fused_labels, clusters):
+        weights = dets[members, 4] * run_weights[run_inds[members]]
+        segm_result[label].append(
+            fuse_masks([rles[i] for i in members], weights, mask_thr))
+    return bbox_result, segm_result
@@ -1,7 +1,7 @@
 from .dist_utils import allreduce_grads, DistOptimizerHook
-from .misc import tensor2imgs, unmap, multi_apply
+from .misc import tensor2imgs, unmap, multi_apply, normalize_img_tensor
 
 __all__ = [
     'allreduce_grads', 'DistOptimizerHook', 'tensor2imgs', 'unmap',
-    'multi_apply'
+    'multi_apply', 'normalize_img_tensor'
 ]
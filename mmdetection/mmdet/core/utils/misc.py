@@ -2,6 +2,7 @@ from functools import partial
 
 import mmcv
 import numpy as np
+import torch
 from six.moves import map, zip
 
 
@@ -18,6 +19,34 @@ def tensor2imgs(tensor, mean=(0, 0, 0), std=(1, 1, 1), to_rgb=True):
     return imgs
 
 
+def normalize_img_tensor(img, img_shapes, mean, std, to_rgb=True):
+    """Normalize a batch of raw (e.g. uint8 BGR) padded images on their
+    device, like ``mmcv.imnormalize`` before padding.
+
+    The channels are swapped, then scaled and shifted by a single fused
+    multiply-add (``x / std - mean / std``), and the padding beyond the
+    shape of each image is kept 0.
+
+    Args:
+        img (Tensor): (N, 3, H, W) raw images.
+        img_shapes (list[tuple]): unpadded (h, w, ...) of each image.
+
+    Returns:
+        Tensor: (N, 3, H, W) float32 normalized images.
+    """
+    std = torch.tensor(std, dtype=torch.float32, device=img.device)
+    mean = torch.tensor(mean, dtype=torch.float32, device=img.device)
+    if to_rgb:
+        img = img.flip(1)
+    img = torch.addcmul((-mean / std).view(1, -1, 1, 1), img.float(),
+                        (1 / std).view(1, -1, 1, 1))
+    for i, img_shape in enumerate(img_shapes):
+        h, w = img_shape[:2]
+        img[i, :, h:] = 0
+        img[i, :, :h, w:] = 0
+    return img
+
+
 def multi_apply(func, *args, **kwargs):
     pfunc = partial(func, **kwargs) if kwargs else func
     map_results = map(pfunc, *args)
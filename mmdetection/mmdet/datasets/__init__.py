@@ -4,15 +4,20 @@ from .coco import CocoDataset
 from .oid import OIDDataset
 from .oid_seg import OIDSegDataset, OIDSegParentDataset
 from .voc import VOCDataset
-from .loader import GroupSampler, DistributedGroupSampler, build_dataloader
+from .loader import (GroupSampler, DistributedGroupSampler, build_dataloader,
+                     DevicePrefetcher)
 from .utils import to_tensor, random_scale, show_ann, get_dataset
 from .concat_dataset import ConcatDataset
 from .repeat_dataset import RepeatDataset
 from .extra_aug import ExtraAugmentation
+from .file_client import FileClient
+from .rle_masks import RLEMasks
+from .ann_columns import ImgInfos, load_img_infos
 
 __all__ = [
     'CustomDataset', 'XMLDataset', 'CocoDataset', 'OIDDataset', 'OIDSegDataset','OIDSegParentDataset', 'VOCDataset', 'GroupSampler',
     'DistributedGroupSampler', 'build_dataloader', 'to_tensor', 'random_scale',
     'show_ann', 'get_dataset', 'ConcatDataset', 'RepeatDataset',
-    'ExtraAugmentation'
+    'ExtraAugmentation', 'FileClient', 'RLEMasks', 'DevicePrefetcher',
+    'ImgInfos', 'load_img_infos'
 ]
@@ -0,0 +1,170 @@
+"""Annotation sets as flat columns, written by util/compile_ann.py.
+
+Instead of a pickled list of one dict per image, an annotation set is a
+``.npz`` file of a few flat arrays, the annotations of image ``i`` being
+rows ``ann_offsets[i]:ann_offsets[i + 1]`` of the annotation columns::
+
+    filename      (num_imgs, ) bytes
+    width         (num_imgs, ) int32
+    height        (num_imgs, ) int32
+    ann_offsets   (num_imgs + 1, ) int64
+    bboxes        (num_anns, 4) float32, x1, y1, x2, y2 in pixels
+    labels        (num_anns, ) int64, 1-based
+    MaskPath      (num_anns, ) bytes
+    img_inds      (num_entries, ) int64, optional
+
+Only ``filename`` is required (e.g. test sets), the image and annotation
+columns are present together. ``img_inds`` lists the image of each entry of
+the set when images are repeated (e.g. rebalanced sets), each image is
+stored once.
+
+The set is loaded as :class:`ImgInfos`, which keeps the columns and makes
+the info dict of an entry when it is indexed. It loads in a fraction of the
+time of the pickle, and unlike millions of python objects, the arrays are
+not copied page by page into each (forked) data loader worker by
+refcounting.
+"""
+import os
+
+import mmcv
+import numpy as np
+
+IMG_COLUMNS = ('filename', 'width', 'height')
+ANN_COLUMNS = ('bboxes', 'labels', 'MaskPath')
+
+
+def dump_ann_columns(columns, path):
+    """Write the columns of an annotation set to a ``.npz`` file,
+    atomically."""
+    assert path.endswith('.npz')
+    num_imgs = len(columns['filename'])
+    if 'ann_offsets' in columns:
+        assert len(columns['ann_offsets']) == num_imgs + 1
+        num_anns = columns['ann_offsets'][-1]
+        assert all(len(columns[k]) == num_anns for k in ANN_COLUMNS
+                   if k in columns)
+    columns = {k: np.asarray(v) for k, v in columns.items()}
+    for k, v in columns.items():
+        # names as bytes, a quarter of the size of numpy str
+        if v.dtype.kind == 'U':
+            columns[k] = np.char.encode(v)
+    tmp_path = '{}.tmp{}.npz'.format(path[:-4], os.getpid())
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+
+def load_ann_columns(path):
+    """Columns of an annotation set, as a dict of arrays."""
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def img_infos_to_columns(img_infos):
+    """Columns of a list of image infos (e.g. of a pickled annotation
+    file), a repeated info object being stored once."""
+    if isinstance(img_infos, ImgInfos):
+        return img_infos.to_columns()
+    # entries sharing the same dict, as in the pickles of rebalanced sets
+    rows = {}
+    img_inds = np.array(
+        [rows.setdefault(id(info), len(rows)) for info in img_infos],
+        dtype=np.int64)
+    if len(rows) < len(img_inds):
+        firsts = np.unique(img_inds, return_index=True)[1]
+        columns = img_infos_to_columns([img_infos[i] for i in firsts])
+        columns['img_inds'] = img_inds
+        return columns
+    columns = dict(
+        filename=np.array([info['filename'] for info in img_infos],
+                          dtype=str))
+    if not img_infos or 'width' not in img_infos[0]:
+        return columns
+    columns['width'] = np.array([info['width'] for info in img_infos],
+                                dtype=np.int32)
+    columns['height'] = np.array([info['height'] for info in img_infos],
+                                 dtype=np.int32)
+    anns = [info['ann'] for info in img_infos]
+    offsets = np.zeros(len(anns) + 1, dtype=np.int64)
+    np.cumsum([len(ann['labels']) for ann in anns], out=offsets[1:])
+    columns['ann_offsets'] = offsets
+    columns['bboxes'] = np.concatenate(
+        [np.asarray(ann['bboxes'], dtype=np.float32).reshape(-1, 4)
+         for ann in anns])
+    columns['labels'] = np.concatenate(
+        [np.asarray(ann['labels'], dtype=np.int64) for ann in anns])
+    columns['MaskPath'] = np.array(
+        [name for ann in anns for name in ann['MaskPath']], dtype=str)
+    return columns
+
+
+def img_info(columns, idx):
+    """The info dict of the idx-th image, as in a pickled annotation file.
+    """
+    info = dict(filename=columns['filename'][idx].decode())
+    if 'width' not in columns:
+        return info
+    info['width'] = int(columns['width'][idx])
+    info['height'] = int(columns['height'][idx])
+    start, end = columns['ann_offsets'][idx:idx + 2]
+    info['ann'] = dict(
+        bboxes=columns['bboxes'][start:end],
+        labels=columns['labels'][start:end],
+        MaskPath=np.array(
+            [name.decode() for name in columns['MaskPath'][start:end]],
+            dtype=object))
+    return info
+
+
+class ImgInfos(object):
+    """Read-only sequence of the image infos of an annotation set, backed
+    by its columns.
+
+    Indexing an entry makes its info dict (:func:`img_info`), which is not
+    kept. Slicing (or indexing by an array) gives another view of the same
+    columns.
+
+    Args:
+        columns (dict): columns of the set, see :func:`load_ann_columns`.
+        inds (ndarray, optional): image of each entry, ``img_inds`` or all
+            the images by default.
+    """
+
+    __slots__ = ('columns', 'inds')
+
+    def __init__(self, columns, inds=None):
+        self.columns = columns
+        if inds is None:
+            inds = columns.get('img_inds')
+        if inds is None:
+            inds = np.arange(len(columns['filename']))
+        self.inds = np.asarray(inds, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.inds)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return img_info(self.columns, self.inds[idx])
+        return ImgInfos(self.columns, self.inds[idx])
+
+    def __iter__(self):
+        for i in self.inds:
+            yield img_info(self.columns, i)
+
+    def column(self, name):
+        """An image column (e.g. 'width') for each entry."""
+        return self.columns[name][self.inds]
+
+    def to_columns(self):
+        """Columns of the entries, for :func:`dump_ann_columns`."""
+        columns = {k: v for k, v in self.columns.items() if k != 'img_inds'}
+        columns['img_inds'] = self.inds
+        return columns
+
+
+def load_img_infos(ann_file):
+    """Image infos of a columnar (``.npz``) or pickled annotation file,
+    as :class:`ImgInfos` or a list."""
+    if ann_file.endswith('.npz'):
+        return ImgInfos(load_ann_columns(ann_file))
+    return mmcv.load(ann_file)
@@ -6,12 +6,13 @@ import numpy as np
 from mmcv.parallel import DataContainer as DC
 from torch.utils.data import Dataset
 
+from .ann_columns import ImgInfos, load_img_infos
 from .transforms import (ImageTransform, BboxTransform, MaskTransform,
                          SegMapTransform, Numpy2Tensor)
 from .utils import to_tensor, random_scale
 from .extra_aug import ExtraAugmentation
+from .file_client import file_client_from_prefix
 import cv2
-from google.cloud import storage
 import logging
 
 
@@ -37,9 +38,22 @@ class CustomDataset(Dataset):
                  seg_scale_factor=1,
                  extra_aug=None,
                  resize_keep_ratio=True,
+                 file_client_args=None,
+                 device_test_aug=False,
+                 img_uint8=False,
                  test_mode=False):
         # prefix of images path
         self.img_prefix = img_prefix
+        # train images missing from img_prefix are looked up in these
+        self.img_prefix_fallbacks = [
+            img_prefix.replace('data/train', 'data/' + split)
+            for split in ('test', 'val') if 'data/train' in img_prefix
+        ]
+
+        # images (and annotation files) are read by a client shared by all
+        # the samples of a worker, see FileClient
+        self.file_client = file_client_from_prefix(img_prefix,
+                                                   **(file_client_args or {}))
 
         self.split = None
 
@@ -52,7 +66,10 @@ class CustomDataset(Dataset):
         # filter images with no annotation during training
         if not test_mode:
             valid_inds = self._filter_imgs()
-            self.img_infos = [self.img_infos[i] for i in valid_inds]
+            if isinstance(self.img_infos, ImgInfos):
+                self.img_infos = self.img_infos[valid_inds]
+            else:
+                self.img_infos = [self.img_infos[i] for i in valid_inds]
             if self.proposals is not None:
                 self.proposals = [self.proposals[i] for i in valid_inds]
 
@@ -91,6 +108,13 @@ class CustomDataset(Dataset):
         self.seg_scale_factor = seg_scale_factor
         # in test mode or not
         self.test_mode = test_mode
+        # test images are only resized (once per scale) and left uint8, the
+        # flips and the normalization are done on the device by
+        # DevicePrefetcher
+        self.device_test_aug = device_test_aug
+        # images are left unnormalized (uint8 BGR) through the loader and
+        # normalized by the detector, with the img_norm_cfg of their metas
+        self.img_uint8 = img_uint8
 
         # set group flag for the sampler
         if not self.test_mode:
@@ -116,7 +140,8 @@ class CustomDataset(Dataset):
         return len(self.img_infos)
 
     def load_annotations(self, ann_file):
-        return mmcv.load(ann_file)
+        # columnar (.npz, util/compile_ann.py) or pickled annotation file
+        return load_img_infos(ann_file)
 
     def load_proposals(self, proposal_file):
         return mmcv.load(proposal_file)
@@ -124,7 +149,59 @@ class CustomDataset(Dataset):
     def get_ann_info(self, idx):
         return self.img_infos[idx]['ann']
 
+    def get_ann_paths(self, idx):
+        """Annotation files of an image, read together with the image."""
+        return []
+
+    def load_ann(self, idx, ann_bytes):
+        """Annotation of an image from the bytes of its annotation files."""
+        return self.get_ann_info(idx)
+
+    def read_img(self, img_info, ann_paths=()):
+        """Read an image and, concurrently, its annotation files.
+
+        Returns:
+            tuple: (img, ann_bytes), the BGR image and the bytes of every
+                file of ``ann_paths``.
+        """
+        paths = [osp.join(self.img_prefix, img_info['filename'])]
+        paths += list(ann_paths)
+        try:
+            values = self.file_client.get_many(paths)
+        except FileNotFoundError:
+            # only a missing image is looked up in the fallback prefixes, a
+            # missing annotation file is an error
+            try:
+                self.file_client.get(paths[0])
+            except FileNotFoundError:
+                pass
+            else:
+                raise
+            values = [self._read_fallback_img(img_info['filename'], paths[0])]
+            values += self.file_client.get_many(paths[1:])
+        img = cv2.imdecode(
+            np.frombuffer(values[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+        return img, values[1:]
+
+    def _read_fallback_img(self, filename, path):
+        """Bytes of an image missing from ``img_prefix``, read from the
+        first of ``img_prefix_fallbacks`` holding it."""
+        logger = logging.getLogger()
+        for prefix in self.img_prefix_fallbacks:
+            logger.info('{} not found, trying {}'.format(path, prefix))
+            try:
+                return self.file_client.get(osp.join(prefix, filename))
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(path)
+
     def _filter_imgs(self, min_size=32):
+        if isinstance(self.img_infos, ImgInfos):
+            # without making the info of every image
+            sizes = np.minimum(
+                self.img_infos.column('width'),
+                self.img_infos.column('height'))
+            return np.flatnonzero(sizes >= min_size)
         valid_inds = []
         for i, img_info in enumerate(self.img_infos):
             if min(img_info['width'], img_info['height']) >= min_size:
@@ -132,6 +209,10 @@ class CustomDataset(Dataset):
         return valid_inds
 
     def _set_group_flag(self):
+        if isinstance(self.img_infos, ImgInfos):
+            self.flag = (self.img_infos.column('width') /
+                         self.img_infos.column('height') > 1).astype(np.uint8)
+            return
 
         self.flag = np.zeros(len(self), dtype=np.uint8)
         for i in range(len(self)):
@@ -171,38 +252,8 @@ class CustomDataset(Dataset):
         if idx%1000==5: 
             logger.info(f"idx={idx}, img_info['filename']={img_info['filename']}")
             print(f"idx={idx}, img_info['filename']={img_info['filename']}")
-        # load image
-
-        # for colab
-        if 'gs://oid2019' in self.img_prefix:
-
-            self.client = storage.Client.from_service_account_json(
-                '/home/jupyter/project-owner-xxxxxxxxxxx.json')
-                
-            # workaround for connection error
-            blob = None
-            while blob is None:
-                try:
-                    self.bucket = self.client.get_bucket('oid2019')
-                    blob = self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/', ''), img_info['filename']))
-                    if blob is None:
-                      logger.info(f"self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/', ''), img_info['filename'])) failed for {osp.join(self.img_prefix.replace('gs://oid2019/', ''), img_info['filename'])}")
-                      blob = self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/data/train', 'data/test'), img_info['filename']))
-                      if blob is None:
-                        logger.info(f"self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/data/train', 'data/test'), img_info['filename'])) failed")
-                        blob = self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/data/train', 'data/val'), img_info['filename']))
-                        if blob is None:
-                          logger.info(f"self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/data/train', 'data/val'), img_info['filename'])) failed")
-                except:               
-                    logger = logging.getLogger()
-                    logger.info(f"------ self.client.get_bucket('oid2019') failed, sleep 2 seconds")
-                    import time                    
-                    time.sleep(2)                     
-                     
-            img = cv2.imdecode(np.asarray(bytearray(blob.download_as_string()), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-            
-        else:
-            img = mmcv.imread(osp.join(self.img_prefix, img_info['filename']))
+        # load image, and the annotation files of the image at the same time
+        img, ann_bytes = self.read_img(img_info, self.get_ann_paths(idx))
         # load proposals if necessary
         if self.proposals is not None:
             proposals = self.proposals[idx][:self.num_max_proposals]
@@ -224,7 +275,7 @@ class CustomDataset(Dataset):
         ann = None
         while ann is None:
           try:
-            ann = self.get_ann_info(idx)
+            ann = self.load_ann(idx, ann_bytes)
           except:
             logger = logging.getLogger()
             logger.info(f"------ self.get_ann_info(idx) failed, sleep 2 seconds")
@@ -256,7 +307,11 @@ class CustomDataset(Dataset):
 
         try:
             img, img_shape, pad_shape, scale_factor = self.img_transform(
-                img, img_scale, flip, keep_ratio=self.resize_keep_ratio)
+                img,
+                img_scale,
+                flip,
+                keep_ratio=self.resize_keep_ratio,
+                normalize=not self.img_uint8)
         except:
             logger = logging.getLogger()
             logger.info("Error! img_info['filename'] = " + str(img_info['filename']))
@@ -293,6 +348,8 @@ class CustomDataset(Dataset):
             pad_shape=pad_shape,
             scale_factor=scale_factor,
             flip=flip)
+        if self.img_uint8:
+            img_meta['img_norm_cfg'] = self.img_norm_cfg
 
         data = dict(
             img=DC(to_tensor(img), stack=True),
@@ -313,27 +370,7 @@ class CustomDataset(Dataset):
     def prepare_test_img(self, idx):
         img_info = self.img_infos[idx]
 
-        # for gcp
-        if 'gs://oid2019' in self.img_prefix:
-
-            self.client = storage.Client.from_service_account_json(
-                '/home/jupyter/project-owner-xxxxxxxxxxx.json')
-                
-            # workaround for connection error
-            blob = None
-            while blob is None:
-                try:
-                    self.bucket = self.client.get_bucket('oid2019')
-                    blob = self.bucket.get_blob(osp.join(self.img_prefix.replace('gs://oid2019/', ''), img_info['filename']))
-                except:
-                    logger = logging.getLogger()
-                    logger.info(f"------ self.client.get_bucket('oid2019') failed, sleep 2 seconds")
-                    import time                    
-                    time.sleep(2)                     
-                     
-            img = cv2.imdecode(np.asarray(bytearray(blob.download_as_string()), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
-        else:                                 
-            img = mmcv.imread(osp.join(self.img_prefix, img_info['filename']))
+        img, _ = self.read_img(img_info)
 
         width = img.shape[1]
         height = img.shape[0]
@@ -346,9 +383,27 @@ class CustomDataset(Dataset):
         else:
             proposal = None
 
+        def prepare_proposal(proposal, img_shape, scale_factor, flip):
+            if proposal is None:
+                return None
+            if proposal.shape[1] == 5:
+                score = proposal[:, 4, None]
+                proposal = proposal[:, :4]
+            else:
+                score = None
+            _proposal = self.bbox_transform(proposal, img_shape,
+                                            scale_factor, flip)
+            _proposal = np.hstack(
+                [_proposal, score]) if score is not None else _proposal
+            return to_tensor(_proposal)
+
         def prepare_single(img, scale, flip, proposal=None):
             _img, img_shape, pad_shape, scale_factor = self.img_transform(
-                img, scale, flip, keep_ratio=self.resize_keep_ratio)
+                img,
+                scale,
+                flip,
+                keep_ratio=self.resize_keep_ratio,
+                normalize=not (self.device_test_aug or self.img_uint8))
             _img = to_tensor(_img)
             _img_meta = dict(
                 ori_shape=(height, width, 3),
@@ -356,19 +411,11 @@ class CustomDataset(Dataset):
                 pad_shape=pad_shape,
                 scale_factor=scale_factor,
                 flip=flip)
-            if proposal is not None:
-                if proposal.shape[1] == 5:
-                    score = proposal[:, 4, None]
-                    proposal = proposal[:, :4]
-                else:
-                    score = None
-                _proposal = self.bbox_transform(proposal, img_shape,
-                                                scale_factor, flip)
-                _proposal = np.hstack(
-                    [_proposal, score]) if score is not None else _proposal
-                _proposal = to_tensor(_proposal)
-            else:
-                _proposal = None
+            # DevicePrefetcher normalizes the images of device_test_aug
+            if self.img_uint8 and not self.device_test_aug:
+                _img_meta['img_norm_cfg'] = self.img_norm_cfg
+            _proposal = prepare_proposal(proposal, img_shape, scale_factor,
+                                         flip)
             return _img, _img_meta, _proposal
 
         imgs = []
@@ -380,7 +427,15 @@ class CustomDataset(Dataset):
             imgs.append(_img)
             img_metas.append(DC(_img_meta, cpu_only=True))
             proposals.append(_proposal)
-            if self.flip_ratio > 0:
+            if self.flip_ratio > 0 and self.device_test_aug:
+                # the flipped image is made from the previous one on the
+                # device, only its meta and proposals are prepared here
+                _img_meta = dict(_img_meta, flip=True)
+                img_metas.append(DC(_img_meta, cpu_only=True))
+                proposals.append(
+                    prepare_proposal(proposal, _img_meta['img_shape'],
+                                     _img_meta['scale_factor'], True))
+            elif self.flip_ratio > 0:
                 _img, _img_meta, _proposal = prepare_single(
                     img, scale, True, proposal)
                 imgs.append(_img)
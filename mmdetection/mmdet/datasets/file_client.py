@@ -0,0 +1,352 @@
+"""Storage backends to read raw image / mask bytes from.
+
+A :class:`FileClient` is created once per dataset and used from every data
+loader worker. Backends open their connections, file handles and maps
+lazily and re-open them after a fork, so a client (and the dataset holding
+it) can be pickled to the workers and each worker ends up with its own
+connections, reused for all of its samples.
+"""
+import logging
+import mmap
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+_open_lock = threading.Lock()
+
+# service account of the buckets of the datasets
+GCS_CREDENTIALS = '/home/jupyter/project-owner-xxxxxxxxxxx.json'
+
+
+def retry(func, max_retries=5, backoff=0.5, max_backoff=16,
+          exceptions=(Exception, )):
+    """Call ``func()`` and retry it with exponential backoff on failures.
+
+    ``FileNotFoundError`` is never retried.
+    """
+    delay = backoff
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except FileNotFoundError:
+            raise
+        except exceptions as e:
+            if attempt == max_retries:
+                raise
+            logger = logging.getLogger()
+            logger.info('{}: {}, retry in {:.1f}s'.format(
+                type(e).__name__, e, delay))
+            time.sleep(delay)
+            delay = min(delay * 2, max_backoff)
+
+
+class BaseStorageBackend(metaclass=ABCMeta):
+    """Abstract class of storage backends.
+
+    Backends only implement :meth:`get`, which returns the bytes of a file
+    and raises ``FileNotFoundError`` if it does not exist. State that can not
+    be shared with forked processes is opened by :meth:`_open`, once per
+    process.
+    """
+
+    def __init__(self):
+        self._pid = None
+
+    def _open(self):
+        pass
+
+    def _check_open(self):
+        if self._pid != os.getpid():
+            with _open_lock:
+                if self._pid != os.getpid():
+                    self._open()
+                    self._pid = os.getpid()
+
+    @abstractmethod
+    def get(self, filepath):
+        pass
+
+    def __getstate__(self):
+        # never pickle connections / maps, they are re-opened when needed
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        for key in getattr(self, '_unpicklable', ()):
+            state[key] = None
+        return state
+
+
+class HardDiskBackend(BaseStorageBackend):
+    """Raw files on the local disk."""
+
+    def get(self, filepath):
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+
+class ArchiveBackend(BaseStorageBackend):
+    """Members of uncompressed tar or zip shards, read from memory maps.
+
+    The member index of every shard is built once per process, then a read
+    is a slice of the map of its shard. Compressed zip members are
+    decompressed on read.
+
+    Args:
+        paths (str | list[str]): shards or glob patterns of shards.
+        prefix (str): stripped from the file paths to get member names,
+            e.g. the ``img_prefix`` of the dataset.
+    """
+
+    _unpicklable = ('_maps', '_zips', '_index')
+
+    def __init__(self, paths, prefix=''):
+        super(ArchiveBackend, self).__init__()
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = sorted(p for pattern in paths for p in glob(pattern))
+        if not self.paths:
+            raise FileNotFoundError('no archive found in {}'.format(paths))
+        self.prefix = prefix
+
+    def _open(self):
+        self._maps = []
+        self._zips = []
+        # member name -> (shard index, offset, size), offset is None for
+        # compressed zip members
+        self._index = {}
+        for i, path in enumerate(self.paths):
+            with open(path, 'rb') as f:
+                self._maps.append(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            if zipfile.is_zipfile(path):
+                zf = zipfile.ZipFile(path)
+                self._zips.append(zf)
+                for info in zf.infolist():
+                    if info.compress_type == zipfile.ZIP_STORED:
+                        # the data follows the local header of the member
+                        header = self._maps[i][info.header_offset:
+                                               info.header_offset + 30]
+                        name_len = int.from_bytes(header[26:28], 'little')
+                        extra_len = int.from_bytes(header[28:30], 'little')
+                        offset = (info.header_offset + 30 + name_len +
+                                  extra_len)
+                        self._index[info.filename] = (i, offset,
+                                                      info.file_size)
+                    else:
+                        self._index[info.filename] = (i, None, info.file_size)
+            else:
+                self._zips.append(None)
+                with tarfile.open(path, 'r:') as tf:
+                    for info in tf:
+                        if info.isfile():
+                            self._index[info.name] = (i, info.offset_data,
+                                                      info.size)
+
+    def _key(self, filepath):
+        if self.prefix and filepath.startswith(self.prefix):
+            filepath = filepath[len(self.prefix):]
+        return filepath.lstrip('/')
+
+    def get(self, filepath):
+        self._check_open()
+        key = self._key(filepath)
+        if key not in self._index:
+            raise FileNotFoundError(filepath)
+        shard, offset, size = self._index[key]
+        if offset is None:
+            return self._zips[shard].read(key)
+        return self._maps[shard][offset:offset + size]
+
+
+class LmdbBackend(BaseStorageBackend):
+    """Values of an LMDB database, keyed by file path.
+
+    Args:
+        db_path (str): path of the database.
+        prefix (str): stripped from the file paths to get the keys.
+    """
+
+    _unpicklable = ('_env', '_txn')
+
+    def __init__(self, db_path, prefix=''):
+        super(LmdbBackend, self).__init__()
+        try:
+            import lmdb  # noqa: F401
+        except ImportError:
+            raise ImportError('Please install lmdb to use LmdbBackend.')
+        self.db_path = db_path
+        self.prefix = prefix
+
+    def _open(self):
+        import lmdb
+        self._env = lmdb.open(
+            self.db_path,
+            readonly=True,
+            lock=False,
+            readahead=False,
+            meminit=False)
+        self._txn = self._env.begin(write=False, buffers=False)
+
+    def get(self, filepath):
+        self._check_open()
+        if self.prefix and filepath.startswith(self.prefix):
+            filepath = filepath[len(self.prefix):]
+        value = self._txn.get(filepath.lstrip('/').encode())
+        if value is None:
+            raise FileNotFoundError(filepath)
+        return value
+
+
+class GCSBackend(BaseStorageBackend):
+    """Objects of Google Cloud Storage, for paths like ``gs://bucket/key``.
+
+    One client per process, with a pool of ``pool_size`` http connections,
+    and buckets are looked up once.
+
+    Args:
+        credentials (str, optional): service account json, the default
+            credentials are used if not given.
+        api_endpoint (str, optional): e.g. the url of a fake object store
+            server, anonymous credentials are used then.
+        pool_size (int): max number of connections to the server.
+        max_retries (int): number of retries of a failed request.
+        backoff (float): seconds before the first retry, doubled on every
+            retry.
+    """
+
+    _unpicklable = ('_client', '_buckets')
+
+    def __init__(self,
+                 credentials=None,
+                 api_endpoint=None,
+                 pool_size=16,
+                 max_retries=5,
+                 backoff=0.5):
+        super(GCSBackend, self).__init__()
+        try:
+            from google.cloud import storage  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                'Please install google-cloud-storage to use GCSBackend.')
+        self.credentials = credentials
+        self.api_endpoint = api_endpoint
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _open(self):
+        import google.auth
+        import requests
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+
+        scopes = ['https://www.googleapis.com/auth/devstorage.read_only']
+        client_options = None
+        if self.api_endpoint is not None:
+            from google.auth.credentials import AnonymousCredentials
+            credentials, project = AnonymousCredentials(), 'fake'
+            client_options = dict(api_endpoint=self.api_endpoint)
+        elif self.credentials is not None:
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.\
+                from_service_account_file(self.credentials, scopes=scopes)
+            project = credentials.project_id
+        else:
+            credentials, project = google.auth.default(scopes=scopes)
+        # a single pooled session shared by all the threads of the process
+        session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self._client = storage.Client(
+            project=project,
+            credentials=credentials,
+            _http=session,
+            client_options=client_options)
+        self._buckets = {}
+
+    def get(self, filepath):
+        self._check_open()
+        assert filepath.startswith('gs://'), filepath
+        bucket_name, key = filepath[len('gs://'):].split('/', 1)
+        if bucket_name not in self._buckets:
+            self._buckets[bucket_name] = self._client.bucket(bucket_name)
+        blob = self._buckets[bucket_name].blob(key)
+
+        def download():
+            from google.api_core.exceptions import NotFound
+            try:
+                return blob.download_as_string()
+            except NotFound:
+                raise FileNotFoundError(filepath)
+
+        return retry(download, self.max_retries, self.backoff)
+
+
+class FileClient(object):
+    """Read raw bytes of files from a storage backend.
+
+    Args:
+        backend (str): one of :attr:`backends`.
+        num_threads (int): number of threads of :meth:`get_many`.
+        **kwargs: arguments of the backend.
+    """
+
+    backends = {
+        'disk': HardDiskBackend,
+        'archive': ArchiveBackend,
+        'lmdb': LmdbBackend,
+        'gcs': GCSBackend,
+    }
+
+    def __init__(self, backend='disk', num_threads=8, **kwargs):
+        if backend not in self.backends:
+            raise ValueError('backend {} is not one of {}'.format(
+                backend, list(self.backends)))
+        self.backend_name = backend
+        self.backend = self.backends[backend](**kwargs)
+        self.num_threads = num_threads
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def register_backend(cls, name, backend):
+        """Add a backend class, a subclass of :class:`BaseStorageBackend`,
+        to :attr:`backends` under ``name``."""
+        if not (isinstance(backend, type)
+                and issubclass(backend, BaseStorageBackend)):
+            raise TypeError(
+                'backend must be a subclass of BaseStorageBackend, not '
+                '{}'.format(backend))
+        cls.backends[name] = backend
+
+    def get(self, filepath):
+        return self.backend.get(filepath)
+
+    def get_many(self, filepaths):
+        """Read several files concurrently, in the order of ``filepaths``."""
+        if len(filepaths) <= 1 or self.num_threads <= 1:
+            return [self.get(p) for p in filepaths]
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.num_threads)
+            self._pid = os.getpid()
+        return list(self._executor.map(self.get, filepaths))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_pid'] = None
+        return state
+
+
+def file_client_from_prefix(img_prefix, **kwargs):
+    """Default client of an image prefix: GCS for ``gs://`` prefixes and the
+    local disk otherwise, ``kwargs`` override it."""
+    if 'backend' not in kwargs and img_prefix.startswith('gs://'):
+        kwargs['backend'] = 'gcs'
+    return FileClient(**kwargs)
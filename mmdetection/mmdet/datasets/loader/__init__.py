@@ -1,4 +1,8 @@
 from .build_loader import build_dataloader
 from .sampler import GroupSampler, DistributedGroupSampler
+from .prefetcher import DevicePrefetcher
 
-__all__ = ['GroupSampler', 'DistributedGroupSampler', 'build_dataloader']
+__all__ = [
+    'GroupSampler', 'DistributedGroupSampler', 'build_dataloader',
+    'DevicePrefetcher'
+]
@@ -12,6 +12,33 @@ rlimit = resource.getrlimit(resource.RLIMIT_NOFILE)
 resource.setrlimit(resource.RLIMIT_NOFILE, (4096, rlimit[1]))
 
 
+def pad_stack(tensors):
+    """Stack tensors of different sizes, zero padded at the end of every dim
+    to the largest of them."""
+    max_shape = [max(s) for s in zip(*[t.size() for t in tensors])]
+    stacked = tensors[0].new_zeros([len(tensors)] + max_shape)
+    for i, t in enumerate(tensors):
+        stacked[i][tuple(slice(0, s) for s in t.size())] = t
+    return stacked
+
+
+def test_collate(batch):
+    """Collate test samples, whose ``img`` is a list of tensors (one per
+    augmentation) that may differ in size from one image to another.
+
+    The images of each augmentation are zero padded to the largest of the
+    batch and stacked, like a ``DataContainer`` with ``stack=True``, the
+    other fields are collated as usual. A test batch goes to a single device,
+    including the last one of the dataset, which may be smaller.
+    """
+    imgs = [data['img'] for data in batch]
+    collated = collate(
+        [{k: v for k, v in data.items() if k != 'img'} for data in batch],
+        len(batch))
+    collated['img'] = [pad_stack(list(aug_imgs)) for aug_imgs in zip(*imgs)]
+    return collated
+
+
 def build_dataloader(dataset,
                      imgs_per_gpu,
                      workers_per_gpu,
@@ -19,6 +46,7 @@ def build_dataloader(dataset,
                      dist=True,
                      **kwargs):
     shuffle = kwargs.get('shuffle', True)
+    pin_memory = kwargs.pop('pin_memory', False)
     print(shuffle)
     if dist:
         rank, world_size = get_dist_info()
@@ -36,13 +64,17 @@ def build_dataloader(dataset,
         batch_size = num_gpus * imgs_per_gpu
         num_workers = num_gpus * workers_per_gpu
 
+    if getattr(dataset, 'test_mode', False):
+        collate_fn = test_collate
+    else:
+        collate_fn = partial(collate, samples_per_gpu=imgs_per_gpu)
     data_loader = DataLoader(
         dataset,
         batch_size=batch_size,
         sampler=sampler,
         num_workers=num_workers,
-        collate_fn=partial(collate, samples_per_gpu=imgs_per_gpu),
-        pin_memory=False,
+        collate_fn=collate_fn,
+        pin_memory=pin_memory,
         **kwargs)
 
     return data_loader
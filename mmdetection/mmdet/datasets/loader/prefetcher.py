@@ -0,0 +1,111 @@
+import torch
+
+
+class DevicePrefetcher(object):
+    """Test batches of a ``device_test_aug`` dataset, augmented on the device.
+
+    The dataset only resizes each image once per scale and leaves it uint8
+    (1/4 of the float32 bytes), the loader should pin memory. The images of
+    the next batch are copied to the device, normalized and flipped (for
+    the augmentations whose meta has ``flip``) on a side CUDA stream while
+    the current batch is being tested, and the batches are yielded like
+    those of a normal test loader, with the images on the device.
+
+    Args:
+        data_loader (DataLoader): test loader of a dataset with
+            ``device_test_aug=True``.
+        img_norm_cfg (dict): ``mean``, ``std`` and ``to_rgb`` of the
+            dataset.
+        device (str or torch.device, optional): the current CUDA device if
+            available, else the CPU (synchronously, e.g. for CPU tests).
+    """
+
+    def __init__(self, data_loader, img_norm_cfg, device=None):
+        self.data_loader = data_loader
+        self.dataset = data_loader.dataset
+        if device is None:
+            device = torch.device('cuda', torch.cuda.current_device()
+                                  ) if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.mean = torch.tensor(
+            img_norm_cfg['mean'], dtype=torch.float32,
+            device=self.device).view(1, -1, 1, 1)
+        self.std = torch.tensor(
+            img_norm_cfg['std'], dtype=torch.float32,
+            device=self.device).view(1, -1, 1, 1)
+        self.to_rgb = img_norm_cfg.get('to_rgb', True)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def _normalize(self, img, img_metas):
+        """Normalize a batch of uint8 BGR images, the padding stays 0 like
+        that of images normalized before padding."""
+        img = img.float()
+        if self.to_rgb:
+            img = img.flip(1)
+        img = (img - self.mean) / self.std
+        for i, img_meta in enumerate(img_metas):
+            h, w = img_meta['img_shape'][:2]
+            img[i, :, h:] = 0
+            img[i, :, :h, w:] = 0
+        return img
+
+    @staticmethod
+    def _flip(img, img_metas):
+        """Flip the images of a batch, only within their image shape."""
+        flipped = torch.zeros_like(img)
+        for i, img_meta in enumerate(img_metas):
+            h, w = img_meta['img_shape'][:2]
+            flipped[i, :, :h, :w] = img[i, :, :h, :w].flip(-1)
+        return flipped
+
+    def _preprocess(self, data):
+        imgs = [
+            img.to(self.device, non_blocking=True) for img in data['img']
+        ]
+        # the augmentations are (scale 0, flipped scale 0, scale 1, ...)
+        # with one image per scale
+        aug_imgs = []
+        scale_idx = -1
+        for img_meta in data['img_meta']:
+            img_metas = img_meta.data[0]
+            if not img_metas[0]['flip']:
+                scale_idx += 1
+                img = self._normalize(imgs[scale_idx], img_metas)
+                aug_imgs.append(img)
+            else:
+                aug_imgs.append(self._flip(img, img_metas))
+        assert scale_idx == len(imgs) - 1
+        data = dict(data)
+        data['img'] = aug_imgs
+        return data
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            for data in self.data_loader:
+                yield self._preprocess(data)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        current_stream = torch.cuda.current_stream(self.device)
+
+        def preload(loader_iter):
+            try:
+                data = next(loader_iter)
+            except StopIteration:
+                return None
+            with torch.cuda.stream(stream):
+                return self._preprocess(data)
+
+        loader_iter = iter(self.data_loader)
+        next_data = preload(loader_iter)
+        while next_data is not None:
+            current_stream.wait_stream(stream)
+            data = next_data
+            for img in data['img']:
+                # allocated on the side stream, used on the current one
+                img.record_stream(current_stream)
+            # the copies of the next batch overlap the test of this one
+            next_data = preload(loader_iter)
+            yield data
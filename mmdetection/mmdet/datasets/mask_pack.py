@@ -0,0 +1,236 @@
+"""Packed instance masks, pre-resized and RLE encoded, indexed by image.
+
+A pack is a directory of shards holding one contiguous record per image,
+and of ``.npy`` columns indexing the records, sorted by file name::
+
+    pack/
+        filename.npy      (num_imgs, ) bytes, sorted
+        width.npy         (num_imgs, ) int32, size the masks are resized to
+        height.npy        (num_imgs, ) int32
+        shard.npy         (num_imgs, ) int32, shard of the record
+        offset.npy        (num_imgs, ) int64, offset of the record in it
+        size.npy          (num_imgs, ) int64, size of the record
+        shard_00000.bin
+        shard_00001.bin
+        ...
+
+A record is the number ``n`` of masks of the image (uint32), the lengths of
+their names (n uint32), the lengths of their COCO RLE counts (n uint32),
+then the names and the counts. The name of a mask is its ``MaskPath`` in
+the annotation file, so a record is shared by all the entries of an image
+(e.g. of a rebalanced annotation file) and only the masks an entry needs
+are decoded.
+"""
+import mmap
+import os
+import os.path as osp
+from glob import glob
+
+import numpy as np
+import pycocotools.mask as maskUtils
+
+from .file_client import BaseStorageBackend
+
+INDEX_COLUMNS = ('filename', 'width', 'height', 'shard', 'offset', 'size')
+
+
+def encode_record(names, counts):
+    """Record of the masks of an image.
+
+    Args:
+        names (Sequence[str]): name of each mask.
+        counts (Sequence[bytes]): COCO RLE counts of each mask.
+
+    Returns:
+        bytes: the record.
+    """
+    assert len(names) == len(counts)
+    names = [n.encode() if isinstance(n, str) else n for n in names]
+    header = np.array(
+        [len(names)] + [len(n) for n in names] + [len(c) for c in counts],
+        dtype=np.uint32)
+    return b''.join([header.tobytes()] + names + list(counts))
+
+
+def decode_record(record):
+    """Names and COCO RLE counts of the masks of a record.
+
+    Returns:
+        tuple: (names, counts), lists of bytes.
+    """
+    num = int(np.frombuffer(record, dtype=np.uint32, count=1)[0])
+    lengths = np.frombuffer(
+        record, dtype=np.uint32, count=2 * num, offset=4).astype(np.int64)
+    offsets = np.cumsum(np.concatenate([[4 * (2 * num + 1)], lengths]))
+    values = [record[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+    return values[:num], values[num:]
+
+
+class MaskPackWriter(object):
+    """Append the records of images to a pack.
+
+    Shards are written to ``.tmp`` files and renamed when complete, the
+    index is written by :meth:`close`, so a pack is usable only once fully
+    written.
+
+    Args:
+        path (str): pack directory, created if it does not exist.
+        shard_size (int): max bytes per shard.
+    """
+
+    def __init__(self, path, shard_size=2**30):
+        self.path = path
+        self.shard_size = shard_size
+        os.makedirs(path, exist_ok=True)
+        self._index = []
+        self._shard = -1
+        self._file = None
+        self._offset = 0
+
+    def _next_shard(self):
+        self._close_shard()
+        self._shard += 1
+        self._file = open(self._shard_path(self._shard) + '.tmp', 'wb')
+        self._offset = 0
+
+    def _shard_path(self, shard):
+        return osp.join(self.path, 'shard_{:05d}.bin'.format(shard))
+
+    def _close_shard(self):
+        if self._file is not None:
+            self._file.close()
+            os.replace(self._file.name, self._shard_path(self._shard))
+            self._file = None
+
+    def add(self, filename, width, height, names, counts):
+        """Add the masks of one image.
+
+        Args:
+            filename (str): file name of the image.
+            width (int): width of the masks.
+            height (int): height of the masks.
+            names (Sequence[str]): ``MaskPath`` of each mask.
+            counts (Sequence[bytes]): COCO RLE counts of each mask.
+        """
+        record = encode_record(names, counts)
+        if self._file is None or (self._offset > 0 and self._offset +
+                                  len(record) > self.shard_size):
+            self._next_shard()
+        self._file.write(record)
+        self._index.append((filename, width, height, self._shard,
+                            self._offset, len(record)))
+        self._offset += len(record)
+
+    def close(self):
+        self._close_shard()
+        if not self._index:
+            return
+        filenames, widths, heights, shards, offsets, sizes = zip(
+            *self._index)
+        filenames = np.array(
+            [f.encode() if isinstance(f, str) else f for f in filenames],
+            dtype=np.bytes_)
+        order = np.argsort(filenames, kind='mergesort')
+        assert not np.any(filenames[order][1:] == filenames[order][:-1]), \
+            'duplicate images in the pack'
+        columns = dict(
+            filename=filenames,
+            width=np.array(widths, dtype=np.int32),
+            height=np.array(heights, dtype=np.int32),
+            shard=np.array(shards, dtype=np.int32),
+            offset=np.array(offsets, dtype=np.int64),
+            size=np.array(sizes, dtype=np.int64))
+        for name in INDEX_COLUMNS:
+            np.save(osp.join(self.path, name + '.npy'), columns[name][order])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MaskPack(BaseStorageBackend):
+    """Read the masks of images from a pack.
+
+    The index and memory maps of the shards are opened lazily, once per
+    process, so a dataset holding a pack can be pickled to the data loader
+    workers.
+
+    Args:
+        path (str): pack directory.
+    """
+
+    _unpicklable = ('_index', '_maps')
+
+    def __init__(self, path):
+        super(MaskPack, self).__init__()
+        if not osp.isfile(osp.join(path, 'filename.npy')):
+            raise FileNotFoundError('no mask pack in {}'.format(path))
+        self.path = path
+
+    def _open(self):
+        self._index = {
+            name: np.load(osp.join(self.path, name + '.npy'), mmap_mode='r')
+            for name in INDEX_COLUMNS
+        }
+        self._maps = []
+        for shard_path in sorted(glob(osp.join(self.path, 'shard_*.bin'))):
+            with open(shard_path, 'rb') as f:
+                self._maps.append(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _lookup(self, filename):
+        key = filename.encode() if isinstance(filename, str) else filename
+        filenames = self._index['filename']
+        i = int(np.searchsorted(filenames, key))
+        if i == len(filenames) or filenames[i] != key:
+            raise FileNotFoundError(filename)
+        return i
+
+    def get(self, filename):
+        """Record of an image."""
+        self._check_open()
+        i = self._lookup(filename)
+        offset = int(self._index['offset'][i])
+        size = int(self._index['size'][i])
+        return self._maps[self._index['shard'][i]][offset:offset + size]
+
+    def size(self, filename):
+        """(width, height) the masks of an image are resized to."""
+        self._check_open()
+        i = self._lookup(filename)
+        return int(self._index['width'][i]), int(self._index['height'][i])
+
+    def load_counts(self, filename, mask_paths):
+        """COCO RLE counts of the masks ``mask_paths`` of an image, without
+        decoding them.
+
+        Returns:
+            tuple: (counts, width, height), counts in the order of
+                ``mask_paths``.
+        """
+        w, h = self.size(filename)
+        names, counts = decode_record(self.get(filename))
+        counts = dict(zip(names, counts))
+        selected = []
+        for mask_path in mask_paths:
+            key = mask_path.encode() if isinstance(mask_path,
+                                                   str) else mask_path
+            if key not in counts:
+                raise FileNotFoundError('{} of {}'.format(mask_path, filename))
+            selected.append(counts[key])
+        return selected, w, h
+
+    def load_masks(self, filename, mask_paths):
+        """Decode the masks ``mask_paths`` of an image.
+
+        Returns:
+            list[ndarray]: uint8 masks of shape (h, w), in the order of
+                ``mask_paths``.
+        """
+        counts, w, h = self.load_counts(filename, mask_paths)
+        return [
+            np.ascontiguousarray(maskUtils.decode(dict(size=[h, w], counts=c)))
+            for c in counts
+        ]
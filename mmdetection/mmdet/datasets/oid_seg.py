@@ -3,12 +3,12 @@ import copy
 
 import numpy as np
 from .custom import CustomDataset
+from .mask_pack import MaskPack
+from .rle_masks import RLEMasks
 import mmcv
 import os
 import platform
 import cv2
-import logging
-from google.cloud import storage
 
 class OIDSegDataset(CustomDataset):
     # 275 leave classes
@@ -61,43 +61,80 @@ class OIDSegDataset(CustomDataset):
         '/m/0283dt1', '/m/039xj_', '/m/01jfm_', '/m/083wq', '/m/0dkzw'
     )
 
+    def __init__(self,
+                 *args,
+                 mask_prefix=None,
+                 mask_pack=None,
+                 rle_masks=False,
+                 **kwargs):
+        super(OIDSegDataset, self).__init__(*args, **kwargs)
+        # gt masks as RLEMasks instead of dense arrays
+        self.rle_masks = rle_masks
+        # masks packed by util/pack_train_masks.py are read from the pack
+        # instead of one png per mask
+        self.mask_pack = MaskPack(mask_pack) if mask_pack else None
+        if mask_prefix is None:
+            if 'gs://oid2019' in self.img_prefix:
+                mask_prefix = 'gs://oid2019/data/train_masks/'
+            else:
+                # local path
+                if platform.system() == 'Darwin':
+                    data_dir = '/Users/bo_liu/Documents/open-images/data/'
+                else:
+                    data_dir = '/media/bo/Elements/open-images/data/'
+                mask_prefix = data_dir + self.split + '_masks/'
+        self.mask_prefix = mask_prefix
+
     def load_annotations(self, ann_file):
         if 'val' in os.path.basename(ann_file): self.split = 'val'
         elif 'test' in os.path.basename(ann_file): self.split = 'OD_test'      
         else: self.split = 'train'
-        return mmcv.load(ann_file)
-
-    def get_ann_info(self, idx):
-        logger = logging.getLogger()
+        return super(OIDSegDataset, self).load_annotations(ann_file)
 
-        # local path
-        if platform.system() == 'Darwin':
-            data_dir = '/Users/bo_liu/Documents/open-images/data/'
-        else:
-            data_dir = '/media/bo/Elements/open-images/data/'
+    def get_ann_paths(self, idx):
+        if self.mask_pack is not None:
+            return []
+        return [
+            self.mask_prefix + mask_path
+            for mask_path in self.img_infos[idx]['ann']['MaskPath']
+        ]
 
+    def load_ann(self, idx, ann_bytes):
         ann = copy.deepcopy(self.img_infos[idx]['ann'])
 
-        gt_masks = []
-        for i, mask_path in enumerate(ann['MaskPath']):
-            # for colab/gcp
-            if 'gs://oid2019' in self.img_prefix:                
-                blob = self.bucket.get_blob('data/train_masks/'+ann['MaskPath'][i])
-                if blob is None:
-                    logger.info("------ ??? -------")
-                  
-                msk = cv2.imdecode(np.asarray(bytearray(blob.download_as_string()), dtype=np.uint8),cv2.IMREAD_UNCHANGED)
+        if self.mask_pack is not None:
+            img_info = self.img_infos[idx]
+            if self.rle_masks:
+                counts, w, h = self.mask_pack.load_counts(
+                    img_info['filename'], ann['MaskPath'])
+                ann['masks'] = RLEMasks(counts, h, w)
             else:
-                msk = mmcv.imread(data_dir + self.split + '_masks/'+ann['MaskPath'][i],'unchanged')
+                ann['masks'] = self.mask_pack.load_masks(
+                    img_info['filename'], ann['MaskPath'])
+            return ann
 
+        gt_masks = []
+        for mask_bytes in ann_bytes:
+            msk = cv2.imdecode(
+                np.frombuffer(mask_bytes, dtype=np.uint8),
+                cv2.IMREAD_UNCHANGED)
             msk = (msk > 0).astype('uint8')
 
             # most images and their masks don't have same size
             msk = mmcv.imresize(msk, (self.img_infos[idx]['width'], self.img_infos[idx]['height']))
             gt_masks.append(msk)
+        if self.rle_masks:
+            img_info = self.img_infos[idx]
+            gt_masks = RLEMasks.from_masks(gt_masks, img_info['height'],
+                                           img_info['width'])
         ann['masks'] = gt_masks
         return ann
 
+    def get_ann_info(self, idx):
+        # the masks are read concurrently
+        return self.load_ann(
+            idx, self.file_client.get_many(self.get_ann_paths(idx)))
+
        
 class OIDSegParentDataset(OIDSegDataset):
   CLASSES = ('/m/0138tl',
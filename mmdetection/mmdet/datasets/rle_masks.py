@@ -0,0 +1,199 @@
+import mmcv
+import numpy as np
+import pycocotools.mask as maskUtils
+
+
+def rle_counts(counts):
+    """Run lengths of a compressed COCO RLE string, decoded with numpy.
+
+    Same decoding as ``rleFrString`` of pycocotools: every value is a
+    little-endian sequence of 5 bit chars (offset by 48, bit 0x20 set when
+    more chars follow, bit 0x10 of the last one is the sign) and, from the
+    fourth value on, a delta to the value two steps before.
+    """
+    chars = np.frombuffer(counts, dtype=np.uint8).astype(np.int64) - 48
+    if len(chars) == 0:
+        return chars
+    ends = np.flatnonzero((chars & 0x20) == 0)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts + 1
+    # position of every char in its value
+    shifts = np.arange(len(chars)) - np.repeat(starts, lengths)
+    values = np.add.reduceat((chars & 0x1f) << (5 * shifts), starts)
+    negative = (chars[ends] & 0x10) != 0
+    values[negative] -= np.left_shift(1, 5 * lengths[negative])
+    values[2::2] = np.cumsum(values[2::2])
+    values[3::2] += np.cumsum(values[1::2])[:len(values[3::2])]
+    return values
+
+
+class RLEMasks(object):
+    """Instance masks of an image kept as COCO RLE at their original size.
+
+    :class:`MaskTransform` only records the rescaling, flipping and padding
+    of the image on the masks, they are applied when targets are cropped
+    from the masks (:meth:`crop_and_resize`), and only to the pixels sampled
+    for the targets, instead of rescaling, flipping and padding every dense
+    mask.
+
+    Args:
+        counts (Sequence[bytes]): COCO RLE counts of each mask.
+        height (int): height of the masks.
+        width (int): width of the masks.
+    """
+
+    def __init__(self, counts, height, width):
+        self.counts = list(counts)
+        self.height = height
+        self.width = width
+        # size after rescaling, flipped or not, size after padding
+        self.scaled_shape = (height, width)
+        self.flip = False
+        self.pad_shape = (height, width)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def shape(self):
+        """Shape of the transformed masks, like a (n, h, w) array."""
+        return (len(self), ) + tuple(self.pad_shape)
+
+    @classmethod
+    def from_masks(cls, masks, height, width):
+        """Encode dense (h, w) uint8 masks."""
+        counts = [
+            maskUtils.encode(np.asfortranarray(mask))['counts']
+            for mask in masks
+        ]
+        return cls(counts, height, width)
+
+    def transform(self, pad_shape, scale_factor, flip=False):
+        """Masks rescaled by ``scale_factor`` (like ``mmcv.imrescale``),
+        flipped horizontally if ``flip`` then padded to ``pad_shape``."""
+        if isinstance(scale_factor, (int, float)):
+            w_scale = h_scale = scale_factor
+        else:
+            w_scale, h_scale = scale_factor[:2]
+        masks = RLEMasks(self.counts, self.height, self.width)
+        masks.scaled_shape = (int(self.height * float(h_scale) + 0.5),
+                              int(self.width * float(w_scale) + 0.5))
+        masks.flip = flip
+        masks.pad_shape = tuple(pad_shape[:2])
+        return masks
+
+    def decode(self, inds=None):
+        """Original masks ``inds`` (all by default), shape (n, h, w)."""
+        if inds is None:
+            inds = range(len(self))
+        rles = [
+            dict(size=[self.height, self.width], counts=self.counts[i])
+            for i in inds
+        ]
+        if not rles:
+            return np.zeros((0, self.height, self.width), dtype=np.uint8)
+        return maskUtils.decode(rles).transpose(2, 0, 1)
+
+    def to_ndarray(self):
+        """Transformed dense masks, the output of ``MaskTransform`` for dense
+        masks."""
+        masks = [
+            mmcv.imresize(
+                np.ascontiguousarray(mask),
+                self.scaled_shape[::-1],
+                interpolation='nearest') for mask in self.decode()
+        ]
+        if self.flip:
+            masks = [mask[:, ::-1] for mask in masks]
+        masks = [mmcv.impad(mask, self.pad_shape, pad_val=0) for mask in masks]
+        if not masks:
+            return np.zeros(self.shape, dtype=np.uint8)
+        return np.stack(masks, axis=0)
+
+    def _source_index(self, coords, axis):
+        """Pixels of the original masks that the transformed pixels
+        ``coords`` along ``axis`` (0 for rows, 1 for cols) come from, and
+        whether they are inside the rescaled masks (not padding)."""
+        size = (self.height, self.width)[axis]
+        scaled_size = self.scaled_shape[axis]
+        valid = (coords >= 0) & (coords < scaled_size)
+        if axis == 1 and self.flip:
+            coords = scaled_size - 1 - coords
+        # nearest neighbour rescaling, as done by cv2
+        src = np.floor(coords * (size / scaled_size)).astype(np.int64)
+        return np.clip(src, 0, size - 1), valid
+
+    def crop_and_resize(self, bboxes, inds, out_size):
+        """Targets of RoIs: the transformed masks ``inds`` cropped by
+        ``bboxes`` and resized to ``out_size`` (bilinear).
+
+        Equivalent to cropping every transformed dense mask and resizing the
+        crop with ``mmcv.imresize``, for all the RoIs at once and without
+        decoding the masks: the ``out_size`` x ``out_size`` x 4 pixels
+        sampled by every RoI are looked up in the runs of the RLE.
+
+        Args:
+            bboxes (ndarray): RoIs in the transformed masks, shape (n, 4).
+            inds (ndarray): mask of each RoI, shape (n, ).
+            out_size (int): size of the targets.
+
+        Returns:
+            ndarray: uint8 targets, shape (n, out_size, out_size).
+        """
+        num = len(bboxes)
+        if num == 0:
+            return np.zeros((0, out_size, out_size), dtype=np.uint8)
+        # run ends of the masks of the RoIs, the ones of the k-th mask are
+        # offset by k * h * w so that they are searched all at once
+        uniq_inds, roi_masks = np.unique(inds, return_inverse=True)
+        area = self.height * self.width
+        run_ends = [
+            np.cumsum(rle_counts(self.counts[i])) + k * area
+            for k, i in enumerate(uniq_inds)
+        ]
+        first_runs = np.cumsum([0] + [len(x) for x in run_ends])[:-1]
+        run_ends = np.concatenate(run_ends)
+
+        bboxes = bboxes.astype(np.int32)
+        starts = bboxes[:, :2].astype(np.int64)
+        sizes = np.maximum(bboxes[:, 2:] - bboxes[:, :2] + 1, 1)
+        # crops are clipped by the padded masks, like numpy slicing
+        sizes = np.minimum(sizes, np.array(self.pad_shape[::-1]) - starts)
+        sizes = np.maximum(sizes, 1)
+
+        # bilinear sampling positions in the crops, as done by cv2
+        dst = np.arange(out_size) + 0.5
+        src = dst[None, :, None] * (sizes[:, None, :] / out_size) - 0.5
+        src = np.maximum(src, 0)
+        low = np.minimum(np.floor(src).astype(np.int64), sizes[:, None] - 1)
+        frac = np.where(low < sizes[:, None] - 1, src - low, 0)
+        high = np.minimum(low + 1, sizes[:, None] - 1)
+
+        # (n, out_size) source rows / cols of the low and high neighbours
+        taps = []
+        for axis, coord in ((0, 1), (1, 0)):
+            taps.append([
+                self._source_index(starts[:, coord, None] + k[..., coord],
+                                   axis) for k in (low, high)
+            ])
+        # bilinear weights, zero for the padding
+        frac = frac.astype(np.float32)
+        weights_y, weights_x = [[
+            (1 - frac[..., coord]) * taps[axis][0][1],
+            frac[..., coord] * taps[axis][1][1]
+        ] for axis, coord in ((0, 1), (1, 0))]
+
+        # pixel (y, x) of a column-major RLE is at x * h + y, in an odd run
+        # if it is foreground. The targets are computed transposed, (n, x, y),
+        # so that the searched positions are mostly increasing.
+        offsets = (roi_masks * area)[:, None, None]
+        first_runs = first_runs[roi_masks][:, None, None]
+        targets = np.zeros((num, out_size, out_size), dtype=np.float32)
+        for (rows, _), wy in zip(taps[0], weights_y):
+            for (cols, _), wx in zip(taps[1], weights_x):
+                pos = cols[:, :, None] * self.height + rows[:, None, :]
+                runs = np.searchsorted(run_ends, pos + offsets, side='right')
+                values = ((runs - first_runs) & 1).astype(np.float32)
+                targets += values * (wx[:, :, None] * wy[:, None, :])
+        # the masks are uint8 both before and after resizing
+        return (targets >= 0.5).astype(np.uint8).transpose(0, 2, 1)
@@ -8,6 +8,8 @@ import numpy as np
 import torch
 from numpy import random
 
+from .rle_masks import RLEMasks
+
 __all__ = [
     'ImageTransform', 'BboxTransform', 'MaskTransform', 'SegMapTransform',
     'Numpy2Tensor'
@@ -36,7 +38,8 @@ class ImageTransform(object):
             scale_factor = np.array([w_scale, h_scale, w_scale, h_scale],
                                     dtype=np.float32)
         img_shape = img.shape
-        img = mmcv.imnormalize(img, self.mean, self.std, self.to_rgb)
+        if normalize:
+            img = mmcv.imnormalize(img, self.mean, self.std, self.to_rgb)
         if flip:
             img = mmcv.imflip(img)
         if self.size_divisor is not None:
@@ -83,6 +86,9 @@ class MaskTransform(object):
 
 
     def __call__(self, masks, pad_shape, scale_factor, flip=False):
+        if isinstance(masks, RLEMasks):
+            # only recorded, applied when the mask targets are cropped
+            return masks.transform(pad_shape, scale_factor, flip)
         masks = [
             mmcv.imrescale(mask, scale_factor, interpolation='nearest')
             for mask in masks
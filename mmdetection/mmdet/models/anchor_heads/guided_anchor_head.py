@@ -210,12 +210,17 @@ class GuidedAnchorHead(AnchorHead):
     def forward(self, feats):
         return multi_apply(self.forward_single, feats)
 
-    def get_sampled_approxs(self, featmap_sizes, img_metas, cfg):
+    def get_sampled_approxs(self,
+                            featmap_sizes,
+                            img_metas,
+                            cfg,
+                            device='cuda'):
         """Get sampled approxs and inside flags according to feature map sizes.
 
         Args:
             featmap_sizes (list[tuple]): Multi-level feature map sizes.
             img_metas (list[dict]): Image meta info.
+            device (torch.device | str): device of the approxs.
 
         Returns:
             tuple: approxes of each image, inside flags of each image
@@ -228,7 +233,7 @@ class GuidedAnchorHead(AnchorHead):
         multi_level_approxs = []
         for i in range(num_levels):
             approxs = self.approx_generators[i].grid_anchors(
-                featmap_sizes[i], self.anchor_strides[i])
+                featmap_sizes[i], self.anchor_strides[i], device=device)
             multi_level_approxs.append(approxs)
         approxs_list = [multi_level_approxs for _ in range(num_imgs)]
 
@@ -245,7 +250,8 @@ class GuidedAnchorHead(AnchorHead):
                 valid_feat_h = min(int(np.ceil(h / anchor_stride)), feat_h)
                 valid_feat_w = min(int(np.ceil(w / anchor_stride)), feat_w)
                 flags = self.approx_generators[i].valid_flags(
-                    (feat_h, feat_w), (valid_feat_h, valid_feat_w))
+                    (feat_h, feat_w), (valid_feat_h, valid_feat_w),
+                    device=device)
                 inside_flags_list = []
                 for i in range(self.approxs_per_octave):
                     split_valid_flags = flags[i::self.approxs_per_octave]
@@ -267,7 +273,8 @@ class GuidedAnchorHead(AnchorHead):
                     shape_preds,
                     loc_preds,
                     img_metas,
-                    use_loc_filter=False):
+                    use_loc_filter=False,
+                    device='cuda'):
         """Get squares according to feature map sizes and guided
         anchors.
 
@@ -277,6 +284,7 @@ class GuidedAnchorHead(AnchorHead):
             loc_preds (list[tensor]): Multi-level location predictions.
             img_metas (list[dict]): Image meta info.
             use_loc_filter (bool): Use loc filter or not.
+            device (torch.device | str): device of the squares.
 
         Returns:
             tuple: square approxs of each image, guided anchors of each image,
@@ -290,7 +298,7 @@ class GuidedAnchorHead(AnchorHead):
         multi_level_squares = []
         for i in range(num_levels):
             squares = self.square_generators[i].grid_anchors(
-                featmap_sizes[i], self.anchor_strides[i])
+                featmap_sizes[i], self.anchor_strides[i], device=device)
             multi_level_squares.append(squares)
         squares_list = [multi_level_squares for _ in range(num_imgs)]
 
@@ -414,11 +422,12 @@ class GuidedAnchorHead(AnchorHead):
             ignore_ratio=cfg.ignore_ratio)
 
         # get sampled approxes
+        device = cls_scores[0].device
         approxs_list, inside_flag_list = self.get_sampled_approxs(
-            featmap_sizes, img_metas, cfg)
+            featmap_sizes, img_metas, cfg, device=device)
         # get squares and guided anchors
         squares_list, guided_anchors_list, _ = self.get_anchors(
-            featmap_sizes, shape_preds, loc_preds, img_metas)
+            featmap_sizes, shape_preds, loc_preds, img_metas, device=device)
 
         # get shape targets
         sampling = False if not hasattr(cfg, 'ga_sampler') else True
@@ -521,7 +530,8 @@ class GuidedAnchorHead(AnchorHead):
             shape_preds,
             loc_preds,
             img_metas,
-            use_loc_filter=not self.training)
+            use_loc_filter=not self.training,
+            device=cls_scores[0].device)
         result_list = []
         for img_id in range(len(img_metas)):
             cls_score_list = [
@@ -3,10 +3,12 @@ from abc import ABCMeta, abstractmethod
 
 import mmcv
 import numpy as np
+import torch
 import torch.nn as nn
 import pycocotools.mask as maskUtils
 
-from mmdet.core import tensor2imgs, get_classes, auto_fp16
+from mmdet.core import (tensor2imgs, get_classes, auto_fp16,
+                        normalize_img_tensor)
 
 
 class BaseDetector(nn.Module):
@@ -14,6 +16,9 @@ class BaseDetector(nn.Module):
 
     __metaclass__ = ABCMeta
 
+    # whether aug_test handles more than one image per gpu
+    batched_test = False
+
     def __init__(self):
         super(BaseDetector, self).__init__()
         self.fp16_enabled = False
@@ -73,15 +78,42 @@ class BaseDetector(nn.Module):
                     len(imgs), len(img_metas)))
         # TODO: remove the restriction of imgs_per_gpu == 1 when prepared
         imgs_per_gpu = imgs[0].size(0)
-        assert imgs_per_gpu == 1
+        assert imgs_per_gpu == 1 or self.batched_test
 
         if num_augs == 1:
             return self.aug_test(imgs, img_metas, **kwargs)
         else:
             return self.aug_test(imgs, img_metas, **kwargs)
 
-    @auto_fp16(apply_to=('img', ))
+    def normalize_raw_img(self, img, img_meta):
+        """Normalize the raw images of a dataset with ``img_uint8``.
+
+        Their metas carry the ``img_norm_cfg``, the images of the other
+        datasets are returned as they are.
+
+        Args:
+            img (Tensor or list[Tensor]): images, or images of each
+                augmentation.
+            img_meta (list[dict] or list[list[dict]]): their metas.
+        """
+        if isinstance(img, (list, tuple)):
+            return [
+                self.normalize_raw_img(_img, _img_meta)
+                for _img, _img_meta in zip(img, img_meta)
+            ]
+        if 'img_norm_cfg' not in img_meta[0]:
+            return img
+        return normalize_img_tensor(
+            img, [meta['img_shape'] for meta in img_meta],
+            **img_meta[0]['img_norm_cfg'])
+
     def forward(self, img, img_meta, return_loss=True, **kwargs):
+        # raw images are normalized in float32, before the fp16 cast
+        img = self.normalize_raw_img(img, img_meta)
+        return self._forward(img, img_meta, return_loss=return_loss, **kwargs)
+
+    @auto_fp16(apply_to=('img', ))
+    def _forward(self, img, img_meta, return_loss=True, **kwargs):
         if return_loss:
             return self.forward_train(img, img_meta, **kwargs)
         else:
@@ -100,7 +132,14 @@ class BaseDetector(nn.Module):
 
         img_tensor = data['img'][0]
         img_metas = data['img_meta'][0].data[0]
-        imgs = tensor2imgs(img_tensor, **img_norm_cfg)
+        if img_tensor.dtype == torch.uint8:
+            # raw BGR images of a dataset with img_uint8
+            imgs = [
+                np.ascontiguousarray(img.cpu().numpy().transpose(1, 2, 0))
+                for img in img_tensor
+            ]
+        else:
+            imgs = tensor2imgs(img_tensor, **img_norm_cfg)
         assert len(imgs) == len(img_metas)
 
         if dataset is None:
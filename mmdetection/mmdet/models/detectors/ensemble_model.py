@@ -1,13 +1,90 @@
+import numpy as np
+import torch
 from torch import nn
 from mmdet.core import (bbox2result, bbox_mapping)
 from mmdet.core import (bbox2roi, merge_aug_masks, merge_aug_bboxes, multiclass_nms, merge_aug_proposals)
+from mmdet.core import flip_result, fuse_results
 from mmdet.models.detectors import BaseDetector
 
 
+class FeatureCache(object):
+    """Features of every (model, augmentation) of a batch, shared by the RPN,
+    bbox and mask passes of :meth:`EnsembleModel.aug_test`.
+
+    Args:
+        policy (str): 'keep' the features where they are computed, 'offload'
+            them to pinned CPU memory and copy them back when needed, or
+            'recompute' them for every pass.
+        max_bytes (int, optional): budget of the cached features, the
+            features that do not fit are recomputed. No limit by default.
+    """
+
+    def __init__(self, policy='keep', max_bytes=None):
+        assert policy in ('keep', 'offload', 'recompute')
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.reset()
+
+    def reset(self):
+        self._feats = {}
+        self.nbytes = 0
+
+    def _offload(self, feat):
+        cpu_feat = torch.empty(
+            feat.size(),
+            dtype=feat.dtype,
+            pin_memory=feat.is_cuda)
+        cpu_feat.copy_(feat, non_blocking=True)
+        return cpu_feat
+
+    def get(self, key, model, img):
+        """Features of ``img`` by ``model``, computed only once per key."""
+        if key in self._feats:
+            feats = self._feats[key]
+            if self.policy == 'offload':
+                feats = tuple(
+                    f.to(img.device, non_blocking=True) for f in feats)
+            return feats
+        feats = model.extract_feat(img)
+        if self.policy == 'recompute':
+            return feats
+        nbytes = sum(f.numel() * f.element_size() for f in feats)
+        if self.max_bytes is None or self.nbytes + nbytes <= self.max_bytes:
+            if self.policy == 'offload':
+                self._feats[key] = tuple(self._offload(f) for f in feats)
+            else:
+                self._feats[key] = feats
+            self.nbytes += nbytes
+        return feats
+
+
 class EnsembleModel(BaseDetector):
-    def __init__(self, models):
+    """Test time ensemble of several cascade detectors.
+
+    Args:
+        models (list[nn.Module]): cascade detectors with the same classes.
+        feat_cache (dict, optional): arguments of :class:`FeatureCache`, by
+            default the backbone and neck run once per (model, augmentation)
+            and their features are kept on the device.
+        fusion (dict, optional): late fusion instead of merging the models
+            per proposal: arguments of :func:`fuse_results` (``method``
+            'wbf' or 'soft_merge', ``iou_thr``, ...) and ``model_weights``.
+            See :meth:`late_fusion_test`.
+    """
+
+    batched_test = True
+
+    def __init__(self, models, feat_cache=None, fusion=None):
         super().__init__()
         self.models = nn.ModuleList(models)
+        self.feat_cache = FeatureCache(
+            **(feat_cache if feat_cache is not None else {}))
+        self.fusion = fusion
+
+    def _extract_feats(self, model_idx, imgs):
+        model = self.models[model_idx]
+        for aug_idx, img in enumerate(imgs):
+            yield self.feat_cache.get((model_idx, aug_idx), model, img)
 
     def simple_test(self, img, img_meta, **kwargs):
         pass
@@ -18,45 +95,99 @@ class EnsembleModel(BaseDetector):
     def extract_feat(self, imgs):
         pass
 
+    def late_fusion_test(self, imgs, img_metas):
+        """Test with augmentations, fusing the detections of the models.
+
+        Every model runs its own ``simple_test`` on every augmentation of an
+        image, on the device of the model, and the detections of all these
+        runs are fused by :func:`fuse_results` (weighted box fusion or soft
+        merging of the boxes, averaging of the masks of each fused box), once
+        the runs of flipped images are mapped back (:func:`flip_result`). The
+        models do not share proposals, so they can also be run apart (other
+        devices or processes) and fused afterwards, see
+        ``tools/fuse_results.py``.
+
+        Returns:
+            list: (bbox_result, segm_result), or bbox_result without mask,
+                of each image.
+        """
+        fusion = dict(self.fusion)
+        model_weights = fusion.pop('model_weights', None)
+        if model_weights is None:
+            model_weights = [1.] * len(self.models)
+        rcnn_test_cfg = self.models[0].test_cfg.rcnn
+        fusion.setdefault('max_per_img', rcnn_test_cfg.max_per_img)
+        if self.models[0].with_mask:
+            fusion.setdefault('mask_thr', rcnn_test_cfg.mask_thr_binary)
+
+        results = []
+        for i in range(len(img_metas[0])):
+            run_results, run_weights = [], []
+            for model, weight in zip(self.models, model_weights):
+                device = next(model.parameters()).device
+                for img, img_meta in zip(imgs, img_metas):
+                    result = model.simple_test(
+                        img[i:i + 1].to(device), [img_meta[i]],
+                        rescale=True)
+                    # simple_test only rescales, a flipped run is mirrored
+                    if img_meta[i]['flip']:
+                        result = flip_result(result, img_meta[i])
+                    run_results.append(result)
+                    run_weights.append(weight)
+            results.append(fuse_results(run_results, run_weights, **fusion))
+        return results
+
     def aug_test(self, imgs, img_metas, **kwargs):
         """Test with augmentations.
-        If rescale is False, then returned bboxes and masks will fit the scale
-        of imgs[0].
+
+        All the images of the batch go through the same forward passes of
+        the backbone, RPN and RoI heads, the outputs are only split per
+        image for the box regression, the merging of augmentations and the
+        NMS. Bboxes and masks are rescaled to the original image size.
+
+        Returns:
+            list: (bbox_result, segm_result), or bbox_result without mask,
+                of each image.
         """
+        if self.fusion is not None:
+            return self.late_fusion_test(imgs, img_metas)
+        self.feat_cache.reset()
         rpn_test_cfg = self.models[0].test_cfg.rpn
         #print(rpn_test_cfg)
         imgs_per_gpu = len(img_metas[0])
         aug_proposals = [[] for _ in range(imgs_per_gpu)]
-        for model in self.models:
-            # recompute feats to save memory
-            for x, img_meta in zip(model.extract_feats(imgs), img_metas):
+        for k, model in enumerate(self.models):
+            # whether feats are kept or recomputed is up to self.feat_cache
+            for x, img_meta in zip(self._extract_feats(k, imgs), img_metas):
                 proposal_list = model.simple_test_rpn(x, img_meta, rpn_test_cfg)
                 for i, proposals in enumerate(proposal_list):
                     aug_proposals[i].append(proposals)
+        # meta of the i-th image in every (model, augmentation), in the
+        # (list of) list format of merge_aug_bboxes and merge_aug_masks
+        aug_img_metas = [[[img_meta[i]] for _ in self.models
+                          for img_meta in img_metas]
+                         for i in range(imgs_per_gpu)]
         # after merging, proposals will be rescaled to the original image size
         proposal_list = [
-            merge_aug_proposals(proposals, img_meta, rpn_test_cfg)
-            for proposals, img_meta in zip(aug_proposals, img_metas)
+            merge_aug_proposals(proposals, [meta for meta, in metas],
+                                rpn_test_cfg)
+            for proposals, metas in zip(aug_proposals, aug_img_metas)
         ]
+        num_rois = [proposals.size(0) for proposals in proposal_list]
 
         rcnn_test_cfg = self.models[0].test_cfg.rcnn
         #print(rcnn_test_cfg)
-        aug_bboxes = []
-        aug_scores = []
-        aug_img_metas = []
-        for model in self.models:
-            for x, img_meta in zip(model.extract_feats(imgs), img_metas):
-                # only one image in the batch
-                img_shape = img_meta[0]['img_shape']
-                scale_factor = img_meta[0]['scale_factor']
-                flip = img_meta[0]['flip']
-
-                proposals = bbox_mapping(proposal_list[0][:, :4], img_shape,
-                                         scale_factor, flip)
+        aug_bboxes = [[] for _ in range(imgs_per_gpu)]
+        aug_scores = [[] for _ in range(imgs_per_gpu)]
+        for k, model in enumerate(self.models):
+            for x, img_meta in zip(self._extract_feats(k, imgs), img_metas):
+                rois = bbox2roi([
+                    bbox_mapping(proposals[:, :4], meta['img_shape'],
+                                 meta['scale_factor'], meta['flip'])
+                    for proposals, meta in zip(proposal_list, img_meta)
+                ])
                 # "ms" in variable names means multi-stage
                 ms_scores = []
-
-                rois = bbox2roi([proposals])
                 for i in range(model.num_stages):
                     bbox_head = model.bbox_head[i]
                     cls_score, bbox_pred = model._bbox_forward_test(i, x, rois)
@@ -64,64 +195,86 @@ class EnsembleModel(BaseDetector):
 
                     if i < model.num_stages - 1:
                         bbox_label = cls_score.argmax(dim=1)
-                        rois = bbox_head.regress_by_class(rois, bbox_label, bbox_pred,
-                                                          img_meta[0])
+                        rois = torch.cat([
+                            bbox_head.regress_by_class(_rois, _label, _pred,
+                                                       meta)
+                            for _rois, _label, _pred, meta in zip(
+                                rois.split(num_rois),
+                                bbox_label.split(num_rois),
+                                bbox_pred.split(num_rois), img_meta)
+                        ])
 
                 cls_score = sum(ms_scores) / float(len(ms_scores))
-                bboxes, scores = model.bbox_head[-1].get_det_bboxes(
-                    rois,
-                    cls_score,
-                    bbox_pred,
-                    img_shape,
-                    scale_factor,
-                    rescale=False,
-                    cfg=None)
-                aug_bboxes.append(bboxes)
-                aug_scores.append(scores)
-                aug_img_metas.append(img_meta)
-
-        # after merging, bboxes will be rescaled to the original image size
-        merged_bboxes, merged_scores = merge_aug_bboxes(
-            aug_bboxes, aug_scores, aug_img_metas, rcnn_test_cfg)
-        det_bboxes, det_labels = multiclass_nms(
-            merged_bboxes, merged_scores, rcnn_test_cfg.score_thr,
-            rcnn_test_cfg.nms, rcnn_test_cfg.max_per_img)
-
-        bbox_result = bbox2result(det_bboxes, det_labels, self.models[0].bbox_head[-1].num_classes)
+                for j, (_rois, _score, _pred, meta) in enumerate(
+                        zip(rois.split(num_rois), cls_score.split(num_rois),
+                            bbox_pred.split(num_rois), img_meta)):
+                    bboxes, scores = model.bbox_head[-1].get_det_bboxes(
+                        _rois,
+                        _score,
+                        _pred,
+                        meta['img_shape'],
+                        meta['scale_factor'],
+                        rescale=False,
+                        cfg=None)
+                    aug_bboxes[j].append(bboxes)
+                    aug_scores[j].append(scores)
 
-        if self.models[0].with_mask:
-            if det_bboxes.shape[0] == 0:
+        det_bboxes = []
+        det_labels = []
+        bbox_results = []
+        for j in range(imgs_per_gpu):
+            # after merging, bboxes will be rescaled to the original image size
+            merged_bboxes, merged_scores = merge_aug_bboxes(
+                aug_bboxes[j], aug_scores[j], aug_img_metas[j], rcnn_test_cfg)
+            _det_bboxes, _det_labels = multiclass_nms(
+                merged_bboxes, merged_scores, rcnn_test_cfg.score_thr,
+                rcnn_test_cfg.nms, rcnn_test_cfg.max_per_img)
+            det_bboxes.append(_det_bboxes)
+            det_labels.append(_det_labels)
+            bbox_results.append(
+                bbox2result(_det_bboxes, _det_labels,
+                            self.models[0].bbox_head[-1].num_classes))
+        num_dets = [_det_bboxes.size(0) for _det_bboxes in det_bboxes]
+
+        if not self.models[0].with_mask:
+            self.feat_cache.reset()
+            return bbox_results
+
+        aug_masks = [[] for _ in range(imgs_per_gpu)]
+        aug_mask_metas = [[] for _ in range(imgs_per_gpu)]
+        if sum(num_dets) > 0:
+            for k, model in enumerate(self.models):
+                for x, img_meta in zip(self._extract_feats(k, imgs), img_metas):
+                    mask_rois = bbox2roi([
+                        bbox_mapping(_det_bboxes[:, :4], meta['img_shape'],
+                                     meta['scale_factor'], meta['flip'])
+                        for _det_bboxes, meta in zip(det_bboxes, img_meta)
+                    ])
+                    mask_roi_extractor = model.mask_roi_extractor[-1]
+                    mask_feats = mask_roi_extractor(
+                        x[:len(mask_roi_extractor.featmap_strides)],
+                        mask_rois)
+                    if model.with_shared_head:
+                        mask_feats = model.shared_head(mask_feats)
+                    for i in range(model.num_stages):
+                        mask_head = model.mask_head[i]
+                        mask_pred = mask_head(mask_feats).sigmoid().cpu().numpy()
+                        for j, _mask_pred in enumerate(
+                                np.split(mask_pred, np.cumsum(num_dets)[:-1])):
+                            aug_masks[j].append(_mask_pred)
+                            aug_mask_metas[j].append([img_meta[j]])
+        self.feat_cache.reset()
+
+        results = []
+        for j in range(imgs_per_gpu):
+            if num_dets[j] == 0:
                 segm_result = [[] for _ in range(self.models[0].mask_head[-1].num_classes - 1)]
             else:
-                aug_masks = []
-                aug_img_metas = []
-                for model in self.models:
-                    for x, img_meta in zip(model.extract_feats(imgs), img_metas):
-                        img_shape = img_meta[0]['img_shape']
-                        scale_factor = img_meta[0]['scale_factor']
-                        flip = img_meta[0]['flip']
-                        _bboxes = bbox_mapping(det_bboxes[:, :4], img_shape,
-                                               scale_factor, flip)
-                        mask_rois = bbox2roi([_bboxes])
-                        mask_roi_extractor = model.mask_roi_extractor[-1]
-                        mask_feats = mask_roi_extractor(
-                            x[:len(mask_roi_extractor.featmap_strides)],
-                            mask_rois)
-                        if model.with_shared_head:
-                            mask_feats = self.shared_head(mask_feats)
-                        last_feat = None
-                        for i in range(model.num_stages):
-                            mask_head = model.mask_head[i]
-                            mask_pred = mask_head(mask_feats)
-                            aug_masks.append(mask_pred.sigmoid().cpu().numpy())
-                            aug_img_metas.append(img_meta)
-                merged_masks = merge_aug_masks(aug_masks, aug_img_metas, rcnn_test_cfg)
-
-                ori_shape = img_metas[0][0]['ori_shape']
+                merged_masks = merge_aug_masks(aug_masks[j], aug_mask_metas[j],
+                                               rcnn_test_cfg)
+                ori_shape = img_metas[0][j]['ori_shape']
                 segm_result = self.models[0].mask_head[-1].get_seg_masks(
-                    merged_masks, det_bboxes, det_labels, rcnn_test_cfg,
+                    merged_masks, det_bboxes[j], det_labels[j], rcnn_test_cfg,
                     ori_shape, scale_factor=1.0, rescale=False)
-            return bbox_result, segm_result
-        else:
-            return bbox_result
-  
+            results.append((bbox_results[j], segm_result))
+        return results
@@ -138,6 +138,10 @@ class FCNMaskHead(nn.Module):
         Returns:
             list[list]: encoded masks
         """
+        if rcnn_test_cfg.get('batched_paste', False):
+            return self.get_seg_masks_batched(mask_pred, det_bboxes,
+                                              det_labels, rcnn_test_cfg,
+                                              ori_shape, scale_factor, rescale)
         if isinstance(mask_pred, torch.Tensor):
             mask_pred = mask_pred.sigmoid().cpu().numpy()
         assert isinstance(mask_pred, np.ndarray)
@@ -177,3 +181,157 @@ class FCNMaskHead(nn.Module):
             cls_segms[label - 1].append(rle)
 
         return cls_segms
+
+    def get_seg_masks_batched(self,
+                              mask_pred,
+                              det_bboxes,
+                              det_labels,
+                              rcnn_test_cfg,
+                              ori_shape,
+                              scale_factor,
+                              rescale,
+                              max_chunk_pixels=2**24):
+        """Same as :meth:`get_seg_masks`, with the masks of all the boxes
+        resized at once and only inside their boxes.
+
+        The masks are resized by chunks of boxes of similar sizes, on the
+        device of ``mask_pred``: the bilinear resizing is separable, so it is
+        done for a whole chunk by two batched matrix products with the
+        interpolation weights of the rows and of the columns of every box.
+        The RLE of every box region is shifted to the box position in the
+        image instead of encoding a whole image per box. Enabled by
+        ``batched_paste=True`` in ``rcnn_test_cfg``.
+
+        Args:
+            max_chunk_pixels (int): max number of pixels of the box regions
+                (padded to the largest of the chunk) resized at once, chunks
+                are also cut when padding would double their pixels.
+        """
+        # when enabling mixed precision training, mask_pred may be float16
+        if isinstance(mask_pred, torch.Tensor):
+            mask_pred = mask_pred.float().sigmoid()
+        else:
+            mask_pred = torch.from_numpy(mask_pred.astype(np.float32))
+
+        cls_segms = [[] for _ in range(self.num_classes - 1)]
+        num = mask_pred.size(0)
+        if num == 0:
+            return cls_segms
+        bboxes = det_bboxes.cpu().numpy()[:, :4]
+        labels = det_labels.cpu().numpy() + 1
+
+        if rescale:
+            img_h, img_w = ori_shape[:2]
+        else:
+            img_h = np.round(ori_shape[0] * scale_factor).astype(np.int32)
+            img_w = np.round(ori_shape[1] * scale_factor).astype(np.int32)
+            scale_factor = 1.0
+        img_h, img_w = int(img_h), int(img_w)
+
+        bboxes = (bboxes / scale_factor).astype(np.int32).astype(np.int64)
+        sizes = np.maximum(bboxes[:, 2:] - bboxes[:, :2] + 1, 1)
+        if self.class_agnostic:
+            mask_pred = mask_pred[:, 0]
+        else:
+            mask_pred = mask_pred[torch.arange(num), torch.from_numpy(
+                labels).to(mask_pred.device)]
+
+        # chunks of boxes sorted by height, cut when the padding to the
+        # largest box of the chunk would waste too much
+        order = np.argsort(sizes[:, 1], kind='mergesort')
+        areas = sizes[:, 0] * sizes[:, 1]
+        chunks = []
+        start = 0
+        for end in range(2, num + 1):
+            inds = order[start:end]
+            padded = len(inds) * sizes[inds, 0].max() * sizes[inds, 1].max()
+            if padded > max_chunk_pixels or padded > 2 * areas[inds].sum():
+                chunks.append(order[start:end - 1])
+                start = end - 1
+        chunks.append(order[start:])
+
+        rles = [None] * num
+        for inds in chunks:
+            inds_t = torch.from_numpy(inds).to(mask_pred.device)
+            chunk_rles = self._paste_chunk(mask_pred[inds_t], bboxes[inds],
+                                           sizes[inds], (img_h, img_w),
+                                           rcnn_test_cfg.mask_thr_binary)
+            for i, rle in zip(inds, chunk_rles):
+                rles[i] = rle
+        for i in range(num):
+            cls_segms[labels[i] - 1].append(rles[i])
+        return cls_segms
+
+    @staticmethod
+    def _resize_weights(sizes, starts, out_len, in_len, img_len, border=0):
+        """Bilinear interpolation weights (n, out_len + 2 * border, in_len)
+        resizing ``in_len`` pixels to ``sizes`` (n, ), as done by cv2: half
+        pixel centers and clamped to the borders. Pixels out of the sizes or
+        of the image, and ``border`` pixels on both sides, have no weight."""
+        n = sizes.size(0)
+        dst = torch.arange(
+            -border, out_len + border, device=sizes.device)
+        src = ((dst[None].float() + 0.5) * in_len / sizes[:, None].float() -
+               0.5).clamp(0, in_len - 1)
+        low = src.floor()
+        frac = src - low
+        low = low.long()
+        high = (low + 1).clamp(max=in_len - 1)
+        pos = dst[None] + starts[:, None]
+        valid = ((dst[None] >= 0) & (dst[None] < sizes[:, None]) &
+                 (pos >= 0) & (pos < img_len)).float()
+        weights = src.new_zeros((n, dst.size(0), in_len))
+        weights.scatter_add_(2, low[..., None],
+                             ((1 - frac) * valid)[..., None])
+        weights.scatter_add_(2, high[..., None], (frac * valid)[..., None])
+        return weights
+
+    def _paste_chunk(self, mask_pred, bboxes, sizes, img_size, thr):
+        """RLEs of the masks ``mask_pred`` (n, mask_h, mask_w) resized to
+        ``sizes`` (n, 2) and pasted at ``bboxes`` in an image of
+        ``img_size``."""
+        device = mask_pred.device
+        mask_h, mask_w = mask_pred.shape[-2:]
+        img_h, img_w = img_size
+        max_w, max_h = (int(s) for s in sizes.max(0))
+        sizes_t = torch.from_numpy(sizes).to(device)
+        starts_t = torch.from_numpy(bboxes[:, :2]).to(device)
+        weights_x = self._resize_weights(sizes_t[:, 0], starts_t[:, 0], max_w,
+                                         mask_w, img_w)
+        weights_y = self._resize_weights(
+            sizes_t[:, 1], starts_t[:, 1], max_h, mask_h, img_h, border=1)
+        # transposed masks (n, w, h + 2) of the box regions, column-major
+        # like RLE, with a zero row above and below
+        masks = weights_x.bmm(mask_pred.transpose(1, 2)).bmm(
+            weights_y.transpose(1, 2))
+        masks = (masks > thr).cpu().numpy().ravel()
+
+        # value changes along the columns of the box regions are the run
+        # boundaries of the column-major RLE of the image
+        changes = np.flatnonzero(masks[1:] != masks[:-1]) + 1
+        boxes, changes = np.divmod(changes, max_w * (max_h + 2))
+        cols, rows = np.divmod(changes, max_h + 2)
+        pos = (bboxes[boxes, 0] + cols) * img_h + bboxes[boxes, 1] + rows - 1
+        splits = np.searchsorted(boxes, np.arange(1, len(bboxes)))
+
+        rles = []
+        for box_pos in np.split(pos, splits):
+            # a run ending at the bottom of a column and one starting at the
+            # top of the next one are a single run
+            dup = np.zeros(len(box_pos), dtype=bool)
+            if len(box_pos) > 1:
+                same = box_pos[1:] == box_pos[:-1]
+                dup[1:] |= same
+                dup[:-1] |= same
+            box_pos = box_pos[~dup]
+            counts = np.diff(
+                np.concatenate([[0], box_pos, [img_h * img_w]]))
+            if len(counts) > 1 and counts[-1] == 0:
+                # a mask ending on the last pixel, no trailing empty run in
+                # the canonical RLE (that of mask_util.encode)
+                counts = counts[:-1]
+            rles.append(
+                mask_util.frPyObjects(
+                    dict(counts=counts.tolist(), size=[img_h, img_w]), img_h,
+                    img_w))
+        return rles
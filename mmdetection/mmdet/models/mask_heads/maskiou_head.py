@@ -148,6 +148,9 @@ class MaskIoUHead(nn.Module):
             area_ratios = []
             proposals_np = pos_proposals.cpu().numpy()
             pos_assigned_gt_inds = pos_assigned_gt_inds.cpu().numpy()
+            if not isinstance(gt_masks, np.ndarray):
+                # RLEMasks
+                gt_masks = gt_masks.to_ndarray()
             # compute mask areas of gt instances (batch processing for speedup)
             gt_instance_mask_area = gt_masks.sum((-1, -2))
             for i in range(num_pos):
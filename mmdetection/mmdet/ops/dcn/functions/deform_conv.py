@@ -2,7 +2,12 @@ import torch
 from torch.autograd import Function
 from torch.nn.modules.utils import _pair
 
-from .. import deform_conv_cuda
+from .deform_conv_cpu import deform_conv_cpu, modulated_deform_conv_cpu
+
+try:
+    from .. import deform_conv_cuda
+except ImportError:  # built without CUDA, only the CPU ops are available
+    deform_conv_cuda = None
 
 
 class DeformConvFunction(Function):
@@ -177,5 +182,42 @@ class ModulatedDeformConvFunction(Function):
         return n, channels_out, height_out, width_out
 
 
-deform_conv = DeformConvFunction.apply
-modulated_deform_conv = ModulatedDeformConvFunction.apply
+def deform_conv(input,
+                offset,
+                weight,
+                stride=1,
+                padding=0,
+                dilation=1,
+                groups=1,
+                deformable_groups=1,
+                im2col_step=64):
+    """Deformable conv, with the CUDA op for CUDA tensors and
+    :func:`deform_conv_cpu` otherwise."""
+    if input.is_cuda:
+        return DeformConvFunction.apply(input, offset, weight, stride,
+                                        padding, dilation, groups,
+                                        deformable_groups, im2col_step)
+    return deform_conv_cpu(input, offset, weight, stride, padding, dilation,
+                           groups, deformable_groups)
+
+
+def modulated_deform_conv(input,
+                          offset,
+                          mask,
+                          weight,
+                          bias=None,
+                          stride=1,
+                          padding=0,
+                          dilation=1,
+                          groups=1,
+                          deformable_groups=1):
+    """Modulated deformable conv, with the CUDA op for CUDA tensors and
+    :func:`modulated_deform_conv_cpu` otherwise."""
+    if input.is_cuda:
+        return ModulatedDeformConvFunction.apply(input, offset, mask, weight,
+                                                 bias, stride, padding,
+                                                 dilation, groups,
+                                                 deformable_groups)
+    return modulated_deform_conv_cpu(input, offset, mask, weight, bias,
+                                     stride, padding, dilation, groups,
+                                     deformable_groups)
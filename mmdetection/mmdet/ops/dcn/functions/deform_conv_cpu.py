@@ -0,0 +1,147 @@
+import torch
+from torch.nn.modules.utils import _pair
+
+
+def _output_size(input, weight, stride, padding, dilation):
+    out_size = []
+    for d in range(2):
+        kernel = dilation[d] * (weight.size(d + 2) - 1) + 1
+        out_size.append(
+            (input.size(d + 2) + 2 * padding[d] - kernel) // stride[d] + 1)
+    if min(out_size) <= 0:
+        raise ValueError(
+            "convolution input is too small (output would be {})".format(
+                'x'.join(map(str, out_size))))
+    return out_size
+
+
+def _deform_columns(input, offset, kernel_size, out_size, stride, padding,
+                    dilation, deformable_groups, mask=None):
+    """Deformable im2col of one image, as ``deformable_im2col`` (and
+    ``modulated_deformable_im2col`` with a mask) of the CUDA op.
+
+    Args:
+        input (Tensor): (C, H, W).
+        offset (Tensor): (dg * kh * kw * 2, out_h, out_w), (dy, dx) pairs.
+        mask (Tensor, optional): (dg * kh * kw, out_h, out_w).
+
+    Returns:
+        Tensor: (C * kh * kw, out_h * out_w) columns.
+    """
+    channels, height, width = input.size()
+    kernel_h, kernel_w = kernel_size
+    out_h, out_w = out_size
+    num_kernel = kernel_h * kernel_w
+    num_out = out_h * out_w
+    dg = deformable_groups
+
+    # sampling positions without the offsets, (kh, kw, out_h, out_w)
+    device = input.device
+    kernel_y = torch.arange(kernel_h, device=device) * dilation[0]
+    kernel_x = torch.arange(kernel_w, device=device) * dilation[1]
+    out_y = torch.arange(out_h, device=device) * stride[0] - padding[0]
+    out_x = torch.arange(out_w, device=device) * stride[1] - padding[1]
+    base_y = kernel_y[:, None, None, None] + out_y[:, None]
+    base_x = kernel_x[:, None, None] + out_x
+    base_y = base_y.expand(kernel_h, kernel_w, out_h, out_w)
+    base_x = base_x.expand(kernel_h, kernel_w, out_h, out_w)
+    offset = offset.view(dg, num_kernel, 2, num_out)
+    ys = base_y.reshape(1, num_kernel, num_out).type_as(offset)
+    xs = base_x.reshape(1, num_kernel, num_out).type_as(offset)
+    ys = (ys + offset[:, :, 0]).view(dg, -1)
+    xs = (xs + offset[:, :, 1]).view(dg, -1)
+
+    # points beyond one pixel of the border are 0, so are the out of bounds
+    # corners of the others
+    inside = ((ys > -1) & (ys < height) & (xs > -1) & (xs < width))
+    y_low = ys.detach().floor()
+    x_low = xs.detach().floor()
+    ly = ys - y_low
+    lx = xs - x_low
+    y_low = y_low.long()
+    x_low = x_low.long()
+    input = input.view(dg, channels // dg, height * width)
+    columns = 0
+    for y, wy in ((y_low, 1 - ly), (y_low + 1, ly)):
+        for x, wx in ((x_low, 1 - lx), (x_low + 1, lx)):
+            valid = inside & (y >= 0) & (y < height) & (x >= 0) & (x < width)
+            pos = (y.clamp(0, height - 1) * width + x.clamp(0, width - 1))
+            values = input.gather(
+                2, pos[:, None].expand(-1, input.size(1), -1))
+            weight = wy * wx * valid.type_as(wy)
+            columns = columns + values * weight[:, None]
+    # (dg, C / dg, kh * kw * out_h * out_w)
+    if mask is not None:
+        columns = columns * mask.reshape(dg, 1, -1)
+    return columns.view(channels * num_kernel, num_out)
+
+
+def _deform_conv(input, offset, weight, bias, stride, padding, dilation,
+                 groups, deformable_groups, mask=None):
+    stride = _pair(stride)
+    padding = _pair(padding)
+    dilation = _pair(dilation)
+    kernel_size = weight.size()[2:]
+    out_size = _output_size(input, weight, stride, padding, dilation)
+    out_channels = weight.size(0)
+    weight = weight.view(groups, out_channels // groups, -1)
+    outputs = []
+    for i in range(input.size(0)):
+        columns = _deform_columns(input[i], offset[i], kernel_size, out_size,
+                                  stride, padding, dilation,
+                                  deformable_groups,
+                                  None if mask is None else mask[i])
+        output = weight.bmm(columns.view(groups, -1, columns.size(1)))
+        outputs.append(output.view(out_channels, *out_size))
+    output = torch.stack(outputs)
+    if bias is not None:
+        output = output + bias.view(1, -1, 1, 1)
+    return output
+
+
+def deform_conv_cpu(input,
+                    offset,
+                    weight,
+                    stride=1,
+                    padding=0,
+                    dilation=1,
+                    groups=1,
+                    deformable_groups=1):
+    """Deformable conv with torch ops, same results as the CUDA op.
+
+    The columns of each image are bilinearly sampled at the offset kernel
+    positions (``deformable_im2col``) and multiplied by the weight of each
+    group. Backward is done by autograd, w.r.t. the input, the offsets and
+    the weight.
+
+    Args:
+        input (Tensor): (N, C, H, W).
+        offset (Tensor): (N, dg * kh * kw * 2, out_h, out_w).
+        weight (Tensor): (C_out, C / groups, kh, kw).
+
+    Returns:
+        Tensor: (N, C_out, out_h, out_w).
+    """
+    if input.dim() != 4:
+        raise ValueError(
+            "Expected 4D tensor as input, got {}D tensor instead.".format(
+                input.dim()))
+    return _deform_conv(input, offset, weight, None, stride, padding,
+                        dilation, groups, deformable_groups)
+
+
+def modulated_deform_conv_cpu(input,
+                              offset,
+                              mask,
+                              weight,
+                              bias=None,
+                              stride=1,
+                              padding=0,
+                              dilation=1,
+                              groups=1,
+                              deformable_groups=1):
+    """Modulated deformable conv (DCNv2) with torch ops, same results as
+    the CUDA op: :func:`deform_conv_cpu` with the sampled columns scaled by
+    ``mask``, of shape (N, dg * kh * kw, out_h, out_w), and a bias."""
+    return _deform_conv(input, offset, weight, bias, stride, padding,
+                        dilation, groups, deformable_groups, mask)
@@ -1,7 +1,10 @@
 import torch
 from torch.autograd import Function
 
-from .. import deform_pool_cuda
+try:
+    from .. import deform_pool_cuda
+except ImportError:  # built without CUDA, deformable RoI pooling is CUDA only
+    deform_pool_cuda = None
 
 
 class DeformRoIPoolingFunction(Function):
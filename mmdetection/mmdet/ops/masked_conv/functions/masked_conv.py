@@ -2,7 +2,13 @@ import math
 import torch
 from torch.autograd import Function
 from torch.nn.modules.utils import _pair
-from .. import masked_conv2d_cuda
+
+from .masked_conv_cpu import masked_conv2d_cpu
+
+try:
+    from .. import masked_conv2d_cuda
+except ImportError:  # built without CUDA, only the CPU op is available
+    masked_conv2d_cuda = None
 
 
 class MaskedConv2dFunction(Function):
@@ -53,4 +59,16 @@ class MaskedConv2dFunction(Function):
         return (None, ) * 5
 
 
-masked_conv2d = MaskedConv2dFunction.apply
+def masked_conv2d(features, mask, weight, bias, padding=0, stride=1):
+    """Conv at the positions where ``mask > 0`` only, with the CUDA kernels
+    for CUDA tensors and :func:`masked_conv2d_cpu` otherwise."""
+    if features.is_cuda:
+        return MaskedConv2dFunction.apply(features, mask, weight, bias,
+                                          padding, stride)
+    assert mask.dim() == 3 and mask.size(0) == 1
+    assert features.dim() == 4 and features.size(0) == 1
+    assert features.size()[2:] == mask.size()[1:]
+    if _pair(stride) != (1, 1):
+        raise ValueError(
+            'Stride could not only be 1 in masked_conv2d currently.')
+    return masked_conv2d_cpu(features, mask, weight, bias, padding)
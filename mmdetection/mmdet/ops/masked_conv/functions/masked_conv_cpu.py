@@ -0,0 +1,48 @@
+import torch
+import torch.nn.functional as F
+from torch.nn.modules.utils import _pair
+
+
+def masked_conv2d_cpu(features, mask, weight, bias, padding=0):
+    """Masked conv with torch ops, same results as the CUDA kernels.
+
+    The columns of the positions where ``mask > 0`` are gathered from the
+    padded features (the masked im2col of the CUDA op), multiplied by the
+    weight and scattered to a zero output. Backward is done by autograd.
+
+    Args:
+        features (Tensor): (1, C, H, W).
+        mask (Tensor): (1, H, W).
+        weight (Tensor): (C_out, C, kh, kw).
+        bias (Tensor or None): (C_out, ).
+        padding (int or tuple[int]): zero padding of the features.
+
+    Returns:
+        Tensor: (1, C_out, out_h, out_w), stride 1.
+    """
+    pad_h, pad_w = _pair(padding)
+    out_channels, in_channels, kernel_h, kernel_w = weight.size()
+    height, width = features.size()[2:]
+    out_h = height + 2 * pad_h - kernel_h + 1
+    out_w = width + 2 * pad_w - kernel_w + 1
+    output = features.new_zeros(out_channels, out_h * out_w)
+    mask_inds = torch.nonzero(mask[0] > 0)
+    if mask_inds.numel() == 0:
+        return output.view(1, out_channels, out_h, out_w)
+
+    padded = F.pad(features[0], (pad_w, pad_w, pad_h, pad_h))
+    padded_w = width + 2 * pad_w
+    # output (h, w) sees the padded pixels (h + i, w + j) of the kernel
+    kernel_offsets = (
+        torch.arange(kernel_h)[:, None] * padded_w + torch.arange(kernel_w))
+    pos = mask_inds[:, 0] * padded_w + mask_inds[:, 1]
+    pos = kernel_offsets.view(-1, 1).to(pos.device) + pos[None, :]
+    # (C * kh * kw, num_masked) columns, in the order of the weight
+    columns = padded.reshape(in_channels, -1)[:, pos].view(
+        in_channels * kernel_h * kernel_w, -1)
+    masked_output = weight.view(out_channels, -1).mm(columns)
+    if bias is not None:
+        masked_output = masked_output + bias[:, None]
+    out_inds = mask_inds[:, 0] * out_w + mask_inds[:, 1]
+    output = output.index_copy(1, out_inds, masked_output)
+    return output.view(1, out_channels, out_h, out_w)
@@ -1,9 +1,14 @@
 import numpy as np
 import torch
 
-from . import nms_cuda, nms_cpu
+from . import nms_cpu
 from .soft_nms_cpu import soft_nms_cpu
 
+try:
+    from . import nms_cuda
+except ImportError:  # built without CUDA, only the CPU nms is available
+    nms_cuda = None
+
 
 def nms(dets, iou_thr, device_id=None):
     """Dispatch to either CPU or GPU NMS implementations.
@@ -1,6 +1,11 @@
 from torch.autograd import Function
 
-from .. import roi_align_cuda
+from .roi_align_cpu import roi_align_cpu
+
+try:
+    from .. import roi_align_cuda
+except ImportError:  # built without CUDA, only the CPU op is available
+    roi_align_cuda = None
 
 
 class RoIAlignFunction(Function):
@@ -58,4 +63,10 @@ class RoIAlignFunction(Function):
         return grad_input, grad_rois, None, None, None
 
 
-roi_align = RoIAlignFunction.apply
+def roi_align(features, rois, out_size, spatial_scale, sample_num=0):
+    """RoIAlign, with the CUDA kernel for CUDA tensors and
+    :func:`roi_align_cpu` otherwise."""
+    if features.is_cuda:
+        return RoIAlignFunction.apply(features, rois, out_size, spatial_scale,
+                                      sample_num)
+    return roi_align_cpu(features, rois, out_size, spatial_scale, sample_num)
@@ -0,0 +1,101 @@
+import torch
+
+
+def _bilinear_taps(coords, size):
+    """Low / high neighbours and weights of sampling points along an axis,
+    as ``bilinear_interpolate`` of the CUDA kernel (zero weights for points
+    beyond one pixel of the border, points clamped inside it)."""
+    valid = ((coords >= -1) & (coords <= size)).type_as(coords)
+    coords = coords.clamp(min=0)
+    low = coords.floor().long()
+    at_border = low >= size - 1
+    low = low.clamp(max=size - 1)
+    high = torch.where(at_border, low, low + 1)
+    frac = torch.where(at_border, torch.zeros_like(coords),
+                       coords - low.type_as(coords))
+    return (low, high), ((1 - frac) * valid, frac * valid)
+
+
+def _sample_points(rois, out_len, num_samples, axis):
+    """(n, out_len * num_samples) sampling points of RoIs along an axis,
+    bin after bin."""
+    start = rois[:, 1 + axis]
+    size = rois[:, 3 + axis] - start
+    bin_size = size / out_len
+    steps = torch.arange(
+        out_len * num_samples, dtype=rois.dtype, device=rois.device)
+    steps = steps // num_samples + (steps % num_samples + 0.5) / num_samples
+    return start[:, None] + bin_size[:, None] * steps[None, :]
+
+
+def roi_align_cpu(features, rois, out_size, spatial_scale, sample_num=0,
+                  max_elements=2**24):
+    """RoIAlign with torch ops, same results as the CUDA kernel.
+
+    RoIs are grouped by their number of sampling points per bin, then the
+    4 bilinear taps of all the sampling points of a group are gathered from
+    the (B * H * W, C) features and averaged per bin. Backward is done by
+    autograd (gradients w.r.t. the features only, like the CUDA op).
+
+    Args:
+        features (Tensor): (B, C, H, W).
+        rois (Tensor): (n, 5), batch index and box.
+        out_size (int or tuple[int]): (out_h, out_w).
+        spatial_scale (float): scale of the features w.r.t. the boxes.
+        sample_num (int): sampling points per bin and axis, adaptive
+            (``ceil(roi_size / out_size)``) if 0.
+        max_elements (int): max number of gathered feature values at once.
+
+    Returns:
+        Tensor: (n, C, out_h, out_w).
+    """
+    if isinstance(out_size, int):
+        out_h = out_w = out_size
+    else:
+        out_h, out_w = out_size
+    num_imgs, channels, height, width = features.size()
+    output = features.new_zeros(rois.size(0), channels, out_h, out_w)
+    if rois.size(0) == 0:
+        return output
+
+    rois = rois.detach().type_as(features)
+    boxes = rois.new_empty(rois.size())
+    boxes[:, 0] = rois[:, 0]
+    boxes[:, 1:3] = rois[:, 1:3] * spatial_scale
+    boxes[:, 3:5] = (rois[:, 3:5] + 1) * spatial_scale
+    # malformed rois are sampled as empty boxes at their start
+    boxes[:, 3:5] = torch.max(boxes[:, 3:5], boxes[:, 1:3])
+    if sample_num > 0:
+        grids = rois.new_full((rois.size(0), 2), sample_num).long()
+    else:
+        sizes = boxes[:, 3:5] - boxes[:, 1:3]
+        grids = torch.stack([(sizes[:, 0] / out_w).ceil(),
+                             (sizes[:, 1] / out_h).ceil()], dim=1).long()
+        grids = grids.clamp(min=1)
+
+    flat_features = features.permute(0, 2, 3, 1).reshape(-1, channels)
+    batch_inds = rois[:, 0].long()
+    results, result_inds = [], []
+    for grid_w, grid_h in torch.unique(grids, dim=0).tolist():
+        inds = torch.nonzero((grids[:, 0] == grid_w)
+                             & (grids[:, 1] == grid_h)).view(-1)
+        num_points = out_h * grid_h * out_w * grid_w
+        chunk = max(1, max_elements // (4 * num_points * channels))
+        for chunk_inds in inds.split(chunk):
+            group = boxes[chunk_inds]
+            ys, wys = _bilinear_taps(
+                _sample_points(group, out_h, grid_h, 1), height)
+            xs, wxs = _bilinear_taps(
+                _sample_points(group, out_w, grid_w, 0), width)
+            base = (batch_inds[chunk_inds] * height * width)[:, None, None]
+            sampled = 0
+            for y, wy in zip(ys, wys):
+                for x, wx in zip(xs, wxs):
+                    pos = base + y[:, :, None] * width + x[:, None, :]
+                    weight = wy[:, :, None] * wx[:, None, :]
+                    sampled = sampled + flat_features[pos] * weight[..., None]
+            # (n, out_h, grid_h, out_w, grid_w, C) -> (n, C, out_h, out_w)
+            sampled = sampled.view(-1, out_h, grid_h, out_w, grid_w, channels)
+            results.append(sampled.mean(dim=(2, 4)).permute(0, 3, 1, 2))
+            result_inds.append(chunk_inds)
+    return output.index_copy(0, torch.cat(result_inds), torch.cat(results))
@@ -1,7 +1,12 @@
 import torch
 from torch.autograd import Function
 
-from .. import roi_pool_cuda
+from .roi_pool_cpu import roi_pool_cpu
+
+try:
+    from .. import roi_pool_cuda
+except ImportError:  # built without CUDA, only the CPU op is available
+    roi_pool_cuda = None
 
 
 class RoIPoolFunction(Function):
@@ -52,4 +57,9 @@ class RoIPoolFunction(Function):
         return grad_input, grad_rois, None, None
 
 
-roi_pool = RoIPoolFunction.apply
+def roi_pool(features, rois, out_size, spatial_scale):
+    """RoIPool, with the CUDA kernel for CUDA tensors and
+    :func:`roi_pool_cpu` otherwise."""
+    if features.is_cuda:
+        return RoIPoolFunction.apply(features, rois, out_size, spatial_scale)
+    return roi_pool_cpu(features, rois, out_size, spatial_scale)
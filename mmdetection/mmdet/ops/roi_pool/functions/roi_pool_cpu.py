@@ -0,0 +1,82 @@
+import torch
+
+
+def _bin_bounds(rois, out_len, size, axis):
+    """(n, out_len) first and last + 1 pixels of the bins of RoIs along an
+    axis, clipped to the features, as computed by the CUDA kernel."""
+    start = rois[:, 1 + axis]
+    bin_size = (rois[:, 3 + axis] - start) / out_len
+    steps = torch.arange(out_len + 1, dtype=rois.dtype, device=rois.device)
+    bounds = steps[None, :] * bin_size[:, None] + start[:, None]
+    first = bounds[:, :-1].floor().long().clamp(0, size)
+    last = bounds[:, 1:].ceil().long().clamp(0, size)
+    return first, last
+
+
+def roi_pool_cpu(features, rois, out_size, spatial_scale,
+                 max_elements=2**24):
+    """RoIPool with torch ops, same results as the CUDA kernel.
+
+    RoIs are grouped by the size of their largest bin, then the pixels of
+    every bin of a group are gathered from the (B * H * W, C) features and
+    max pooled. Empty bins and malformed RoIs are 0. Backward is done by
+    autograd (to the max of each bin, like the argmax of the CUDA op).
+
+    Args:
+        features (Tensor): (B, C, H, W).
+        rois (Tensor): (n, 5), batch index and box.
+        out_size (int or tuple[int]): (out_h, out_w).
+        spatial_scale (float): scale of the features w.r.t. the boxes.
+        max_elements (int): max number of gathered feature values at once.
+
+    Returns:
+        Tensor: (n, C, out_h, out_w).
+    """
+    if isinstance(out_size, int):
+        out_h = out_w = out_size
+    else:
+        out_h, out_w = out_size
+    num_imgs, channels, height, width = features.size()
+    output = features.new_zeros(rois.size(0), channels, out_h, out_w)
+
+    rois = rois.detach().type_as(features)
+    boxes = rois.new_empty(rois.size())
+    boxes[:, 0] = rois[:, 0]
+    boxes[:, 1:3] = rois[:, 1:3] * spatial_scale
+    boxes[:, 3:5] = (rois[:, 3:5] + 1) * spatial_scale
+    inds = torch.nonzero((boxes[:, 3] > boxes[:, 1])
+                         & (boxes[:, 4] > boxes[:, 2])).view(-1)
+    if inds.numel() == 0:
+        return output
+    boxes = boxes[inds]
+    x1, x2 = _bin_bounds(boxes, out_w, width, 0)
+    y1, y2 = _bin_bounds(boxes, out_h, height, 1)
+    # largest bin of each RoI along each axis
+    bin_sizes = torch.stack([(x2 - x1).max(1)[0], (y2 - y1).max(1)[0]], 1)
+    bin_sizes = bin_sizes.clamp(min=1)
+    empty = ((y2 <= y1)[:, :, None] | (x2 <= x1)[:, None, :])
+
+    flat_features = features.permute(0, 2, 3, 1).reshape(-1, channels)
+    base = boxes[:, 0].long() * height * width
+    results, result_inds = [], []
+    for bin_w, bin_h in torch.unique(bin_sizes, dim=0).tolist():
+        group = torch.nonzero((bin_sizes[:, 0] == bin_w)
+                              & (bin_sizes[:, 1] == bin_h)).view(-1)
+        chunk = max(1,
+                    max_elements // (out_h * bin_h * out_w * bin_w * channels))
+        for chunk_inds in group.split(chunk):
+            # (n, out_len, bin_len) pixels of the bins along each axis, the
+            # last pixel of a bin is repeated up to the largest bin
+            xs = x1[chunk_inds, :, None] + torch.arange(bin_w)
+            xs = torch.min(xs, x2[chunk_inds, :, None] - 1).clamp(0, width - 1)
+            ys = y1[chunk_inds, :, None] + torch.arange(bin_h)
+            ys = torch.min(ys, y2[chunk_inds, :, None] - 1).clamp(
+                0, height - 1)
+            pos = (base[chunk_inds, None, None, None, None] +
+                   ys[:, :, :, None, None] * width + xs[:, None, None])
+            # (n, out_h, bin_h, out_w, bin_w, C) -> (n, out_h, out_w, C)
+            pooled = flat_features[pos].max(dim=4)[0].max(dim=2)[0]
+            pooled = pooled.masked_fill(empty[chunk_inds][..., None], 0)
+            results.append(pooled.permute(0, 3, 1, 2))
+            result_inds.append(inds[chunk_inds])
+    return output.index_copy(0, torch.cat(result_inds), torch.cat(results))
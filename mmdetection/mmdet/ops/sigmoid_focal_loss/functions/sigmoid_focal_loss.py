@@ -1,7 +1,12 @@
 from torch.autograd import Function
 from torch.autograd.function import once_differentiable
 
-from .. import sigmoid_focal_loss_cuda
+from .sigmoid_focal_loss_cpu import sigmoid_focal_loss_cpu
+
+try:
+    from .. import sigmoid_focal_loss_cuda
+except ImportError:  # built without CUDA, only the CPU op is available
+    sigmoid_focal_loss_cuda = None
 
 
 class SigmoidFocalLossFunction(Function):
@@ -31,4 +36,9 @@ class SigmoidFocalLossFunction(Function):
         return d_input, None, None, None, None
 
 
-sigmoid_focal_loss = SigmoidFocalLossFunction.apply
+def sigmoid_focal_loss(input, target, gamma=2.0, alpha=0.25):
+    """Unreduced sigmoid focal loss, with the CUDA op for CUDA tensors and
+    :func:`sigmoid_focal_loss_cpu` otherwise."""
+    if input.is_cuda:
+        return SigmoidFocalLossFunction.apply(input, target, gamma, alpha)
+    return sigmoid_focal_loss_cpu(input, target, gamma, alpha)
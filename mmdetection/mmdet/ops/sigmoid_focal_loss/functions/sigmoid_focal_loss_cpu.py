@@ -0,0 +1,34 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# log(FLT_MIN), the CUDA op clamps the probability of the positives to it
+_MIN_LOG_PROB = math.log(1.1754943508222875e-38)
+
+
+def sigmoid_focal_loss_cpu(input, target, gamma=2.0, alpha=0.25):
+    """Sigmoid focal loss with torch ops, same results as the CUDA op.
+
+    Args:
+        input (Tensor): (n, num_classes) logits.
+        target (Tensor): (n, ) labels in [1, num_classes], 0 for the
+            background, negative to ignore a sample.
+        gamma (float): focusing parameter.
+        alpha (float): weight of the positives, 1 - alpha for the
+            negatives.
+
+    Returns:
+        Tensor: (n, num_classes) unreduced loss, backward by autograd.
+    """
+    classes = torch.arange(
+        1, input.size(1) + 1, dtype=target.dtype, device=target.device)
+    target = target[:, None]
+    pos = (target == classes).type_as(input)
+    neg = ((target >= 0) & (target != classes)).type_as(input)
+    p = input.sigmoid()
+    # log(p) and log(1 - p), computed from the logits to be stable
+    pos_term = (1 - p).pow(gamma) * F.logsigmoid(input).clamp(
+        min=_MIN_LOG_PROB)
+    neg_term = p.pow(gamma) * F.logsigmoid(-input)
+    return -pos * pos_term * alpha - neg * neg_term * (1 - alpha)
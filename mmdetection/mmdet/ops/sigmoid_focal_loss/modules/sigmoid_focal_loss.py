@@ -12,7 +12,6 @@ class SigmoidFocalLoss(nn.Module):
         self.alpha = alpha
 
     def forward(self, logits, targets):
-        assert logits.is_cuda
         loss = sigmoid_focal_loss(logits, targets, self.gamma, self.alpha)
         return loss.sum()
 
@@ -0,0 +1,112 @@
+"""Benchmark mask targets from dense masks against RLEMasks.
+
+Random instance masks of a synthetic image go through ``MaskTransform`` and
+``mask_target`` once as dense masks and once as :class:`RLEMasks`, the time
+per sample, the memory of the transformed masks and the agreement of the
+targets are reported:
+
+    python tools/bench_mask_target.py --num_gts 30 --num_rois 128
+"""
+import argparse
+import time
+
+import cv2
+import mmcv
+import numpy as np
+import torch
+
+from mmdet.core import mask_target
+from mmdet.datasets import RLEMasks
+from mmdet.datasets.transforms import MaskTransform
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark mask targets from dense and RLE masks')
+    parser.add_argument('--img_size', type=int, nargs=2, default=[1024, 768])
+    parser.add_argument('--img_scale', type=int, nargs=2, default=[1333, 800])
+    parser.add_argument('--num_gts', type=int, default=30)
+    parser.add_argument('--num_rois', type=int, default=128)
+    parser.add_argument('--mask_size', type=int, default=28)
+    parser.add_argument('--num_iters', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def random_instances(w, h, num, rng):
+    """Random ellipse masks and their boxes."""
+    masks, bboxes = [], []
+    for _ in range(num):
+        cx, cy = rng.uniform(0, w), rng.uniform(0, h)
+        ax, ay = rng.uniform(8, w / 3), rng.uniform(8, h / 3)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.ellipse(mask, (int(cx), int(cy)), (int(ax), int(ay)),
+                    rng.uniform(0, 180), 0, 360, 1, -1)
+        ys, xs = np.where(mask)
+        if len(xs) == 0:
+            mask[int(cy) % h, int(cx) % w] = 1
+            ys, xs = np.where(mask)
+        masks.append(mask)
+        bboxes.append([xs.min(), ys.min(), xs.max(), ys.max()])
+    return masks, np.array(bboxes, dtype=np.float32)
+
+
+def jitter_rois(gt_bboxes, num, img_shape, rng):
+    """Proposals around the gt boxes, like positive samples."""
+    inds = rng.randint(0, len(gt_bboxes), num)
+    bboxes = gt_bboxes[inds]
+    wh = np.tile(bboxes[:, 2:] - bboxes[:, :2] + 1, 2)
+    bboxes = bboxes + rng.uniform(-0.2, 0.2, bboxes.shape) * wh
+    bboxes[:, 0::2] = np.clip(bboxes[:, 0::2], 0, img_shape[1] - 1)
+    bboxes[:, 1::2] = np.clip(bboxes[:, 1::2], 0, img_shape[0] - 1)
+    bboxes[:, 2:] = np.maximum(bboxes[:, 2:], bboxes[:, :2])
+    return torch.from_numpy(bboxes.astype(np.float32)), torch.from_numpy(inds)
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    w, h = args.img_size
+    masks, gt_bboxes = random_instances(w, h, args.num_gts, rng)
+    rle_masks = RLEMasks.from_masks(masks, h, w)
+    cfg = mmcv.ConfigDict(dict(mask_size=args.mask_size))
+    mask_transform = MaskTransform()
+
+    scale_factor = min(
+        max(args.img_scale) / max(h, w), min(args.img_scale) / min(h, w))
+    img_shape = (int(h * scale_factor + 0.5), int(w * scale_factor + 0.5))
+    pad_shape = tuple(int(np.ceil(s / 32)) * 32 for s in img_shape)
+
+    times = dict(dense=0., rle=0.)
+    nbytes = dict(dense=0, rle=sum(len(c) for c in rle_masks.counts))
+    num_pixels = num_diff = 0
+    for it in range(args.num_iters):
+        flip = bool(it % 2)
+        gt_bboxes_t = gt_bboxes * scale_factor
+        if flip:
+            gt_bboxes_t[:, 0::2] = img_shape[1] - 1 - gt_bboxes_t[:, 2::-2]
+        rois, inds = jitter_rois(gt_bboxes_t, args.num_rois, img_shape, rng)
+
+        start = time.time()
+        dense = mask_transform(masks, pad_shape, scale_factor, flip)
+        dense_targets = mask_target([rois], [inds], [dense], cfg)
+        times['dense'] += time.time() - start
+        nbytes['dense'] = dense.nbytes
+
+        start = time.time()
+        rle = mask_transform(rle_masks, pad_shape, scale_factor, flip)
+        rle_targets = mask_target([rois], [inds], [rle], cfg)
+        times['rle'] += time.time() - start
+
+        num_pixels += dense_targets.numel()
+        num_diff += int((dense_targets != rle_targets).sum())
+
+    for key in ('dense', 'rle'):
+        print('{:5s}: {:8.2f} ms / sample, {:10d} bytes of masks'.format(
+            key, 1000 * times[key] / args.num_iters, nbytes[key]))
+    print('speedup {:.1f}x, {:.4%} of the target pixels differ'.format(
+        times['dense'] / times['rle'], num_diff / max(num_pixels, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Check that batched ensemble inference matches inference one image at a
+time.
+
+Runs the same EnsembleModel over the same images with ``imgs_per_gpu=1`` and
+with ``--imgs_per_gpu`` images per batch (on cpu by default) and compares the
+boxes, scores and masks of every image. Images of a batch are zero padded
+to the largest of them, so the features close to the bottom and right
+borders of the smaller images may differ slightly, hence the tolerances.
+Randomly initialized models (without ``--checkpoint``) score their
+detections almost equally, so such small differences reorder them: check
+them on images of a single size.
+
+    python tools/check_batched_test.py --cfg_list a.py b.py \
+        --checkpoint a.pth b.pth --ann_file seg_val_100.pkl \
+        --img_prefix data/val/ --img_scale 1333,800 --flip --imgs_per_gpu 4
+"""
+import argparse
+
+import mmcv
+import numpy as np
+import pycocotools.mask as maskUtils
+import torch
+from mmcv.runner import load_checkpoint
+
+from mmdet.datasets import CustomDataset, build_dataloader
+from mmdet.models import build_detector
+from mmdet.models.detectors.ensemble_model import EnsembleModel
+
+
+def scale(s):
+    try:
+        x, y = map(int, s.split(','))
+        return x, y
+    except ValueError:
+        raise argparse.ArgumentTypeError("scale must be x,y")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check batched against single image ensemble inference')
+    parser.add_argument('--cfg_list', type=str, nargs='+')
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        nargs='+',
+        help='checkpoints of the models, randomly initialized if not given')
+    parser.add_argument('--ann_file')
+    parser.add_argument('--img_prefix')
+    parser.add_argument('--img_scale', type=scale, nargs='+')
+    parser.add_argument('--flip', action='store_true')
+    parser.add_argument('--imgs_per_gpu', type=int, default=4)
+    parser.add_argument('--num_imgs', type=int, default=20)
+    parser.add_argument(
+        '--thres',
+        type=float,
+        default=0.,
+        help='score threshold, 0 so that untrained models have detections')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--atol', type=float, default=1e-2)
+    parser.add_argument('--min_mask_iou', type=float, default=0.99)
+    return parser.parse_args()
+
+
+def run(model, dataset, imgs_per_gpu, device):
+    data_loader = build_dataloader(
+        dataset,
+        imgs_per_gpu=imgs_per_gpu,
+        workers_per_gpu=0,
+        dist=False,
+        shuffle=False)
+    results = []
+    for data in data_loader:
+        imgs = [img.to(device) for img in data['img']]
+        img_metas = [img_meta.data[0] for img_meta in data['img_meta']]
+        with torch.no_grad():
+            results.extend(
+                model(imgs, img_metas, return_loss=False, rescale=True))
+    return results
+
+
+def compare(result, ref_result, atol, min_mask_iou):
+    """Whether two results match, and the largest box / score difference."""
+    max_diff = 0.
+    for cls_idx, (bboxes, ref_bboxes) in enumerate(
+            zip(result[0], ref_result[0])):
+        if bboxes.shape != ref_bboxes.shape:
+            return False, np.inf
+        if bboxes.size == 0:
+            continue
+        max_diff = max(max_diff, np.abs(bboxes - ref_bboxes).max())
+        segms, ref_segms = result[1][cls_idx], ref_result[1][cls_idx]
+        ious = np.diag(maskUtils.iou(segms, ref_segms, [0] * len(ref_segms)))
+        # the IoU of two empty masks is 0
+        same = [a['counts'] == b['counts'] for a, b in zip(segms, ref_segms)]
+        if np.where(same, 1., ious).min() < min_mask_iou:
+            return False, max_diff
+    return max_diff <= atol, max_diff
+
+
+def main():
+    args = parse_args()
+
+    test_cfg = mmcv.ConfigDict(
+        dict(
+            rpn=dict(
+                nms_across_levels=False,
+                nms_pre=1000,
+                nms_post=1000,
+                max_num=1000,
+                nms_thr=0.7,
+                min_bbox_size=0),
+            rcnn=dict(
+                score_thr=args.thres,
+                nms=dict(type='nms', iou_thr=0.5),
+                max_per_img=100,
+                mask_thr_binary=0.5),
+            keep_all_stages=False))
+    models = []
+    checkpoints = args.checkpoint or [None] * len(args.cfg_list)
+    for config_path, checkpoint_path in zip(args.cfg_list, checkpoints):
+        cfg = mmcv.Config.fromfile(config_path)
+        cfg.model.pretrained = None
+        model = build_detector(cfg.model, train_cfg=None, test_cfg=test_cfg)
+        if checkpoint_path is not None:
+            load_checkpoint(model, checkpoint_path, map_location='cpu')
+        models.append(model)
+    model = EnsembleModel(models).to(args.device)
+    model.eval()
+
+    dataset = CustomDataset(
+        ann_file=args.ann_file,
+        img_prefix=args.img_prefix,
+        img_scale=args.img_scale,
+        img_norm_cfg=dict(
+            mean=[123.675, 116.28, 103.53],
+            std=[58.395, 57.12, 57.375],
+            to_rgb=True),
+        size_divisor=32,
+        flip_ratio=int(args.flip),
+        with_mask=False,
+        with_label=False,
+        test_mode=True)
+    dataset.img_infos = dataset.img_infos[:args.num_imgs]
+
+    ref_results = run(model, dataset, 1, args.device)
+    results = run(model, dataset, args.imgs_per_gpu, args.device)
+    assert len(results) == len(ref_results)
+    num_dets = sum(len(bboxes) for ref_result in ref_results
+                   for bboxes in ref_result[0])
+    # a check without detections compares nothing
+    assert num_dets > 0, 'no detection, lower --thres'
+
+    num_mismatch = 0
+    max_diff = 0.
+    for i, (result, ref_result) in enumerate(zip(results, ref_results)):
+        match, diff = compare(result, ref_result, args.atol,
+                              args.min_mask_iou)
+        max_diff = max(max_diff, diff)
+        if not match:
+            num_mismatch += 1
+            print('image {} ({}) differs, max box diff {}'.format(
+                i, dataset.img_infos[i]['filename'], diff))
+    print('{} images, {} detections, {} mismatches, max box diff {}'.format(
+        len(results), num_dets, num_mismatch, max_diff))
+    assert num_mismatch == 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+"""Check the CPU implementations of the ops against reference loops.
+
+The references are direct ports of the CUDA kernels (one output element at
+a time), the outputs of the CPU ops must match them, their gradients are
+checked with ``gradcheck`` in double precision, and the CPU and CUDA ops are
+compared on the same inputs when a GPU is available. Then a randomly
+initialized detector of ``--config`` runs ``simple_test`` end to end on CPU
+(anchors, NMS, RoI heads and masks):
+
+    python tools/check_cpu_ops.py --config configs/<config>.py
+"""
+import argparse
+import math
+
+import mmcv
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.autograd import gradcheck
+
+from mmdet.models import build_detector
+from mmdet.ops import (deform_conv, masked_conv2d, modulated_deform_conv,
+                       roi_align, roi_pool, sigmoid_focal_loss)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the CPU ops against reference implementations')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--config',
+        default='configs/cascade_mask_rcnn_dconv_c3-c5_r101_fpn_1x_colab.py',
+        help='detector of the end to end CPU test')
+    parser.add_argument(
+        '--img_size', type=int, nargs=2, default=[200, 300], help='h w')
+    return parser.parse_args()
+
+
+def bilinear_ref(data, y, x, in_range):
+    """Bilinear sampling of a (H, W) map as the CUDA kernels, ``in_range``
+    is the condition for a point to be sampled at all."""
+    height, width = data.shape
+    if not in_range(y, x):
+        return 0.
+    y_low, x_low = int(math.floor(y)), int(math.floor(x))
+    value = 0.
+    for yy, wy in ((y_low, 1 - (y - y_low)), (y_low + 1, y - y_low)):
+        for xx, wx in ((x_low, 1 - (x - x_low)), (x_low + 1, x - x_low)):
+            if 0 <= yy < height and 0 <= xx < width:
+                value += wy * wx * data[yy, xx]
+    return value
+
+
+def roi_align_ref(features, rois, out_size, spatial_scale, sample_num):
+    features = features.numpy()
+    height, width = features.shape[2:]
+    output = np.zeros((len(rois), features.shape[1], out_size, out_size))
+    for n, (b, x1, y1, x2, y2) in enumerate(rois.tolist()):
+        start_w, start_h = x1 * spatial_scale, y1 * spatial_scale
+        roi_w = max((x2 + 1) * spatial_scale - start_w, 0)
+        roi_h = max((y2 + 1) * spatial_scale - start_h, 0)
+        bin_w, bin_h = roi_w / out_size, roi_h / out_size
+        grid_h = sample_num if sample_num > 0 else int(math.ceil(bin_h))
+        grid_w = sample_num if sample_num > 0 else int(math.ceil(bin_w))
+        for ph in range(out_size):
+            for pw in range(out_size):
+                for c in range(features.shape[1]):
+                    total = 0.
+                    for iy in range(grid_h):
+                        y = start_h + ph * bin_h + (iy + .5) * bin_h / grid_h
+                        for ix in range(grid_w):
+                            x = (start_w + pw * bin_w +
+                                 (ix + .5) * bin_w / grid_w)
+                            # clamped to the border as the CUDA kernel
+                            if -1 <= y <= height and -1 <= x <= width:
+                                y_, x_ = min(max(y, 0), height - 1), min(
+                                    max(x, 0), width - 1)
+                                total += bilinear_ref(
+                                    features[int(b), c], y_, x_,
+                                    lambda *_: True)
+                    output[n, c, ph, pw] = total / (grid_h * grid_w)
+    return output
+
+
+def roi_pool_ref(features, rois, out_size, spatial_scale):
+    features = features.numpy()
+    height, width = features.shape[2:]
+    output = np.zeros((len(rois), features.shape[1], out_size, out_size))
+    for n, (b, x1, y1, x2, y2) in enumerate(rois.tolist()):
+        x1, y1 = x1 * spatial_scale, y1 * spatial_scale
+        roi_w = (x2 + 1) * spatial_scale - x1
+        roi_h = (y2 + 1) * spatial_scale - y1
+        if roi_w <= 0 or roi_h <= 0:
+            continue
+        for ph in range(out_size):
+            h1 = min(max(int(math.floor(ph * roi_h / out_size + y1)), 0),
+                     height)
+            h2 = min(max(int(math.ceil((ph + 1) * roi_h / out_size + y1)), 0),
+                     height)
+            for pw in range(out_size):
+                w1 = min(max(int(math.floor(pw * roi_w / out_size + x1)), 0),
+                         width)
+                w2 = min(
+                    max(int(math.ceil((pw + 1) * roi_w / out_size + x1)), 0),
+                    width)
+                if h2 > h1 and w2 > w1:
+                    output[n, :, ph, pw] = features[int(b), :, h1:h2,
+                                                    w1:w2].max(axis=(1, 2))
+    return output
+
+
+def deform_conv_ref(input, offset, weight, stride, padding, dilation, groups,
+                    deformable_groups, mask=None, bias=None):
+    input, offset, weight = input.numpy(), offset.numpy(), weight.numpy()
+    num, channels, height, width = input.shape
+    out_channels, _, kernel_h, kernel_w = weight.shape
+    out_h, out_w = offset.shape[2:]
+    channels_per_dg = channels // deformable_groups
+    columns = np.zeros((num, channels, kernel_h, kernel_w, out_h, out_w))
+    for n in range(num):
+        for c in range(channels):
+            g = c // channels_per_dg
+            for i in range(kernel_h):
+                for j in range(kernel_w):
+                    k = (g * kernel_h + i) * kernel_w + j
+                    for h in range(out_h):
+                        for w in range(out_w):
+                            y = (h * stride - padding + i * dilation +
+                                 offset[n, 2 * k, h, w])
+                            x = (w * stride - padding + j * dilation +
+                                 offset[n, 2 * k + 1, h, w])
+                            value = bilinear_ref(
+                                input[n, c], y, x, lambda y, x: -1 < y <
+                                height and -1 < x < width)
+                            if mask is not None:
+                                value *= float(mask[n, k, h, w])
+                            columns[n, c, i, j, h, w] = value
+    columns = columns.reshape(num, groups, -1, out_h * out_w)
+    weight = weight.reshape(groups, out_channels // groups, -1)
+    output = np.einsum('gok,ngkl->ngol', weight, columns).reshape(
+        num, out_channels, out_h, out_w)
+    if bias is not None:
+        output += bias.numpy()[:, None, None]
+    return output
+
+
+def focal_loss_ref(input, target, gamma, alpha):
+    input = input.double()
+    one_hot = F.one_hot(target.clamp(min=0), input.size(1) + 1)[:, 1:]
+    one_hot = one_hot.double()
+    p = input.sigmoid()
+    pt = (1 - p) * one_hot + p * (1 - one_hot)
+    weight = (alpha * one_hot + (1 - alpha) * (1 - one_hot)) * pt.pow(gamma)
+    loss = F.binary_cross_entropy_with_logits(
+        input, one_hot, reduction='none') * weight
+    return loss * (target >= 0).double()[:, None]
+
+
+def random_rois(num, num_imgs, img_size):
+    xy = np.random.rand(num, 2) * img_size * 0.7
+    wh = np.random.rand(num, 2) * img_size * 0.5
+    rois = np.hstack([
+        np.random.randint(num_imgs, size=(num, 1)), xy,
+        np.minimum(xy + wh, img_size)
+    ])
+    return torch.from_numpy(rois).float()
+
+
+def compare(name, output, reference, atol=1e-4):
+    output = output.detach().cpu().double().numpy()
+    error = float(np.abs(output - np.asarray(reference)).max())
+    print('{:48s} max abs error {:.2e} {}'.format(
+        name, error, 'OK' if error < atol else 'FAILED'))
+    return error < atol
+
+
+def check(name, passed):
+    print('{:48s} {}'.format(name, 'OK' if passed else 'FAILED'))
+    return passed
+
+
+def check_simple_test(config, img_size):
+    """``simple_test`` of a randomly initialized detector on a random
+    image, on CPU only. The score threshold is 0 so that the untrained
+    detector still has detections for the mask head."""
+    cfg = mmcv.Config.fromfile(config)
+    cfg.model.pretrained = None
+    cfg.test_cfg.rcnn.score_thr = 0.
+    cfg.test_cfg.rcnn.max_per_img = 20
+    model = build_detector(cfg.model, train_cfg=None, test_cfg=cfg.test_cfg)
+    model.eval()
+    h, w = img_size
+    pad_h, pad_w = -(-h // 32) * 32, -(-w // 32) * 32
+    img = torch.zeros(1, 3, pad_h, pad_w)
+    img[:, :, :h, :w] = torch.randn(1, 3, h, w)
+    img_meta = dict(
+        ori_shape=(h, w, 3),
+        img_shape=(h, w, 3),
+        pad_shape=(pad_h, pad_w, 3),
+        scale_factor=1.,
+        flip=False)
+    with torch.no_grad():
+        result = model.simple_test(img, [img_meta], rescale=True)
+    if isinstance(result, tuple):
+        bbox_result, segm_result = result
+    else:
+        bbox_result, segm_result = result, None
+    bboxes = np.vstack(bbox_result)
+    passed = len(bboxes) > 0 and bboxes.shape[1] == 5
+    passed &= bool((bboxes[:, :4] >= 0).all() and
+                   (bboxes[:, [0, 2]] <= w).all() and
+                   (bboxes[:, [1, 3]] <= h).all())
+    if segm_result is not None:
+        passed &= [len(segms) for segms in segm_result] == [
+            len(cls_bboxes) for cls_bboxes in bbox_result
+        ]
+    return check(
+        'simple_test on cpu, {} detections'.format(len(bboxes)), passed)
+
+
+def main():
+    args = parse_args()
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    results = []
+
+    # RoIAlign and RoIPool
+    features = torch.randn(2, 4, 12, 15)
+    rois = random_rois(12, 2, 80)
+    for sample_num in (0, 2):
+        results.append(
+            compare('roi_align sample_num={}'.format(sample_num),
+                    roi_align(features, rois, 4, 1. / 8, sample_num),
+                    roi_align_ref(features, rois, 4, 1. / 8, sample_num)))
+    results.append(
+        compare('roi_pool', roi_pool(features, rois, 4, 1. / 8),
+                roi_pool_ref(features, rois, 4, 1. / 8)))
+    feat = features.double().requires_grad_()
+    results.append(
+        check(
+            'roi_align gradcheck',
+            gradcheck(lambda x: roi_align(x, rois.double(), 3, 1. / 8, 2),
+                      (feat, ))))
+    results.append(
+        check(
+            'roi_pool gradcheck',
+            gradcheck(lambda x: roi_pool(x, rois.double(), 3, 1. / 8),
+                      (feat, ))))
+
+    # masked conv
+    features = torch.randn(1, 4, 10, 11)
+    mask = (torch.rand(1, 10, 11) > 0.6).float()
+    weight = torch.randn(6, 4, 3, 3)
+    bias = torch.randn(6)
+    results.append(
+        compare('masked_conv2d',
+                masked_conv2d(features, mask, weight, bias, 1),
+                F.conv2d(features, weight, bias, padding=1) * mask[:, None]))
+    results.append(
+        check(
+            'masked_conv2d gradcheck',
+            gradcheck(lambda x, w: masked_conv2d(x, mask.double(), w, None, 1),
+                      (features.double().requires_grad_(),
+                       weight.double().requires_grad_()))))
+
+    # deformable convs, the offsets are kept away from integer positions so
+    # that the numerical gradients do not cross the bilinear cells
+    for stride, padding, dilation, groups, dg in ((1, 1, 1, 1, 1),
+                                                  (2, 1, 1, 2, 2),
+                                                  (1, 2, 2, 1, 2)):
+        name = 'deform_conv s{} p{} d{} g{} dg{}'.format(
+            stride, padding, dilation, groups, dg)
+        input = torch.randn(2, 4, 9, 8)
+        weight = torch.randn(6, 4 // groups, 3, 3)
+        out_h = (9 + 2 * padding - 2 * dilation - 1) // stride + 1
+        out_w = (8 + 2 * padding - 2 * dilation - 1) // stride + 1
+        offset = torch.randint(-3, 3, (2, dg * 18, out_h, out_w)).float()
+        offset += torch.rand(offset.size()) * 0.8 + 0.1
+        mask = torch.rand(2, dg * 9, out_h, out_w)
+        bias = torch.randn(6)
+        conv_args = (stride, padding, dilation, groups, dg)
+        results.append(
+            compare(
+                name,
+                deform_conv(input, offset, weight, *conv_args),
+                deform_conv_ref(input, offset, weight, *conv_args)))
+        results.append(
+            compare(
+                'modulated_' + name,
+                modulated_deform_conv(input, offset, mask, weight, bias,
+                                      *conv_args),
+                deform_conv_ref(input, offset, weight, *conv_args, mask,
+                                bias)))
+        results.append(
+            compare(
+                name + ' offset=0',
+                deform_conv(input, torch.zeros_like(offset), weight,
+                            *conv_args),
+                F.conv2d(input, weight, None, stride, padding, dilation,
+                         groups)))
+        inputs = [
+            x.double().requires_grad_()
+            for x in (input, offset, mask, weight, bias)
+        ]
+        results.append(
+            check(
+                'modulated_' + name + ' gradcheck',
+                gradcheck(
+                    lambda x, o, m, w, b: modulated_deform_conv(
+                        x, o, m, w, b, *conv_args), inputs)))
+
+    # sigmoid focal loss
+    logits = torch.randn(50, 8) * 4
+    labels = torch.randint(-1, 9, (50, ))
+    results.append(
+        compare('sigmoid_focal_loss',
+                sigmoid_focal_loss(logits, labels, 2.0, 0.25),
+                focal_loss_ref(logits, labels, 2.0, 0.25).numpy()))
+    results.append(
+        check(
+            'sigmoid_focal_loss gradcheck',
+            gradcheck(lambda x: sigmoid_focal_loss(x, labels, 2.0, 0.25),
+                      (logits.double().requires_grad_(), ))))
+
+    # CPU against CUDA
+    if torch.cuda.is_available():
+        features = torch.randn(2, 16, 40, 50)
+        rois = random_rois(64, 2, 400)
+        roi_ops = (
+            ('roi_align', lambda f, r: roi_align(f, r, 7, 1. / 8, 0)),
+            ('roi_align sample_num=2',
+             lambda f, r: roi_align(f, r, 7, 1. / 8, 2)),
+            ('roi_pool', lambda f, r: roi_pool(f, r, 7, 1. / 8)))
+        for name, op in roi_ops:
+            results.append(
+                compare(name + ' cpu vs cuda', op(features, rois),
+                        op(features.cuda(), rois.cuda()).cpu().numpy()))
+        input = torch.randn(2, 16, 30, 30)
+        offset = torch.randn(2, 36, 30, 30) * 2
+        mask = torch.rand(2, 18, 30, 30)
+        weight = torch.randn(8, 16, 3, 3)
+        bias = torch.randn(8)
+        conv_args = (1, 1, 1, 1, 2)
+        results.append(
+            compare(
+                'deform_conv cpu vs cuda',
+                deform_conv(input, offset, weight, *conv_args),
+                deform_conv(input.cuda(), offset.cuda(), weight.cuda(),
+                            *conv_args).cpu().numpy(), 1e-3))
+        results.append(
+            compare(
+                'modulated_deform_conv cpu vs cuda',
+                modulated_deform_conv(input, offset, mask, weight, bias,
+                                      *conv_args),
+                modulated_deform_conv(input.cuda(), offset.cuda(),
+                                      mask.cuda(), weight.cuda(), bias.cuda(),
+                                      *conv_args).cpu().numpy(), 1e-3))
+        features = torch.randn(1, 16, 30, 30)
+        mask = (torch.rand(1, 30, 30) > 0.5).float()
+        weight = torch.randn(8, 16, 3, 3)
+        results.append(
+            compare(
+                'masked_conv2d cpu vs cuda',
+                masked_conv2d(features, mask, weight, bias, 1),
+                masked_conv2d(features.cuda(), mask.cuda(), weight.cuda(),
+                              bias.cuda(), 1).cpu().numpy(), 1e-3))
+        results.append(
+            compare(
+                'sigmoid_focal_loss cpu vs cuda',
+                sigmoid_focal_loss(logits, labels, 2.0, 0.25),
+                sigmoid_focal_loss(logits.cuda(), labels.cuda(), 2.0,
+                                   0.25).cpu().numpy()))
+    else:
+        print('no GPU, CPU vs CUDA comparisons skipped')
+
+    # end to end, anchors and all on CPU
+    results.append(check_simple_test(args.config, args.img_size))
+
+    print('{}/{} checks passed'.format(sum(results), len(results)))
+
+
+if __name__ == '__main__':
+    main()
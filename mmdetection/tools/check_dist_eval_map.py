@@ -0,0 +1,163 @@
+"""Check the mAP of ``DistEvalmAPHook`` against ``eval_map`` on CPU ranks.
+
+The hook runs in 1, 3 and 4 processes of a gloo process group (CPU
+tensors), on random ground truth and detections (jittered gts, confused
+classes, false positives and rounded scores with ties) of a few objects per
+image, with and without ignored (crowd) gts. The images are tested by
+returning their precomputed results, so the tp and fp of each rank, their
+gathering and the accumulation on rank 0 are checked: the mAP must equal
+that of ``eval_map`` on the results of all the images in one process.
+
+    python tools/check_dist_eval_map.py --world_sizes 1 3 4
+"""
+import argparse
+import contextlib
+import io
+import os.path as osp
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Dataset
+
+from mmdet.core import DistEvalmAPHook, eval_map
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check DistEvalmAPHook against eval_map')
+    parser.add_argument(
+        '--world_sizes', type=int, nargs='+', default=[1, 3, 4])
+    parser.add_argument('--num_images', type=int, default=50)
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class RandomDataset(Dataset):
+    """Random gts of a validation set, and the results of its images."""
+
+    def __init__(self, num_images, num_classes, with_crowd, seed):
+        rng = np.random.RandomState(seed)
+        self.CLASSES = tuple('class_{}'.format(i) for i in range(num_classes))
+        self.with_crowd = with_crowd
+        self.anns, self.results = [], []
+        for _ in range(num_images):
+            num_gts = rng.randint(0, 5)
+            bboxes = self._random_bboxes(rng, num_gts)
+            labels = rng.randint(1, num_classes + 1, size=num_gts)
+            num_ignore = rng.randint(0, 3) if with_crowd else 0
+            self.anns.append(
+                dict(
+                    bboxes=bboxes,
+                    labels=labels,
+                    bboxes_ignore=self._random_bboxes(rng, num_ignore),
+                    labels_ignore=rng.randint(
+                        1, num_classes + 1, size=num_ignore)))
+            # jittered gts, some of another class, and false positives
+            num_fps = rng.randint(0, 4)
+            det_bboxes = np.vstack([
+                bboxes + rng.normal(0, 8, size=bboxes.shape),
+                self._random_bboxes(rng, num_fps)
+            ])
+            det_labels = np.concatenate(
+                [labels, rng.randint(1, num_classes + 1, size=num_fps)])
+            confused = rng.rand(num_gts) < 0.2
+            det_labels[:num_gts][confused] = rng.randint(
+                1, num_classes + 1, size=confused.sum())
+            scores = rng.rand(len(det_bboxes)).round(1)
+            self.results.append([
+                np.column_stack([
+                    det_bboxes[det_labels == label],
+                    scores[det_labels == label]
+                ]).astype(np.float32) for label in range(1, num_classes + 1)
+            ])
+
+    @staticmethod
+    def _random_bboxes(rng, num):
+        xy = rng.uniform(0, 400, size=(num, 2))
+        wh = rng.uniform(10, 100, size=(num, 2))
+        return np.hstack([xy, xy + wh]).astype(np.float32)
+
+    def get_ann_info(self, idx):
+        return self.anns[idx]
+
+    def __getitem__(self, idx):
+        return self.results[idx]
+
+    def __len__(self):
+        return len(self.anns)
+
+
+class PrecomputedmAPHook(DistEvalmAPHook):
+    """The hook, with the precomputed results of the dataset as those of the
+    model."""
+
+    def _test(self, runner, inds):
+        return [self.dataset[idx] for idx in inds]
+
+
+def run_rank(rank, world_size, dataset, init_file, out_file):
+    dist.init_process_group(
+        'gloo',
+        init_method='file://' + init_file,
+        rank=rank,
+        world_size=world_size)
+    runner = SimpleNamespace(
+        rank=rank,
+        world_size=world_size,
+        epoch=0,
+        model=SimpleNamespace(eval=lambda: None),
+        log_buffer=SimpleNamespace(output={}, ready=False))
+    hook = PrecomputedmAPHook(dataset)
+    # without the mAP summary of rank 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        hook.after_train_epoch(runner)
+    if rank == 0:
+        with open(out_file, 'w') as f:
+            f.write(repr(runner.log_buffer.output['mAP']))
+    dist.destroy_process_group()
+
+
+def dist_map(dataset, world_size):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        init_file = osp.join(tmpdir, 'init')
+        out_file = osp.join(tmpdir, 'map')
+        mp.spawn(
+            run_rank,
+            args=(world_size, dataset, init_file, out_file),
+            nprocs=world_size)
+        with open(out_file) as f:
+            return float(f.read())
+
+
+def main():
+    args = parse_args()
+    ok = True
+    for with_crowd in (False, True):
+        dataset = RandomDataset(args.num_images, args.num_classes,
+                                with_crowd, args.seed)
+        gt_bboxes, gt_labels, gt_ignore = DistEvalmAPHook(dataset)._get_gts(
+            range(len(dataset)))
+        ref_map, _ = eval_map(
+            dataset.results,
+            gt_bboxes,
+            gt_labels,
+            gt_ignore=gt_ignore,
+            dataset=dataset.CLASSES,
+            print_summary=False)
+        for world_size in args.world_sizes:
+            mean_ap = dist_map(dataset, world_size)
+            passed = mean_ap == ref_map
+            ok &= passed
+            print('{} rank(s), {} crowd: mAP {:.6f}, eval_map {:.6f} {}'.
+                  format(world_size, 'with' if with_crowd else 'without',
+                         mean_ap, ref_map, 'OK' if passed else 'FAILED'))
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
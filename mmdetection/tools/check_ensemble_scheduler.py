@@ -0,0 +1,250 @@
+"""Check that the ensemble scheduler matches the sequential ensemble test.
+
+Tests the same images with :class:`EnsembleScheduler` (one worker process
+per model, CPU workers by default) and sequentially in the main process:
+the augmentations of each image are merged by an :class:`EnsembleModel` of
+each model alone and the results of the models are fused by
+:func:`fuse_results`, which is what the workers and the scheduler do. The
+boxes, scores and masks of every image must match.
+
+Without ``--ann_file`` the images are random, and without
+``--checkpoint`` the models are randomly initialized (and saved to a
+temporary checkpoint for the workers), so the check runs anywhere:
+
+    python tools/check_ensemble_scheduler.py
+    python tools/check_ensemble_scheduler.py --cfg_list a.py b.py \
+        --checkpoint a.pth b.pth --ann_file seg_val_100.pkl \
+        --img_prefix data/val/ --img_scale 1333,800 --flip
+"""
+import argparse
+import os.path as osp
+import tempfile
+
+import mmcv
+import numpy as np
+import pycocotools.mask as maskUtils
+import torch
+from mmcv.runner import load_checkpoint
+
+from mmdet.apis.ensemble_scheduler import EnsembleScheduler
+from mmdet.core import fuse_results
+from mmdet.datasets import CustomDataset, build_dataloader
+from mmdet.models import build_detector
+from mmdet.models.detectors.ensemble_model import EnsembleModel
+
+
+def scale(s):
+    try:
+        x, y = map(int, s.split(','))
+        return x, y
+    except ValueError:
+        raise argparse.ArgumentTypeError("scale must be x,y")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the ensemble scheduler against the sequential '
+        'ensemble test')
+    parser.add_argument(
+        '--cfg_list',
+        type=str,
+        nargs='+',
+        default=['configs/cascade_mask_rcnn_dconv_c3-c5_r101_fpn_1x_colab.py'
+                 ] * 2)
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        nargs='+',
+        help='checkpoints of the models, randomly initialized if not given')
+    parser.add_argument(
+        '--ann_file', help='annotation file, random images if not given')
+    parser.add_argument('--img_prefix')
+    parser.add_argument(
+        '--img_scale', type=scale, nargs='+', default=[(320, 224)])
+    parser.add_argument('--flip', action='store_true')
+    parser.add_argument('--imgs_per_gpu', type=int, default=2)
+    parser.add_argument('--num_imgs', type=int, default=5)
+    parser.add_argument(
+        '--thres',
+        type=float,
+        default=0.,
+        help='score threshold, 0 so that untrained models have detections')
+    parser.add_argument(
+        '--devices',
+        nargs='+',
+        help='device of each model, cpu for all of them by default')
+    parser.add_argument(
+        '--worker_threads',
+        type=int,
+        default=1,
+        help='torch threads of each worker')
+    parser.add_argument(
+        '--fusion', choices=['wbf', 'soft_merge'], default='wbf')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--atol', type=float, default=1e-2)
+    parser.add_argument('--min_mask_iou', type=float, default=0.99)
+    return parser.parse_args()
+
+
+def random_images(num_imgs, img_dir, rng):
+    """Random images of random sizes, and their annotation file."""
+    img_infos = []
+    for i in range(num_imgs):
+        h, w = rng.randint(150, 300, size=2)
+        filename = '{:03d}.jpg'.format(i)
+        mmcv.imwrite(
+            rng.randint(0, 256, size=(h, w, 3)).astype(np.uint8),
+            osp.join(img_dir, filename))
+        img_infos.append(dict(filename=filename, width=w, height=h))
+    ann_file = osp.join(img_dir, 'ann.pkl')
+    mmcv.dump(img_infos, ann_file)
+    return ann_file
+
+
+def sequential_test(models, data_loader, model_weights, fusion):
+    """The augmentations merged by each model alone, then the models
+    fused, in the main process."""
+    model_results = []
+    for model in models:
+        model = EnsembleModel([model])
+        model.eval()
+        results = []
+        for data in data_loader:
+            img_metas = [img_meta.data[0] for img_meta in data['img_meta']]
+            with torch.no_grad():
+                results.extend(
+                    model(
+                        data['img'],
+                        img_metas,
+                        return_loss=False,
+                        rescale=True))
+        model_results.append(results)
+    return [
+        fuse_results(list(img_results), model_weights, **fusion)
+        for img_results in zip(*model_results)
+    ]
+
+
+def compare(result, ref_result, atol, min_mask_iou):
+    """Whether two results match, and the largest box / score difference."""
+    max_diff = 0.
+    for cls_idx, (bboxes, ref_bboxes) in enumerate(
+            zip(result[0], ref_result[0])):
+        if bboxes.shape != ref_bboxes.shape:
+            return False, np.inf
+        if bboxes.size == 0:
+            continue
+        max_diff = max(max_diff, np.abs(bboxes - ref_bboxes).max())
+        segms, ref_segms = result[1][cls_idx], ref_result[1][cls_idx]
+        ious = np.diag(maskUtils.iou(segms, ref_segms, [0] * len(ref_segms)))
+        # the IoU of two empty masks is 0
+        same = [a['counts'] == b['counts'] for a, b in zip(segms, ref_segms)]
+        if np.where(same, 1., ious).min() < min_mask_iou:
+            return False, max_diff
+    return max_diff <= atol, max_diff
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    torch.manual_seed(args.seed)
+    # the sequential test runs with the threads of a worker
+    torch.set_num_threads(args.worker_threads)
+    tmpdir = tempfile.TemporaryDirectory()
+
+    test_cfg = mmcv.ConfigDict(
+        dict(
+            rpn=dict(
+                nms_across_levels=False,
+                nms_pre=1000,
+                nms_post=1000,
+                max_num=1000,
+                nms_thr=0.7,
+                min_bbox_size=0),
+            rcnn=dict(
+                score_thr=args.thres,
+                nms=dict(type='nms', iou_thr=0.5),
+                max_per_img=20,
+                mask_thr_binary=0.5),
+            keep_all_stages=False))
+    models, model_cfgs = [], []
+    for i, config_path in enumerate(args.cfg_list):
+        cfg = mmcv.Config.fromfile(config_path)
+        cfg.model.pretrained = None
+        model = build_detector(cfg.model, train_cfg=None, test_cfg=test_cfg)
+        if args.checkpoint is not None:
+            checkpoint_path = args.checkpoint[i]
+            load_checkpoint(model, checkpoint_path, map_location='cpu')
+        else:
+            # the workers build their own model, with these weights
+            checkpoint_path = osp.join(tmpdir.name, '{}.pth'.format(i))
+            torch.save(dict(state_dict=model.state_dict()), checkpoint_path)
+        models.append(model)
+        model_cfgs.append(dict(config=config_path, checkpoint=checkpoint_path))
+
+    ann_file, img_prefix = args.ann_file, args.img_prefix
+    if ann_file is None:
+        img_prefix = tmpdir.name
+        ann_file = random_images(args.num_imgs, img_prefix, rng)
+    dataset = CustomDataset(
+        ann_file=ann_file,
+        img_prefix=img_prefix,
+        img_scale=args.img_scale,
+        img_norm_cfg=dict(
+            mean=[123.675, 116.28, 103.53],
+            std=[58.395, 57.12, 57.375],
+            to_rgb=True),
+        size_divisor=32,
+        flip_ratio=int(args.flip),
+        with_mask=False,
+        with_label=False,
+        test_mode=True)
+    dataset.img_infos = dataset.img_infos[:args.num_imgs]
+    data_loader = build_dataloader(
+        dataset,
+        imgs_per_gpu=args.imgs_per_gpu,
+        workers_per_gpu=0,
+        dist=False,
+        shuffle=False)
+
+    model_weights = [1.] * len(models)
+    fusion = dict(
+        method=args.fusion,
+        max_per_img=test_cfg.rcnn.max_per_img,
+        mask_thr=test_cfg.rcnn.mask_thr_binary)
+    ref_results = sequential_test(models, data_loader, model_weights, fusion)
+    devices = args.devices or ['cpu'] * len(models)
+    with EnsembleScheduler(
+            model_cfgs,
+            devices,
+            test_cfg=test_cfg,
+            fusion=dict(fusion, model_weights=model_weights),
+            num_threads=args.worker_threads) as scheduler:
+        results = scheduler.run(data_loader)
+    tmpdir.cleanup()
+
+    assert len(results) == len(ref_results) == len(dataset)
+    num_dets = sum(len(bboxes) for ref_result in ref_results
+                   for bboxes in ref_result[0])
+    # a check without detections compares nothing
+    assert num_dets > 0, 'no detection, lower --thres'
+
+    num_mismatch = 0
+    max_diff = 0.
+    for i, (result, ref_result) in enumerate(zip(results, ref_results)):
+        match, diff = compare(result, ref_result, args.atol,
+                              args.min_mask_iou)
+        max_diff = max(max_diff, diff)
+        if not match:
+            num_mismatch += 1
+            print('image {} ({}) differs, max box diff {}'.format(
+                i, dataset.img_infos[i]['filename'], diff))
+    print('{} models on {}, {} images, {} detections, {} mismatches, max box '
+          'diff {}'.format(
+              len(models), ', '.join(devices), len(results), num_dets,
+              num_mismatch, max_diff))
+    assert num_mismatch == 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""Check and time ``eval_map`` against the former loops over the boxes.
+
+Random ground truth and detections of an OID-like validation set (275
+classes of long-tailed frequencies, a few objects per image, detections
+jittered around them with confused classes and false positives, rounded
+scores with ties) are evaluated by ``eval_map`` and by the former
+implementation (a loop over the rows of ``bbox_overlaps``, nested loops
+over the dets and gts in ``tpfp_default`` and ``tpfp_imagenet``, the
+classes evaluated one after the other). The recalls, precisions and APs of
+every class are compared bit for bit and the times are reported:
+
+    python tools/check_eval_map.py --num_images 5000 --nproc 8
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mmdet.core import average_precision, eval_map
+from mmdet.core.evaluation.mean_ap import get_cls_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check eval_map against the former loops')
+    parser.add_argument('--num_images', type=int, default=2000)
+    parser.add_argument('--num_classes', type=int, default=275)
+    parser.add_argument('--nproc', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--skip_loop',
+        action='store_true',
+        help='only time eval_map, without the former implementation')
+    return parser.parse_args()
+
+
+def bbox_overlaps_loop(bboxes1, bboxes2, mode='iou'):
+    """The former bbox_overlaps, a loop over the rows."""
+    bboxes1 = bboxes1.astype(np.float32)
+    bboxes2 = bboxes2.astype(np.float32)
+    rows = bboxes1.shape[0]
+    cols = bboxes2.shape[0]
+    ious = np.zeros((rows, cols), dtype=np.float32)
+    if rows * cols == 0:
+        return ious
+    exchange = False
+    if bboxes1.shape[0] > bboxes2.shape[0]:
+        bboxes1, bboxes2 = bboxes2, bboxes1
+        ious = np.zeros((cols, rows), dtype=np.float32)
+        exchange = True
+    area1 = (bboxes1[:, 2] - bboxes1[:, 0] + 1) * (
+        bboxes1[:, 3] - bboxes1[:, 1] + 1)
+    area2 = (bboxes2[:, 2] - bboxes2[:, 0] + 1) * (
+        bboxes2[:, 3] - bboxes2[:, 1] + 1)
+    for i in range(bboxes1.shape[0]):
+        x_start = np.maximum(bboxes1[i, 0], bboxes2[:, 0])
+        y_start = np.maximum(bboxes1[i, 1], bboxes2[:, 1])
+        x_end = np.minimum(bboxes1[i, 2], bboxes2[:, 2])
+        y_end = np.minimum(bboxes1[i, 3], bboxes2[:, 3])
+        overlap = np.maximum(x_end - x_start + 1, 0) * np.maximum(
+            y_end - y_start + 1, 0)
+        if mode == 'iou':
+            union = area1[i] + area2 - overlap
+        else:
+            union = area1[i] if not exchange else area2
+        ious[i, :] = overlap / union
+    if exchange:
+        ious = ious.T
+    return ious
+
+
+def _fp_without_gts(det_bboxes, fp, area_ranges):
+    if area_ranges == [(None, None)]:
+        fp[...] = 1
+    else:
+        det_areas = (det_bboxes[:, 2] - det_bboxes[:, 0] + 1) * (
+            det_bboxes[:, 3] - det_bboxes[:, 1] + 1)
+        for i, (min_area, max_area) in enumerate(area_ranges):
+            fp[i, (det_areas >= min_area) & (det_areas < max_area)] = 1
+
+
+def _in_range(bbox, min_area, max_area):
+    area = (bbox[2] - bbox[0] + 1) * (bbox[3] - bbox[1] + 1)
+    return area >= min_area and area < max_area
+
+
+def tpfp_imagenet_loop(det_bboxes,
+                       gt_bboxes,
+                       gt_ignore,
+                       default_iou_thr,
+                       area_ranges=None):
+    """The former tpfp_imagenet, a loop over the dets and the gts."""
+    num_dets = det_bboxes.shape[0]
+    num_gts = gt_bboxes.shape[0]
+    if area_ranges is None:
+        area_ranges = [(None, None)]
+    tp = np.zeros((len(area_ranges), num_dets), dtype=np.float32)
+    fp = np.zeros((len(area_ranges), num_dets), dtype=np.float32)
+    if num_gts == 0:
+        _fp_without_gts(det_bboxes, fp, area_ranges)
+        return tp, fp
+    ious = bbox_overlaps_loop(det_bboxes, gt_bboxes - 1)
+    gt_w = gt_bboxes[:, 2] - gt_bboxes[:, 0] + 1
+    gt_h = gt_bboxes[:, 3] - gt_bboxes[:, 1] + 1
+    iou_thrs = np.minimum((gt_w * gt_h) / ((gt_w + 10.0) * (gt_h + 10.0)),
+                          default_iou_thr)
+    sort_inds = np.argsort(-det_bboxes[:, -1])
+    for k, (min_area, max_area) in enumerate(area_ranges):
+        gt_covered = np.zeros(num_gts, dtype=bool)
+        if min_area is None:
+            gt_area_ignore = np.zeros_like(gt_ignore, dtype=bool)
+        else:
+            gt_areas = gt_w * gt_h
+            gt_area_ignore = (gt_areas < min_area) | (gt_areas >= max_area)
+        for i in sort_inds:
+            max_iou = -1
+            matched_gt = -1
+            for j in range(num_gts):
+                if gt_covered[j]:
+                    continue
+                elif ious[i, j] >= iou_thrs[j] and ious[i, j] > max_iou:
+                    max_iou = ious[i, j]
+                    matched_gt = j
+            if matched_gt >= 0:
+                gt_covered[matched_gt] = 1
+                if not (gt_ignore[matched_gt] or gt_area_ignore[matched_gt]):
+                    tp[k, i] = 1
+            elif min_area is None or _in_range(det_bboxes[i], min_area,
+                                               max_area):
+                fp[k, i] = 1
+    return tp, fp
+
+
+def tpfp_default_loop(det_bboxes,
+                      gt_bboxes,
+                      gt_ignore,
+                      iou_thr,
+                      area_ranges=None):
+    """The former tpfp_default, a loop over the dets."""
+    num_dets = det_bboxes.shape[0]
+    num_gts = gt_bboxes.shape[0]
+    if area_ranges is None:
+        area_ranges = [(None, None)]
+    tp = np.zeros((len(area_ranges), num_dets), dtype=np.float32)
+    fp = np.zeros((len(area_ranges), num_dets), dtype=np.float32)
+    if num_gts == 0:
+        _fp_without_gts(det_bboxes, fp, area_ranges)
+        return tp, fp
+    ious = bbox_overlaps_loop(det_bboxes, gt_bboxes)
+    ious_max = ious.max(axis=1)
+    ious_argmax = ious.argmax(axis=1)
+    sort_inds = np.argsort(-det_bboxes[:, -1])
+    for k, (min_area, max_area) in enumerate(area_ranges):
+        gt_covered = np.zeros(num_gts, dtype=bool)
+        if min_area is None:
+            gt_area_ignore = np.zeros_like(gt_ignore, dtype=bool)
+        else:
+            gt_areas = (gt_bboxes[:, 2] - gt_bboxes[:, 0] + 1) * (
+                gt_bboxes[:, 3] - gt_bboxes[:, 1] + 1)
+            gt_area_ignore = (gt_areas < min_area) | (gt_areas >= max_area)
+        for i in sort_inds:
+            if ious_max[i] >= iou_thr:
+                matched_gt = ious_argmax[i]
+                if not (gt_ignore[matched_gt] or gt_area_ignore[matched_gt]):
+                    if not gt_covered[matched_gt]:
+                        gt_covered[matched_gt] = True
+                        tp[k, i] = 1
+                    else:
+                        fp[k, i] = 1
+            elif min_area is None or _in_range(det_bboxes[i], min_area,
+                                               max_area):
+                fp[k, i] = 1
+    return tp, fp
+
+
+def eval_map_loop(det_results,
+                  gt_bboxes,
+                  gt_labels,
+                  gt_ignore=None,
+                  scale_ranges=None,
+                  iou_thr=0.5,
+                  dataset=None):
+    """The former eval_map, the classes then the images one by one."""
+    area_ranges = ([(rg[0]**2, rg[1]**2) for rg in scale_ranges]
+                   if scale_ranges is not None else None)
+    num_scales = len(scale_ranges) if scale_ranges is not None else 1
+    tpfp_func = (
+        tpfp_imagenet_loop if dataset in ['det', 'vid'] else tpfp_default_loop)
+    eval_results = []
+    for i in range(len(det_results[0])):
+        cls_dets, cls_gts, cls_gt_ignore = get_cls_results(
+            det_results, gt_bboxes, gt_labels, gt_ignore, i)
+        tp, fp = tuple(
+            zip(*[
+                tpfp_func(cls_dets[j], cls_gts[j], cls_gt_ignore[j], iou_thr,
+                          area_ranges) for j in range(len(cls_dets))
+            ]))
+        num_gts = np.zeros(num_scales, dtype=int)
+        for j, bbox in enumerate(cls_gts):
+            if area_ranges is None:
+                num_gts[0] += np.sum(np.logical_not(cls_gt_ignore[j]))
+            else:
+                gt_areas = (bbox[:, 2] - bbox[:, 0] + 1) * (
+                    bbox[:, 3] - bbox[:, 1] + 1)
+                for k, (min_area, max_area) in enumerate(area_ranges):
+                    num_gts[k] += np.sum(
+                        np.logical_not(cls_gt_ignore[j]) &
+                        (gt_areas >= min_area) & (gt_areas < max_area))
+        cls_dets = np.vstack(cls_dets)
+        sort_inds = np.argsort(-cls_dets[:, -1])
+        tp = np.cumsum(np.hstack(tp)[:, sort_inds], axis=1)
+        fp = np.cumsum(np.hstack(fp)[:, sort_inds], axis=1)
+        eps = np.finfo(np.float32).eps
+        recalls = tp / np.maximum(num_gts[:, np.newaxis], eps)
+        precisions = tp / np.maximum((tp + fp), eps)
+        if scale_ranges is None:
+            recalls = recalls[0, :]
+            precisions = precisions[0, :]
+            num_gts = num_gts.item()
+        mode = 'area' if dataset != 'voc07' else '11points'
+        eval_results.append({
+            'num_gts': num_gts,
+            'num_dets': cls_dets.shape[0],
+            'recall': recalls,
+            'precision': precisions,
+            'ap': average_precision(recalls, precisions, mode)
+        })
+    return eval_results
+
+
+def random_dataset(num_images, num_classes, rng, img_size=(1024, 768)):
+    """Gts of long-tailed classes, dets jittered around them."""
+    w, h = img_size
+    cls_freqs = 1. / np.arange(1, num_classes + 1)
+    cls_freqs /= cls_freqs.sum()
+    det_results, gt_bboxes, gt_labels, gt_ignore = [], [], [], []
+    for _ in range(num_images):
+        num_gts = rng.randint(0, 12)
+        centers = rng.uniform(0, 1, (num_gts, 2)) * [w, h]
+        sizes = rng.uniform(4, 400, (num_gts, 2))
+        bboxes = np.hstack([centers - sizes / 2, centers + sizes / 2])
+        labels = rng.choice(num_classes, num_gts, p=cls_freqs) + 1
+        gt_bboxes.append(bboxes.astype(np.float32))
+        gt_labels.append(labels)
+        gt_ignore.append(rng.uniform(size=num_gts) < 0.1)
+        # jittered dets of the gts, some of another class
+        objs = rng.randint(0, max(num_gts, 1), num_gts * 4)
+        dets = bboxes[objs] + rng.normal(0, 0.1, (len(objs), 4)) * np.tile(
+            sizes[objs], 2)
+        det_labels = np.where(
+            rng.uniform(size=len(objs)) < 0.2,
+            rng.choice(num_classes, len(objs), p=cls_freqs) + 1, labels[objs])
+        # false positives
+        num_fps = rng.randint(0, 30)
+        fp_centers = rng.uniform(0, 1, (num_fps, 2)) * [w, h]
+        fp_sizes = rng.uniform(4, 400, (num_fps, 2))
+        dets = np.vstack([
+            dets,
+            np.hstack(
+                [fp_centers - fp_sizes / 2, fp_centers + fp_sizes / 2])
+        ])
+        det_labels = np.concatenate([
+            det_labels,
+            rng.choice(num_classes, num_fps, p=cls_freqs) + 1
+        ])
+        # rounded scores, with ties
+        scores = np.round(rng.uniform(size=(len(dets), 1)), 2)
+        dets = np.hstack([dets, scores]).astype(np.float32)
+        det_results.append([
+            dets[det_labels == i + 1] for i in range(num_classes)
+        ])
+    return det_results, gt_bboxes, gt_labels, gt_ignore
+
+
+def compare(name, results, references):
+    num_same = 0
+    for result, reference in zip(results, references):
+        num_same += all(
+            np.array_equal(result[key], reference[key])
+            for key in ('num_gts', 'num_dets', 'recall', 'precision', 'ap'))
+    print('{}: {}/{} classes identical'.format(name, num_same,
+                                               len(references)))
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    det_results, gt_bboxes, gt_labels, gt_ignore = random_dataset(
+        args.num_images, args.num_classes, rng)
+    settings = [
+        ('default', dict()),
+        ('default ignore', dict(gt_ignore=gt_ignore)),
+        ('default scales',
+         dict(gt_ignore=gt_ignore, scale_ranges=[(0, 32), (32, 96),
+                                                 (96, 1e5)])),
+        ('imagenet', dict(dataset='det')),
+        ('imagenet scales', dict(dataset='det', scale_ranges=[(0, 96),
+                                                              (96, 1e5)])),
+    ]
+    for name, kwargs in settings:
+        times = []
+        for nproc in (1, args.nproc):
+            start = time.time()
+            _, results = eval_map(
+                det_results,
+                gt_bboxes,
+                gt_labels,
+                print_summary=False,
+                nproc=nproc,
+                **kwargs)
+            times.append(time.time() - start)
+        line = '{:16s} eval_map {:6.2f} s, nproc={} {:6.2f} s'.format(
+            name, times[0], args.nproc, times[1])
+        if not args.skip_loop:
+            start = time.time()
+            references = eval_map_loop(det_results, gt_bboxes, gt_labels,
+                                       **kwargs)
+            line += ', former loops {:6.2f} s'.format(time.time() - start)
+        print(line)
+        if not args.skip_loop:
+            compare(name, results, references)
+
+
+if __name__ == '__main__':
+    main()
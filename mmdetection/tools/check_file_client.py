@@ -0,0 +1,170 @@
+"""Check the pluggable storage backends with a fake in-memory backend.
+
+A backend keeping its files in a dict is registered to :class:`FileClient`
+and used by a :class:`CustomDataset` whose images are only in this backend:
+
+- the backend is opened lazily, once per process, and re-opened after
+  pickling (as in the data loader workers), without its unpicklable state,
+- ``get_many`` returns the files in order and a missing file raises
+  ``FileNotFoundError``,
+- the dataset reads its images through the client, and a train image
+  missing from ``img_prefix`` from the first fallback prefix holding it,
+- ``file_client_from_prefix`` and the registration reject what they should.
+
+    python tools/check_file_client.py
+"""
+import argparse
+import os.path as osp
+import pickle
+import tempfile
+
+import cv2
+import mmcv
+import numpy as np
+
+from mmdet.datasets import CustomDataset, FileClient
+from mmdet.datasets.file_client import (BaseStorageBackend,
+                                        file_client_from_prefix)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check FileClient with an in-memory backend')
+    parser.add_argument('--num_files', type=int, default=20)
+    parser.add_argument('--num_threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class MemoryBackend(BaseStorageBackend):
+    """Files of a dict, keyed by path. The dict of opened files stands for
+    the connections of a real backend."""
+
+    _unpicklable = ('_opened', )
+
+    def __init__(self, files):
+        super(MemoryBackend, self).__init__()
+        self.files = files
+        self.num_opens = 0
+
+    def _open(self):
+        self._opened = dict(self.files)
+        self.num_opens += 1
+
+    def get(self, filepath):
+        self._check_open()
+        if filepath not in self._opened:
+            raise FileNotFoundError(filepath)
+        return self._opened[filepath]
+
+
+def check(name, passed):
+    print('{:56s} {}'.format(name, 'OK' if passed else 'FAILED'))
+    return passed
+
+
+def raises(exception, func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except exception:
+        return True
+    return False
+
+
+def check_client(num_files, num_threads, rng):
+    results = []
+    files = {
+        'mem://{:03d}'.format(i): rng.bytes(rng.randint(1, 100))
+        for i in range(num_files)
+    }
+    client = FileClient('memory', num_threads=num_threads, files=files)
+    paths = list(files)[::-1]
+    results.append(
+        check('get', all(client.get(p) == files[p] for p in paths)))
+    results.append(
+        check('get_many in order',
+              client.get_many(paths) == [files[p] for p in paths]))
+    results.append(check('opened once', client.backend.num_opens == 1))
+    results.append(
+        check('missing file',
+              raises(FileNotFoundError, client.get_many,
+                     paths[:2] + ['mem://missing'])))
+
+    state = client.backend.__getstate__()
+    results.append(check('not pickled', state['_opened'] is None))
+    unpickled = pickle.loads(pickle.dumps(client))
+    results.append(
+        check('re-opened after pickling',
+              unpickled.get_many(paths) == [files[p] for p in paths]
+              and unpickled.backend.num_opens == 2))
+    return results
+
+
+def check_dataset(rng, tmpdir):
+    """Images of a dataset in the memory backend, some of them only in the
+    fallback prefix of the train images."""
+    imgs, files, img_infos = [], {}, []
+    for i in range(4):
+        img = rng.randint(0, 256, size=(32, 48, 3)).astype(np.uint8)
+        filename = '{}.png'.format(i)
+        split = 'val' if i % 2 else 'train'
+        files['mem://data/{}/{}'.format(split, filename)] = cv2.imencode(
+            '.png', img)[1].tobytes()
+        imgs.append(img)
+        img_infos.append(dict(filename=filename, width=48, height=32))
+    ann_file = osp.join(tmpdir, 'ann.pkl')
+    mmcv.dump(img_infos, ann_file)
+    dataset = CustomDataset(
+        ann_file=ann_file,
+        img_prefix='mem://data/train',
+        img_scale=(48, 32),
+        img_norm_cfg=dict(mean=[0, 0, 0], std=[1, 1, 1], to_rgb=False),
+        file_client_args=dict(backend='memory', files=files),
+        test_mode=True)
+    read = [dataset.read_img(img_info)[0] for img_info in img_infos]
+    return [
+        check('dataset images, with the fallback prefix',
+              all(np.array_equal(a, b) for a, b in zip(read, imgs))),
+        check('dataset missing image',
+              raises(FileNotFoundError, dataset.read_img,
+                     dict(filename='missing.png')))
+    ]
+
+
+def check_selection():
+    client = file_client_from_prefix('data/train/', backend='memory', files={})
+    results = [
+        check('backend argument', client.backend_name == 'memory'),
+        check('disk by default',
+              file_client_from_prefix('data/train/').backend_name == 'disk'),
+        check('unknown backend', raises(ValueError, FileClient, 'missing')),
+        check('abstract backend', raises(TypeError, BaseStorageBackend)),
+        check('register a non-backend',
+              raises(TypeError, FileClient.register_backend, 'dict', dict))
+    ]
+    try:
+        client = file_client_from_prefix('gs://bucket/data/train/')
+    except ImportError:
+        print('{:56s} {}'.format('gcs for gs:// prefixes',
+                                 'skipped, no google-cloud-storage'))
+    else:
+        results.append(
+            check('gcs for gs:// prefixes', client.backend_name == 'gcs'))
+    return results
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    FileClient.register_backend('memory', MemoryBackend)
+    results = check_client(args.num_files, args.num_threads, rng)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results += check_dataset(rng, tmpdir)
+    results += check_selection()
+    print('{}/{} checks passed'.format(sum(results), len(results)))
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Check that late fusion maps the flipped augmentations back.
+
+A probe detector finds, in each channel of its input, the box of the pixels
+above 0.5 (one object of that class) and outputs it like ``simple_test``
+with rescale: boxes and box masks in the original image, not unflipped. An
+image with an object per class is tested by :meth:`EnsembleModel.
+late_fusion_test` at two scales, with and without flip, then:
+
+- the fusion of all the augmentations must equal that of the unflipped
+  ones only,
+- the fusion on the mirror of the image must be the mirror of the fusion on
+  the image (at scale 1 only, the boxes of an upscaled mirror are half a
+  pixel off by the rounding of the upscaling).
+
+    python tools/check_fusion_flip.py
+"""
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+import pycocotools.mask as mask_util
+import torch
+from torch import nn
+
+from mmdet.core import flip_result
+from mmdet.models.detectors.ensemble_model import EnsembleModel
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the flipped augmentations of late fusion')
+    parser.add_argument('--num_classes', type=int, default=3)
+    parser.add_argument('--height', type=int, default=48)
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--method', choices=['wbf', 'soft_merge'],
+                        default='wbf')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class BoxProbe(nn.Module):
+    """Detector of the box of the bright pixels of each channel."""
+
+    with_mask = True
+
+    def __init__(self, num_classes):
+        super(BoxProbe, self).__init__()
+        self.num_classes = num_classes
+        self.dummy = nn.Parameter(torch.zeros(1))
+        self.test_cfg = SimpleNamespace(
+            rcnn=SimpleNamespace(max_per_img=100, mask_thr_binary=0.5))
+
+    def simple_test(self, img, img_meta, rescale=True):
+        assert rescale
+        meta = img_meta[0]
+        h, w = meta['img_shape'][:2]
+        ori_h, ori_w = meta['ori_shape'][:2]
+        img = img[0, :, :h, :w].cpu().numpy()
+        bbox_result, segm_result = [], []
+        for c in range(self.num_classes):
+            ys, xs = np.nonzero(img[c] > 0.5)
+            if len(xs) == 0:
+                bbox_result.append(np.zeros((0, 5), dtype=np.float32))
+                segm_result.append([])
+                continue
+            score = img[c][ys, xs].mean()
+            bbox = np.array([xs.min(), ys.min(), xs.max(), ys.max()
+                             ]) / meta['scale_factor']
+            bbox_result.append(
+                np.append(bbox, score)[None].astype(np.float32))
+            # a box mask, pasted like get_seg_masks
+            x1, y1, x2, y2 = bbox.astype(np.int32)
+            mask = np.zeros((ori_h, ori_w), dtype=np.uint8, order='F')
+            mask[y1:y2 + 1, x1:x2 + 1] = 1
+            segm_result.append([mask_util.encode(mask)])
+        return bbox_result, segm_result
+
+
+def make_augs(img, scales=(1, 2)):
+    """Inputs and metas of the augmentations of an image (c, h, w)."""
+    imgs, img_metas = [], []
+    ori_shape = (img.shape[1], img.shape[2], 3)
+    for scale in scales:
+        scaled = img.repeat_interleave(scale, 1).repeat_interleave(scale, 2)
+        for flip in (False, True):
+            imgs.append((scaled.flip(-1) if flip else scaled)[None])
+            img_metas.append([
+                dict(
+                    ori_shape=ori_shape,
+                    img_shape=(scaled.shape[1], scaled.shape[2], 3),
+                    pad_shape=(scaled.shape[1], scaled.shape[2], 3),
+                    scale_factor=float(scale),
+                    flip=flip)
+            ])
+    return imgs, img_metas
+
+
+def compare(result, expected):
+    """Max box difference (inf if the numbers of boxes differ), number of
+    different masks."""
+    box_diff = 0
+    for a, b in zip(result[0], expected[0]):
+        if a.shape != b.shape:
+            return np.inf, -1
+        if len(a):
+            box_diff = max(box_diff, np.abs(a - b).max())
+    num_masks = sum(ra['counts'] != rb['counts']
+                    for a, b in zip(result[1], expected[1])
+                    for ra, rb in zip(a, b))
+    return box_diff, num_masks
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    h, w = args.height, args.width
+    img = torch.zeros(args.num_classes, h, w)
+    for c in range(args.num_classes):
+        # asymmetric boxes, so that an unflipped mirror never matches
+        x1 = rng.randint(0, w // 2 - 4)
+        y1 = rng.randint(0, h - 8)
+        img[c, y1:rng.randint(y1 + 4, h), x1:rng.randint(x1 + 4, w // 2)] = (
+            0.6 + 0.1 * c)
+
+    model = EnsembleModel([BoxProbe(args.num_classes)],
+                          fusion=dict(method=args.method))
+    imgs, img_metas = make_augs(img)
+    fused = model.late_fusion_test(imgs, img_metas)[0]
+    unflipped = model.late_fusion_test(imgs[0::2], img_metas[0::2])[0]
+    direct = model.late_fusion_test(imgs[:2], img_metas[:2])[0]
+    mirror_imgs, mirror_metas = make_augs(img.flip(-1), scales=(1, ))
+    mirror = model.late_fusion_test(mirror_imgs, mirror_metas)[0]
+    ori_meta = dict(img_shape=(h, w, 3), scale_factor=1.0)
+
+    ok = True
+    for name, result, expected in [
+        ('all augs vs unflipped augs', fused, unflipped),
+        ('mirror vs mirrored fusion', mirror, flip_result(direct, ori_meta)),
+    ]:
+        box_diff, num_masks = compare(result, expected)
+        passed = box_diff < 1e-3 and num_masks == 0
+        ok &= passed
+        print('{}: max box diff {:.2e}, {} different masks: {}'.format(
+            name, box_diff, num_masks, 'ok' if passed else 'MISMATCH'))
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Check and time the batched ``multiclass_nms`` against one NMS per class.
+
+Random detections of ``--num_classes`` classes (boxes jittered around a
+few objects, like the outputs of a bbox head) go through
+``multiclass_nms`` and through the former loop over the classes, on CPU and
+on CUDA when available, the kept boxes, scores and labels are compared and
+the time per image is reported:
+
+    python tools/check_multiclass_nms.py --num_classes 276 --score_thr 0
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from mmdet.core import multiclass_nms
+from mmdet.ops.nms import nms_wrapper
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the batched multiclass_nms against a class loop')
+    parser.add_argument('--num_classes', type=int, default=276)
+    parser.add_argument('--num_boxes', type=int, default=1000)
+    parser.add_argument('--score_thr', type=float, default=0.)
+    parser.add_argument('--iou_thr', type=float, default=0.5)
+    parser.add_argument('--max_per_img', type=int, default=100)
+    parser.add_argument('--num_iters', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def multiclass_nms_loop(multi_bboxes, multi_scores, score_thr, nms_cfg,
+                        max_num=-1):
+    """One NMS per class, the former implementation of multiclass_nms."""
+    num_classes = multi_scores.shape[1]
+    bboxes, labels = [], []
+    nms_cfg_ = nms_cfg.copy()
+    nms_op = getattr(nms_wrapper, nms_cfg_.pop('type', 'nms'))
+    for i in range(1, num_classes):
+        cls_inds = multi_scores[:, i] > score_thr
+        if not cls_inds.any():
+            continue
+        _bboxes = multi_bboxes[cls_inds, i * 4:(i + 1) * 4]
+        _scores = multi_scores[cls_inds, i]
+        cls_dets = torch.cat([_bboxes, _scores[:, None]], dim=1)
+        cls_dets, _ = nms_op(cls_dets, **nms_cfg_)
+        bboxes.append(cls_dets)
+        labels.append(
+            multi_bboxes.new_full((cls_dets.shape[0], ),
+                                  i - 1,
+                                  dtype=torch.long))
+    if not bboxes:
+        return multi_bboxes.new_zeros((0, 5)), multi_bboxes.new_zeros(
+            (0, ), dtype=torch.long)
+    bboxes = torch.cat(bboxes)
+    labels = torch.cat(labels)
+    if max_num > 0 and bboxes.shape[0] > max_num:
+        _, inds = bboxes[:, -1].sort(descending=True)
+        bboxes = bboxes[inds[:max_num]]
+        labels = labels[inds[:max_num]]
+    return bboxes, labels
+
+
+def random_detections(num_boxes, num_classes, rng, img_size=(1333, 800)):
+    """Boxes of every class jittered around a few objects, softmax scores."""
+    w, h = img_size
+    num_objects = 20
+    centers = rng.uniform(0, 1, (num_objects, 2)) * [w, h]
+    sizes = rng.uniform(16, 400, (num_objects, 2))
+    objects = rng.randint(num_objects, size=num_boxes)
+    boxes = np.concatenate(
+        [centers[objects] - sizes[objects] / 2,
+         centers[objects] + sizes[objects] / 2], axis=1)
+    boxes = boxes[:, None] + rng.normal(
+        0, 8, (num_boxes, num_classes, 4)) * (sizes[objects, None].repeat(
+            2, axis=-1) / 64)
+    boxes[..., 0::2] = boxes[..., 0::2].clip(0, w - 1)
+    boxes[..., 1::2] = boxes[..., 1::2].clip(0, h - 1)
+    logits = rng.normal(0, 2, (num_boxes, num_classes))
+    scores = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    return (torch.from_numpy(boxes.reshape(num_boxes, -1)).float(),
+            torch.from_numpy(scores).float())
+
+
+def compare(name, results, references):
+    num_same = num_boxes = 0
+    max_error = 0.
+    for (bboxes, labels), (ref_bboxes, ref_labels) in zip(
+            results, references):
+        num_boxes += max(len(bboxes), len(ref_bboxes))
+        if bboxes.shape == ref_bboxes.shape:
+            same = (labels == ref_labels) & (bboxes == ref_bboxes).all(1)
+            num_same += int(same.sum())
+            if len(bboxes):
+                max_error = max(max_error,
+                                float((bboxes - ref_bboxes).abs().max()))
+    print('{}: {}/{} identical boxes, max abs error {:.2e}'.format(
+        name, num_same, num_boxes, max_error))
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    inputs = [
+        random_detections(args.num_boxes, args.num_classes, rng)
+        for _ in range(args.num_iters)
+    ]
+    nms_cfg = dict(type='nms', iou_thr=args.iou_thr)
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        for max_num in (-1, args.max_per_img):
+            outputs = {}
+            for name, func in (('loop', multiclass_nms_loop),
+                               ('batched', multiclass_nms)):
+                outputs[name] = []
+                start = time.time()
+                for bboxes, scores in inputs:
+                    outputs[name].append(
+                        func(
+                            bboxes.to(device), scores.to(device),
+                            args.score_thr, nms_cfg, max_num))
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                print('{} max_num={} {:8s} {:8.1f} ms / image'.format(
+                    device, max_num, name,
+                    1000 * (time.time() - start) / args.num_iters))
+            compare('{} max_num={}'.format(device, max_num),
+                    outputs['batched'], outputs['loop'])
+
+
+if __name__ == '__main__':
+    main()
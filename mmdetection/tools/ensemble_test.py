@@ -2,17 +2,17 @@ import argparse
 import os
 import os.path as osp
 import shutil
-import tempfile
 
 import mmcv
 import torch
-import torch.distributed as dist
 from mmcv.runner import load_checkpoint, get_dist_info
 from mmcv.parallel import MMDataParallel, MMDistributedDataParallel
 
-from mmdet.apis import init_dist
+from mmdet.apis import (init_dist, EnsembleScheduler, ResultSpool,
+                        collect_spooled_results, dump_results,
+                        get_spool_dir, pending_loader)
 from mmdet.core import results2json, coco_eval
-from mmdet.datasets import build_dataloader, get_dataset
+from mmdet.datasets import build_dataloader, get_dataset, DevicePrefetcher
 from mmdet.models import build_detector
 from mmdet.models.detectors.ensemble_model import EnsembleModel
 
@@ -26,10 +26,11 @@ def single_gpu_test(model, data_loader, show=False):
         with torch.no_grad():
             if i%100==0: print(' ', i)
             result = model(return_loss=False, rescale=not show, **data)
-        results.append(result)
+        # EnsembleModel returns the results of every image of the batch
+        results.extend(result)
 
         if show:
-            model.module.show_result(data, result, dataset.img_norm_cfg)
+            model.module.show_result(data, result[0], dataset.img_norm_cfg)
 
         batch_size = data['img'][0].size(0)
         for _ in range(batch_size):
@@ -37,69 +38,133 @@ def single_gpu_test(model, data_loader, show=False):
     return results
 
 
+def scheduler_test(scheduler, data_loader):
+    """Test with one worker process per model, see EnsembleScheduler."""
+    prog_bar = mmcv.ProgressBar(len(data_loader.dataset))
+
+    def update(batch_idx, results):
+        for _ in range(len(results)):
+            prog_bar.update()
+
+    return scheduler.run(data_loader, callback=update)
+
+
 def multi_gpu_test(model, data_loader, tmpdir=None):
+    """Test on every rank, spooling the results to ``tmpdir`` (see
+    :class:`ResultSpool`), where a killed test is resumed. The spool
+    of a temporary directory is removed once the results are read."""
     model.eval()
-    results = []
-    dataset = data_loader.dataset
     rank, world_size = get_dist_info()
+    spool = ResultSpool(
+        get_spool_dir(tmpdir), len(data_loader.dataset), rank=rank)
+    # only the images not in the spool yet are tested
+    data_loader, indices = pending_loader(data_loader, spool)
     if rank == 0:
-        prog_bar = mmcv.ProgressBar(len(dataset))
+        prog_bar = mmcv.ProgressBar(len(indices) * world_size)
+    indices = iter(indices)
     for i, data in enumerate(data_loader):
         with torch.no_grad():
             result = model(return_loss=False, rescale=True, **data)
-        results.append(result)
+        # EnsembleModel returns the results of every image of the batch
+        for img_result in result:
+            spool.add(next(indices), img_result)
 
         if rank == 0:
             batch_size = data['img'][0].size(0)
             for _ in range(batch_size * world_size):
                 prog_bar.update()
 
-    # collect results from all ranks
-    results = collect_results(results, len(dataset), tmpdir)
+    # merged from the chunks of all ranks while they are read, the spool
+    # of a temporary directory is removed then
+    return collect_spooled_results(spool, remove=tmpdir is None)
 
-    return results
 
+class DatasetShard(object):
+    """Images ``[start, end)`` of a test dataset.
 
-def collect_results(result_part, size, tmpdir=None):
-    rank, world_size = get_dist_info()
-    # create a tmp dir if it is not specified
-    if tmpdir is None:
-        MAX_LEN = 512
-        # 32 is whitespace
-        dir_tensor = torch.full((MAX_LEN, ),
-                                32,
-                                dtype=torch.uint8,
-                                device='cuda')
+    The other attributes (``CLASSES``, ``test_mode``, ``img_norm_cfg``...)
+    are those of the dataset.
+    """
+
+    def __init__(self, dataset, start, end):
+        self.dataset = dataset
+        self.start = start
+        self.end = min(end, len(dataset))
+
+    def __getattr__(self, name):
+        # not found on the shard, e.g. while unpickling, before 'dataset'
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __getitem__(self, idx):
+        return self.dataset[self.start + idx]
+
+    def __len__(self):
+        return self.end - self.start
+
+
+def dump_atomic(obj, file, file_format):
+    """Dump to a temporary file renamed to ``file``, so that ``file`` is
+    either complete or missing (e.g. if the job is preempted)."""
+    tmp_file = '{}.tmp{}'.format(file, os.getpid())
+    mmcv.dump(obj, tmp_file, file_format=file_format)
+    os.replace(tmp_file, file)
+
+
+def sharded_test(test, dataset, shard_size, shard_out, ann_file,
+                 tmpdir=None):
+    """Test ``dataset`` shard by shard, resuming the shards not done yet.
+
+    Shard ``i`` of ``n`` holds the images ``[i * shard_size, (i + 1) *
+    shard_size)``, its results are written to ``shard_out.format(i=i,
+    n=n)``, then a ``.done`` json records the images of the shard. A shard
+    is skipped when its ``.done`` matches, so a preempted job is resumed by
+    running the same command again.
+
+    Args:
+        test (callable): test function of a dataset, returning its results
+            on rank 0.
+        shard_size (int): number of images per shard.
+        shard_out (str): template of the result files, with ``{i}`` and
+            ``{n}`` fields.
+        ann_file (str): annotation file, recorded in the ``.done`` files.
+        tmpdir (str, optional): spool dir of the distributed tests, shard
+            ``i`` is spooled to ``tmpdir/shard_i``.
+    """
+    rank, _ = get_dist_info()
+    num_shards = -(-len(dataset) // shard_size)
+    for i in range(num_shards):
+        out_file = shard_out.format(i=i, n=num_shards)
+        done_file = out_file + '.done'
+        shard = DatasetShard(dataset, i * shard_size, (i + 1) * shard_size)
+        done = dict(
+            ann_file=ann_file,
+            start=shard.start,
+            end=shard.end,
+            num_images=len(dataset))
+        # every rank sees the same files, so they skip the same shards
+        if osp.isfile(out_file) and osp.isfile(done_file):
+            if mmcv.load(done_file) == done:
+                print('shard {}/{} already done: {}'.format(
+                    i, num_shards, out_file))
+                continue
+            raise ValueError(
+                '{} was written for other images ({}), remove it or use '
+                'another --shard_out'.format(done_file, mmcv.load(done_file)))
+        print('shard {}/{}: images {} to {}'.format(i, num_shards,
+                                                    shard.start, shard.end))
+        shard_tmpdir = None
+        if tmpdir is not None:
+            shard_tmpdir = osp.join(tmpdir, 'shard_{}'.format(i))
+        outputs = test(shard, shard_tmpdir)
         if rank == 0:
-            tmpdir = tempfile.mkdtemp()
-            tmpdir = torch.tensor(
-                bytearray(tmpdir.encode()), dtype=torch.uint8, device='cuda')
-            dir_tensor[:len(tmpdir)] = tmpdir
-        dist.broadcast(dir_tensor, 0)
-        tmpdir = dir_tensor.cpu().numpy().tobytes().decode().rstrip()
-    else:
-        mmcv.mkdir_or_exist(tmpdir)
-    # dump the part result to the dir
-    mmcv.dump(result_part, osp.join(tmpdir, 'part_{}.pkl'.format(rank)))
-    dist.barrier()
-    # collect all parts
-    if rank != 0:
-        return None
-    else:
-        # load results of all parts from tmp dir
-        part_list = []
-        for i in range(world_size):
-            part_file = osp.join(tmpdir, 'part_{}.pkl'.format(i))
-            part_list.append(mmcv.load(part_file))
-        # sort the results
-        ordered_results = []
-        for res in zip(*part_list):
-            ordered_results.extend(list(res))
-        # the dataloader may pad some samples
-        ordered_results = ordered_results[:size]
-        # remove tmp dir
-        shutil.rmtree(tmpdir)
-        return ordered_results
+            print('\nwriting results to {}'.format(out_file))
+            mmcv.mkdir_or_exist(osp.dirname(osp.abspath(out_file)))
+            dump_results(outputs, out_file)
+            dump_atomic(done, done_file, 'json')
+            if shard_tmpdir is not None and osp.isdir(shard_tmpdir):
+                shutil.rmtree(shard_tmpdir)
 
 
 def scale(s):
@@ -120,7 +185,70 @@ def parse_args():
     parser.add_argument('--max_per_img', type=int, default=100)
     parser.add_argument('--img_scale', type=scale, nargs='+')
     parser.add_argument('--flip', action='store_true')
+    parser.add_argument(
+        '--prefetch',
+        action='store_true',
+        help='load uint8 images resized once per scale to pinned memory, '
+        'and normalize and flip them on the gpu while the previous batch '
+        'is tested')
+    parser.add_argument(
+        '--img_uint8',
+        action='store_true',
+        help='pass uint8 images from the loader workers to the models, '
+        'which normalize them')
+    parser.add_argument(
+        '--imgs_per_gpu',
+        type=int,
+        default=1,
+        help='number of test images run together through the models')
+    parser.add_argument(
+        '--feat_cache',
+        choices=['keep', 'offload', 'recompute'],
+        default='keep',
+        help='whether the backbone features of each (model, augmentation) '
+        'are kept on the gpu, offloaded to pinned cpu memory or recomputed '
+        'by the rpn, bbox and mask passes')
+    parser.add_argument(
+        '--feat_cache_mb',
+        type=float,
+        help='memory budget of the cached features in MB')
+    parser.add_argument(
+        '--fusion',
+        choices=['wbf', 'soft_merge'],
+        help='fuse the detections of each model (and augmentation) instead '
+        'of merging the models per proposal')
+    parser.add_argument('--fusion_iou_thr', type=float, default=0.55)
+    parser.add_argument('--fusion_skip_thr', type=float, default=0.)
+    parser.add_argument(
+        '--model_weights',
+        type=float,
+        nargs='+',
+        help='weight of each model in the fusion')
+    parser.add_argument(
+        '--devices',
+        type=str,
+        nargs='+',
+        help='device of each model (e.g. cuda:0 cuda:1 cpu), each model then '
+        'runs in its own worker process and the models are fused')
+    parser.add_argument(
+        '--queue_size',
+        type=int,
+        default=2,
+        help='max number of batches waiting for each worker')
+    parser.add_argument(
+        '--worker_threads',
+        type=int,
+        help='torch threads of each worker process')
     parser.add_argument('--out', help='output result file')
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        help='test the images of --ann_file by shards of this size, '
+        'resuming the shards not done yet')
+    parser.add_argument(
+        '--shard_out',
+        help='result file of each shard, with {i} and {n} fields, e.g. '
+        'LB_out_{i}of{n}.pkl')
     parser.add_argument(
         '--eval',
         type=str,
@@ -128,7 +256,10 @@ def parse_args():
         choices=['proposal', 'proposal_fast', 'bbox', 'segm', 'keypoints'],
         help='eval types')
     parser.add_argument('--show', action='store_true', help='show results')
-    parser.add_argument('--tmpdir', help='tmp dir for writing some results')
+    parser.add_argument(
+        '--tmpdir',
+        help='dir of the results spooled by every rank, a killed '
+        'distributed test is resumed with the same dir')
     parser.add_argument(
         '--launcher',
         choices=['none', 'pytorch', 'slurm', 'mpi'],
@@ -146,6 +277,8 @@ def main():
 
     if args.out is not None and not args.out.endswith(('.pkl', '.pickle')):
         raise ValueError('The output file must be a pkl file.')
+    if args.shard_size is not None and args.shard_out is None:
+        raise ValueError('--shard_out is required with --shard_size.')
 
     cfg = mmcv.Config.fromfile(args.config)
     # set cudnn_benchmark
@@ -162,7 +295,7 @@ def main():
         init_dist(args.launcher, **cfg.dist_params)
 
     # build the dataloader
-    # TODO: support multiple images per gpu (only minor changes are needed)
+    assert args.imgs_per_gpu == 1 or not args.show
     dataset_type = 'OIDSegDataset'
     data_root = 'gs://oid2019/data/'
     img_norm_cfg = dict(
@@ -179,17 +312,28 @@ def main():
             img_norm_cfg=img_norm_cfg,
             size_divisor=32,
             flip_ratio=int(args.flip),
+            device_test_aug=args.prefetch,
+            img_uint8=args.img_uint8,
             with_mask=True,
             with_label=False,
             test_mode=True)
         )
         
-    data_loader = build_dataloader(
-        dataset,
-        imgs_per_gpu=1,
-        workers_per_gpu=cfg.data.workers_per_gpu,
-        dist=distributed,
-        shuffle=False)
+    # the images of --prefetch are prepared by the main process for its gpu
+    assert not args.prefetch or not (distributed or args.devices), \
+        '--prefetch only works with the single gpu test'
+
+    def build_loader(dataset):
+        data_loader = build_dataloader(
+            dataset,
+            imgs_per_gpu=args.imgs_per_gpu,
+            workers_per_gpu=cfg.data.workers_per_gpu,
+            dist=distributed,
+            shuffle=False,
+            pin_memory=args.prefetch)
+        if args.prefetch:
+            data_loader = DevicePrefetcher(data_loader, img_norm_cfg)
+        return data_loader
 
     # build the model and load checkpoint
     test_cfg = mmcv.ConfigDict(dict(
@@ -208,36 +352,88 @@ def main():
         mask_thr_binary=0.5),
     keep_all_stages=False))    
     
-    # build the model and load checkpoint
-    models = []
-    for config_path, checkpoint_path in zip(args.cfg_list, args.checkpoint):
-        print(f"config: {config_path}\\n checkpoint: {checkpoint_path}")
-        tmp_cfg = mmcv.Config.fromfile(config_path)
-        tmp_cfg.model.pretrained = None
-        tmp_cfg.data.test.test_mode = True
-        model = build_detector(tmp_cfg.model, train_cfg=None, test_cfg=test_cfg)
-        checkpoint = load_checkpoint(model, checkpoint_path, map_location='cpu')
-        # old versions did not save class info in checkpoints, this walkaround is
-        # for backward compatibility
-        if 'CLASSES' in checkpoint['meta']:
-            model.CLASSES = checkpoint['meta']['CLASSES']
-        else:
-            model.CLASSES = dataset.CLASSES
-        models.append(model)
-    model = EnsembleModel(models)
+    feat_cache = dict(policy=args.feat_cache)
+    if args.feat_cache_mb is not None:
+        feat_cache['max_bytes'] = int(args.feat_cache_mb * 1024**2)
+    fusion = None
+    if args.fusion is not None:
+        fusion = dict(
+            method=args.fusion,
+            iou_thr=args.fusion_iou_thr,
+            skip_thr=args.fusion_skip_thr,
+            model_weights=args.model_weights)
+
+    if args.devices is not None:
+        # one worker process per model, the models are built in the workers
+        assert not distributed and not args.show
+        scheduler = EnsembleScheduler(
+            [dict(config=config_path, checkpoint=checkpoint_path)
+             for config_path, checkpoint_path in zip(args.cfg_list,
+                                                     args.checkpoint)],
+            args.devices,
+            test_cfg=test_cfg,
+            fusion=fusion,
+            feat_cache=feat_cache,
+            queue_size=args.queue_size,
+            num_threads=args.worker_threads)
 
-    if not distributed:
-        model = MMDataParallel(model, device_ids=[0])
-        outputs = single_gpu_test(model, data_loader, args.show)
+        def test(dataset, tmpdir=None):
+            return scheduler_test(scheduler, build_loader(dataset))
     else:
-        model = MMDistributedDataParallel(model.cuda())
-        outputs = multi_gpu_test(model, data_loader, args.tmpdir)
+        # build the model and load checkpoint
+        models = []
+        for config_path, checkpoint_path in zip(args.cfg_list,
+                                                args.checkpoint):
+            print(f"config: {config_path}\\n checkpoint: {checkpoint_path}")
+            tmp_cfg = mmcv.Config.fromfile(config_path)
+            tmp_cfg.model.pretrained = None
+            tmp_cfg.data.test.test_mode = True
+            model = build_detector(
+                tmp_cfg.model, train_cfg=None, test_cfg=test_cfg)
+            checkpoint = load_checkpoint(
+                model, checkpoint_path, map_location='cpu')
+            # old versions did not save class info in checkpoints, this
+            # walkaround is for backward compatibility
+            if 'CLASSES' in checkpoint['meta']:
+                model.CLASSES = checkpoint['meta']['CLASSES']
+            else:
+                model.CLASSES = dataset.CLASSES
+            models.append(model)
+        model = EnsembleModel(models, feat_cache=feat_cache, fusion=fusion)
+
+        if not distributed:
+            model = MMDataParallel(model, device_ids=[0])
+        else:
+            model = MMDistributedDataParallel(model.cuda())
+
+        def test(dataset, tmpdir=None):
+            if not distributed:
+                return single_gpu_test(model, build_loader(dataset),
+                                       args.show)
+            return multi_gpu_test(model, build_loader(dataset), tmpdir)
+
+    if args.shard_size is not None:
+        # the models are loaded once for all the shards
+        sharded_test(test, dataset, args.shard_size, args.shard_out,
+                     args.ann_file, args.tmpdir)
+        if args.devices is not None:
+            scheduler.close()
+        return
+    outputs = test(dataset, args.tmpdir)
+    if args.devices is not None:
+        scheduler.close()
 
     rank, _ = get_dist_info()
     if args.out and rank == 0:
-        print('writing results to {}'.format(args.out))
-        mmcv.dump(outputs, args.out)
         eval_types = args.eval
+        if eval_types and eval_types != ['proposal_fast']:
+            # the evaluation needs all the results, else they are streamed
+            outputs = list(outputs)
+        print('writing results to {}'.format(args.out))
+        dump_results(outputs, args.out)
+        if distributed and args.tmpdir is not None:
+            # the results are written, the spool is not needed to resume
+            shutil.rmtree(args.tmpdir)
         if eval_types:
             print('Starting evaluate {}'.format(' and '.join(eval_types)))
             if eval_types == ['proposal_fast']:
@@ -255,6 +451,9 @@ def main():
                         result_file = args.out + '.{}.json'.format(name)
                         results2json(dataset, outputs_, result_file)
                         coco_eval(result_file, eval_types, dataset.coco)
+    elif distributed and rank == 0:
+        # not written, the temporary spool is not needed
+        outputs.close()
 
 
 if __name__ == '__main__':
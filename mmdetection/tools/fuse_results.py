@@ -0,0 +1,73 @@
+"""Fuse the test results of several models, run apart (late fusion).
+
+Every model is tested on its own (e.g. ``tools/test.py --out``, on any
+device or node, possibly with its own augmentations) and the result files,
+in the same image order, are fused image by image with weighted box fusion
+or soft merging. The results must be in the unflipped image, as those of
+the test tools (``aug_test`` merges the flipped augmentations back); the
+raw ``simple_test`` result of a flipped input is mapped back by
+:func:`flip_result` first:
+
+    python tools/fuse_results.py --results a.pkl b.pkl --weights 2 1 \\
+        --method wbf --out fused.pkl
+"""
+import argparse
+from functools import partial
+from multiprocessing import Pool
+
+import mmcv
+
+from mmdet.core import fuse_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Fuse the test results of several models')
+    parser.add_argument(
+        '--results', type=str, nargs='+', required=True,
+        help='result files of the models')
+    parser.add_argument(
+        '--weights', type=float, nargs='+', help='weight of each model')
+    parser.add_argument(
+        '--method', choices=['wbf', 'soft_merge'], default='wbf')
+    parser.add_argument('--iou_thr', type=float, default=0.55)
+    parser.add_argument('--skip_thr', type=float, default=0.)
+    parser.add_argument('--mask_thr', type=float, default=0.5)
+    parser.add_argument('--max_per_img', type=int, default=100)
+    parser.add_argument('--num_processes', type=int, default=1)
+    parser.add_argument('--out', required=True, help='fused result file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.weights is not None:
+        assert len(args.weights) == len(args.results)
+    model_results = [mmcv.load(path) for path in args.results]
+    num_imgs = len(model_results[0])
+    assert all(len(results) == num_imgs for results in model_results)
+
+    fuse = partial(
+        fuse_results,
+        run_weights=args.weights,
+        method=args.method,
+        iou_thr=args.iou_thr,
+        skip_thr=args.skip_thr,
+        mask_thr=args.mask_thr,
+        max_per_img=args.max_per_img)
+    img_results = zip(*model_results)
+    if args.num_processes > 1:
+        with Pool(args.num_processes) as pool:
+            outputs = pool.map(fuse, img_results, chunksize=16)
+    else:
+        outputs = []
+        prog_bar = mmcv.ProgressBar(num_imgs)
+        for results in img_results:
+            outputs.append(fuse(results))
+            prog_bar.update()
+    print('\nwriting results to {}'.format(args.out))
+    mmcv.dump(outputs, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,17 @@
 import argparse
 import os
-import os.path as osp
 import shutil
-import tempfile
 
 import pandas as pd
 from tqdm import tqdm
 
 import mmcv
 import torch
-import torch.distributed as dist
 from mmcv.runner import load_checkpoint, get_dist_info
 from mmcv.parallel import MMDataParallel, MMDistributedDataParallel
 
-from mmdet.apis import init_dist
+from mmdet.apis import (init_dist, ResultSpool, collect_spooled_results,
+                        dump_results, get_spool_dir, pending_loader)
 from mmdet.core import results2json, coco_eval
 from mmdet.datasets import build_dataloader, get_dataset
 from mmdet.models import build_detector
@@ -93,68 +91,31 @@ def single_gpu_test(model, data_loader, show=False):
 
 
 def multi_gpu_test(model, data_loader, tmpdir=None):
+    """Test on every rank, spooling the results to ``tmpdir`` (see
+    :class:`ResultSpool`), where a killed test is resumed. The spool
+    of a temporary directory is removed once the results are read."""
     model.eval()
-    results = []
-    dataset = data_loader.dataset
     rank, world_size = get_dist_info()
+    spool = ResultSpool(
+        get_spool_dir(tmpdir), len(data_loader.dataset), rank=rank)
+    # only the images not in the spool yet are tested
+    data_loader, indices = pending_loader(data_loader, spool)
     if rank == 0:
-        prog_bar = mmcv.ProgressBar(len(dataset))
+        prog_bar = mmcv.ProgressBar(len(indices) * world_size)
+    indices = iter(indices)
     for i, data in enumerate(data_loader):
         with torch.no_grad():
             result = model(return_loss=False, rescale=True, **data)
-        results.append(result)
+        spool.add(next(indices), result)
 
         if rank == 0:
             batch_size = data['img'][0].size(0)
             for _ in range(batch_size * world_size):
                 prog_bar.update()
 
-    # collect results from all ranks
-    results = collect_results(results, len(dataset), tmpdir)
-
-    return results
-
-
-def collect_results(result_part, size, tmpdir=None):
-    rank, world_size = get_dist_info()
-    # create a tmp dir if it is not specified
-    if tmpdir is None:
-        MAX_LEN = 512
-        # 32 is whitespace
-        dir_tensor = torch.full((MAX_LEN, ),
-                                32,
-                                dtype=torch.uint8,
-                                device='cuda')
-        if rank == 0:
-            tmpdir = tempfile.mkdtemp()
-            tmpdir = torch.tensor(
-                bytearray(tmpdir.encode()), dtype=torch.uint8, device='cuda')
-            dir_tensor[:len(tmpdir)] = tmpdir
-        dist.broadcast(dir_tensor, 0)
-        tmpdir = dir_tensor.cpu().numpy().tobytes().decode().rstrip()
-    else:
-        mmcv.mkdir_or_exist(tmpdir)
-    # dump the part result to the dir
-    mmcv.dump(result_part, osp.join(tmpdir, 'part_{}.pkl'.format(rank)))
-    dist.barrier()
-    # collect all parts
-    if rank != 0:
-        return None
-    else:
-        # load results of all parts from tmp dir
-        part_list = []
-        for i in range(world_size):
-            part_file = osp.join(tmpdir, 'part_{}.pkl'.format(i))
-            part_list.append(mmcv.load(part_file))
-        # sort the results
-        ordered_results = []
-        for res in zip(*part_list):
-            ordered_results.extend(list(res))
-        # the dataloader may pad some samples
-        ordered_results = ordered_results[:size]
-        # remove tmp dir
-        shutil.rmtree(tmpdir)
-        return ordered_results
+    # merged from the chunks of all ranks while they are read, the spool
+    # of a temporary directory is removed then
+    return collect_spooled_results(spool, remove=tmpdir is None)
 
 
 def parse_args():
@@ -169,7 +130,10 @@ def parse_args():
         choices=['proposal', 'proposal_fast', 'bbox', 'segm', 'keypoints'],
         help='eval types')
     parser.add_argument('--show', action='store_true', help='show results')
-    parser.add_argument('--tmpdir', help='tmp dir for writing some results')
+    parser.add_argument(
+        '--tmpdir',
+        help='dir of the results spooled by every rank, a killed '
+        'distributed test is resumed with the same dir')
     parser.add_argument(
         '--launcher',
         choices=['none', 'pytorch', 'slurm', 'mpi'],
@@ -233,24 +197,33 @@ def main():
 
     rank, _ = get_dist_info()
     if args.out and rank == 0:
-        print('\nwriting results to {}'.format(args.out))
-        mmcv.dump(outputs, args.out)
-
         dataset.CLASSES = CLASSES
 
         data_list = []
-        for i in tqdm(range(len(dataset))): 
-            img_id = dataset.img_infos[i]['filename'].split('.')[0]
-            w = dataset.img_infos[i]['width']
-            h = dataset.img_infos[i]['height']
-            for l in range(len(dataset.CLASSES)):
-                l_name = dataset.CLASSES[l] 
-                for b in outputs[i][l]: 
-                    if len(b)>0: 
-                        data_list.append((img_id, l_name, b[-1], b[0]/w, b[1]/h, b[2]/w, b[3]/h))
+
+        def add_rows(outputs):
+            # the csv rows of each result, while the results are written
+            for i, result in enumerate(tqdm(outputs, total=len(dataset))):
+                img_id = dataset.img_infos[i]['filename'].split('.')[0]
+                w = dataset.img_infos[i]['width']
+                h = dataset.img_infos[i]['height']
+                for l in range(len(dataset.CLASSES)):
+                    l_name = dataset.CLASSES[l]
+                    for b in result[l]:
+                        if len(b)>0:
+                            data_list.append((img_id, l_name, b[-1], b[0]/w, b[1]/h, b[2]/w, b[3]/h))
+                yield result
+
+        print('\nwriting results to {}'.format(args.out))
+        dump_results(add_rows(outputs), args.out)
+        if distributed and args.tmpdir is not None:
+            # the results are written, the spool is not needed to resume
+            shutil.rmtree(args.tmpdir)
         data_df = pd.DataFrame(data_list, columns =['ImageID', 'LabelName', 'Score', 'XMin', 'YMin', 'XMax', 'YMax'])
         data_df.to_csv(args.out.split('.pkl')[0]+'.csv', index=False)
-
+    elif distributed and rank == 0:
+        # not written, the temporary spool is not needed
+        outputs.close()
 
 
 if __name__ == '__main__':
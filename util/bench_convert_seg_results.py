@@ -0,0 +1,96 @@
+"""Benchmark the conversion of a results shard to PredictionStrings.
+
+Compares the former path of convert_seg_results_to_sub_25.py (decode every
+mask, then re-encode it with the Kaggle ``encode_binary_mask``) to the
+skip-the-decode path of ``seg_results``, and checks that both give the same
+strings, e.g.
+
+    python bench_convert_seg_results.py --pkl_path LB_res_0of25.pkl
+"""
+import argparse
+import time
+from multiprocessing import Pool
+
+import funcy
+import mmcv
+import pycocotools.mask as maskUtils
+
+from seg_results import encode_binary_mask, flatten_results, prediction_string
+
+
+def decode_prediction_string(result, classes, score_fmt):
+    bb_result, segm_result = result
+    bbs = mmcv.concat_list(bb_result)
+    if len(segm_result) == 2:  # mask scoring rcnn
+        segms = mmcv.concat_list(segm_result[0])
+        probs = mmcv.concat_list(segm_result[1])
+    else:
+        segms = mmcv.concat_list(segm_result)
+        probs = [bb[4] for bb in bbs]
+    labels = [
+        classes[k] for k, bbox in enumerate(bb_result)
+        for _ in range(bbox.shape[0])
+    ]
+    row = ''
+    for proba, seg, label in zip(probs, segms, labels):
+        mask = maskUtils.decode(seg).astype(bool)
+        rle = encode_binary_mask(mask).decode('utf-8')
+        row += (label + ' ' + score_fmt.format(proba) + ' ' + rle + ' ')
+    return row.strip(' ')
+
+
+_shared = {}
+
+
+def process_chunk(inds):
+    return [
+        prediction_string(_shared['columns'], j, _shared['classes'],
+                          _shared['score_fmt']) for j in inds
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pkl_path', help='a 4000-image results shard')
+    parser.add_argument('--num_imgs', type=int, default=4000)
+    parser.add_argument('--num_processes', type=int, default=12)
+    parser.add_argument('--eight_digit', action='store_true')
+    args = parser.parse_args()
+
+    results = mmcv.load(args.pkl_path)[:args.num_imgs]
+    classes = ['class_{}'.format(k) for k in range(len(results[0][0]))]
+    score_fmt = '{:.8f}' if args.eight_digit else '{:.6f}'
+    num_dets = sum(bbox.shape[0] for res in results for bbox in res[0])
+    print('{} images, {} detections'.format(len(results), num_dets))
+
+    tic = time.time()
+    decoded = [
+        decode_prediction_string(res, classes, score_fmt) for res in results
+    ]
+    print('decode + encode_binary_mask: {:.1f}s'.format(time.time() - tic))
+
+    tic = time.time()
+    columns = flatten_results(results)
+    flat = time.time() - tic
+    direct = [
+        prediction_string(columns, j, classes, score_fmt)
+        for j in range(len(results))
+    ]
+    print('flatten_results: {:.1f}s, skip the decode: {:.1f}s'.format(
+        flat, time.time() - tic))
+    assert direct == decoded, 'the two paths give different strings'
+
+    # forked workers read the flattened columns of the parent
+    _shared.update(
+        columns=columns, classes=classes, score_fmt=score_fmt)
+    tic = time.time()
+    chunks = funcy.lchunks(max(len(results) // 100, 1), range(len(results)))
+    with Pool(args.num_processes) as p:
+        pooled = mmcv.concat_list(p.map(process_chunk, chunks))
+    print('skip the decode, {} processes: {:.1f}s'.format(
+        args.num_processes, time.time() - tic))
+    assert pooled == direct
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""OID class hierarchy as integer-indexed CSR tables.
+
+The classes are indexed once, and the ancestors and the descendants of
+class ``i`` are ``members[offsets[i]:offsets[i + 1]]`` of two CSR tables,
+so that the labels of millions of detections or annotations are expanded to
+their ancestors (or descendants) by a few numpy operations instead of a dict
+lookup per label::
+
+    hierarchy = ClassHierarchy.load('seg_all_keyed_child.pkl')
+    item_inds, labels = hierarchy.expand_labels(det_labels)
+    scores, bboxes = det_scores[item_inds], det_bboxes[item_inds]
+
+The hierarchy is read from the challenge hierarchy json or from a pickled
+dict from each label to its ancestor labels (``seg_all_keyed_child.pkl``),
+and cached next to it as ``<path>.npz`` (rebuilt when the source changes).
+"""
+import json
+import os
+import os.path as osp
+import pickle
+
+import numpy as np
+
+# version of the binary form, part of the cached source stamp
+CACHE_VERSION = 'class_hierarchy.1'
+
+
+def lookup(keys, values):
+    """Index of each value in the sorted array ``keys``, -1 if missing."""
+    inds = np.searchsorted(keys, values)
+    inds[inds == len(keys)] = 0
+    found = keys[inds] == values if len(keys) else np.zeros(len(values),
+                                                            dtype=bool)
+    return np.where(found, inds, -1)
+
+
+def _csr(rows):
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    members = np.array([i for row in rows for i in row], dtype=np.int64)
+    return offsets, members
+
+
+def _transpose(offsets, members, num_classes):
+    """CSR table of the inverse relation, each row sorted."""
+    rows = np.repeat(np.arange(num_classes), np.diff(offsets))
+    order = np.lexsort((rows, members))
+    counts = np.bincount(members, minlength=num_classes)
+    inv_offsets = np.zeros(num_classes + 1, dtype=np.int64)
+    np.cumsum(counts, out=inv_offsets[1:])
+    return inv_offsets, rows[order]
+
+
+class ClassHierarchy(object):
+    """Ancestors and descendants of indexed classes.
+
+    Args:
+        classes (Sequence[str]): label names, in index order.
+        ancestors (tuple): (offsets, members) CSR table of the ancestor
+            indices of each class, the class excluded.
+        descendants (tuple, optional): CSR table of the descendants, the
+            inverse of ``ancestors`` by default.
+    """
+
+    def __init__(self, classes, ancestors, descendants=None):
+        self.classes = [str(label) for label in classes]
+        self.ancestor_table = tuple(np.asarray(a) for a in ancestors)
+        if descendants is None:
+            descendants = _transpose(*self.ancestor_table, len(classes))
+        self.descendant_table = tuple(np.asarray(a) for a in descendants)
+        self._names = np.array(self.classes, dtype=str)
+        self._order = np.argsort(self._names, kind='stable')
+        self._sorted_names = self._names[self._order]
+
+    @property
+    def num_classes(self):
+        return len(self.classes)
+
+    @classmethod
+    def from_json(cls, path):
+        """Classes of a hierarchy json, sorted by label.
+
+        The root of the file is not a class. A class may appear under
+        several parents, its ancestors are those of all of them.
+        """
+        with open(path) as f:
+            root = json.load(f)
+        ancestors = {}
+
+        def visit(node, parents):
+            label = node['LabelName']
+            ancestors.setdefault(label, set()).update(parents)
+            for child in node.get('Subcategory', []):
+                visit(child, parents + [label])
+
+        for child in root.get('Subcategory', []):
+            visit(child, [])
+        classes = sorted(ancestors)
+        class_inds = {label: i for i, label in enumerate(classes)}
+        return cls(classes,
+                   _csr([
+                       sorted(class_inds[a] for a in ancestors[label])
+                       for label in classes
+                   ]))
+
+    @classmethod
+    def from_parents(cls, parents):
+        """Classes of a dict from each label to its ancestor labels, sorted
+        by label, the ancestors of a class kept in their order."""
+        classes = sorted(
+            set(parents) | {a
+                            for labels in parents.values()
+                            for a in labels})
+        class_inds = {label: i for i, label in enumerate(classes)}
+        return cls(classes,
+                   _csr([[class_inds[a] for a in parents.get(label, ())]
+                         for label in classes]))
+
+    def save(self, path, source=''):
+        """Write the binary form (npz), atomically."""
+        tmp_path = '{}.tmp{}.npz'.format(path, os.getpid())
+        np.savez(
+            tmp_path,
+            classes=self._names,
+            ancestor_offsets=self.ancestor_table[0],
+            ancestor_members=self.ancestor_table[1],
+            descendant_offsets=self.descendant_table[0],
+            descendant_members=self.descendant_table[1],
+            source=np.array(source))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, cache=True):
+        """Load a hierarchy json, a pickled dict of ancestors or a saved
+        npz.
+
+        Args:
+            path (str): .json, .pkl or .npz file.
+            cache (bool): use (or write) the binary form ``<path>.npz``,
+                valid while the size and mtime of ``path`` are unchanged.
+        """
+        if path.endswith('.npz'):
+            return cls._load_npz(path)[0]
+        cache_path = path + '.npz'
+        stat = os.stat(path)
+        source = '{} {} {}'.format(CACHE_VERSION, stat.st_size,
+                                   stat.st_mtime_ns)
+        if cache and osp.isfile(cache_path):
+            hierarchy, cached_source = cls._load_npz(cache_path)
+            if cached_source == source:
+                return hierarchy
+        if path.endswith('.json'):
+            hierarchy = cls.from_json(path)
+        else:
+            with open(path, 'rb') as f:
+                hierarchy = cls.from_parents(pickle.load(f))
+        if cache:
+            try:
+                hierarchy.save(cache_path, source)
+            except OSError:
+                # e.g. a read-only data directory
+                pass
+        return hierarchy
+
+    @classmethod
+    def _load_npz(cls, path):
+        with np.load(path) as data:
+            hierarchy = cls(
+                data['classes'],
+                (data['ancestor_offsets'], data['ancestor_members']),
+                (data['descendant_offsets'], data['descendant_members']))
+            return hierarchy, str(data['source'])
+
+    def _table(self, relation):
+        assert relation in ('ancestors', 'descendants')
+        return (self.ancestor_table
+                if relation == 'ancestors' else self.descendant_table)
+
+    def index(self, labels):
+        """Index of each label (str or bytes), -1 for unknown labels."""
+        labels = np.asarray(labels)
+        if labels.dtype.kind == 'S':
+            labels = np.char.decode(labels)
+        inds = lookup(self._sorted_names, labels.astype(str))
+        return np.where(inds >= 0, self._order[np.maximum(inds, 0)], -1)
+
+    def relatives(self, class_ind, relation='ancestors'):
+        """Indices of the ancestors (or descendants) of a class."""
+        offsets, members = self._table(relation)
+        return members[offsets[class_ind]:offsets[class_ind + 1]]
+
+    def relative_labels(self, labels, relation='ancestors'):
+        """Label names of the ancestors (or descendants) of each label, an
+        empty list for unknown labels."""
+        return [[self.classes[j] for j in self.relatives(i, relation)]
+                if i >= 0 else [] for i in self.index(labels)]
+
+    def subset(self, classes):
+        """The hierarchy restricted to some classes, indexed in the given
+        order, the relatives of each class sorted by their new index."""
+        inds = self.index(classes)
+        assert (inds >= 0).all(), 'unknown classes'
+        new_inds = np.full(self.num_classes, -1, dtype=np.int64)
+        new_inds[inds] = np.arange(len(inds))
+        rows = []
+        for i in inds:
+            related = new_inds[self.relatives(i)]
+            rows.append(np.sort(related[related >= 0]))
+        return ClassHierarchy(classes, _csr(rows))
+
+    def expand(self, class_inds, relation='ancestors', with_self=True):
+        """Expand class indices to their ancestors (or descendants).
+
+        The outputs of an item are consecutive, the item itself first, then
+        its relatives in table order.
+
+        Returns:
+            tuple: (index of the expanded item of each output, output
+                class indices). ``item_inds`` gathers the other arrays of
+                the items, e.g. their scores.
+        """
+        offsets, members = self._table(relation)
+        class_inds = np.asarray(class_inds, dtype=np.int64)
+        known = class_inds >= 0
+        starts = np.where(known, offsets[np.maximum(class_inds, 0)], 0)
+        nums = np.where(known, offsets[class_inds + 1] - starts, 0)
+        if with_self:
+            # the item itself is a relative of rank -1
+            starts = starts - 1
+            nums = nums + 1
+        item_inds = np.repeat(np.arange(len(class_inds)), nums)
+        # position of each output among those of its item
+        ranks = np.arange(len(item_inds)) - np.repeat(
+            np.cumsum(nums) - nums, nums)
+        outputs = members[np.maximum(starts[item_inds] + ranks, 0)] if len(
+            members) else np.zeros(len(item_inds), dtype=np.int64)
+        if with_self:
+            outputs = np.where(ranks == 0, class_inds[item_inds], outputs)
+        return item_inds, outputs
+
+    def expand_labels(self, labels, relation='ancestors', with_self=True):
+        """Expand label names (str or bytes) like :meth:`expand`, unknown
+        labels are kept (with ``with_self``) without relatives.
+
+        Returns:
+            tuple: (index of the expanded item of each output, output labels
+                of the dtype of ``labels``).
+        """
+        labels = np.asarray(labels)
+        inds = self.index(labels)
+        item_inds, class_inds = self.expand(inds, relation, with_self)
+        names = self._names
+        if labels.dtype.kind == 'S':
+            names = np.char.encode(names)
+        elif labels.dtype.kind == 'O':
+            names = names.astype(object)
+        # the item itself, its known label or not, then its relatives
+        first = np.ones(len(item_inds), dtype=bool)
+        first[1:] = item_inds[1:] != item_inds[:-1]
+        if not with_self:
+            first[:] = False
+        outputs = labels[item_inds].astype(
+            np.result_type(labels.dtype, names.dtype)
+            if labels.dtype.kind != 'O' else object)
+        outputs[~first] = names[class_inds[~first]]
+        return item_inds, outputs
@@ -2,43 +2,48 @@ import pandas as pd
 from glob import glob
 import os
 from tqdm import tqdm
+import argparse
 
 pd.set_option('display.max_columns', 25)
 
 if __name__ == '__main__':
-    
 
-    csv_pattern1 = 'LB_csv/LB_avg3_2scale_flip_NMS_G8k_2scale_flip_thr0_0.5_*of25.csv'
-    csv_pattern2 = 'LB_csv/LB_avg3_2scale_flip_thr0_120_*of25.csv'
-    
-    
-    csv_lst1 = sorted(glob(csv_pattern1))
-    csv_lst2 = sorted(glob(csv_pattern2))    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--leaf_store')
+    parser.add_argument('--parent_store')
+    parser.add_argument('--out_csv')
+    args = parser.parse_args()
+
+    if args.leaf_store:
+        # the only place where the detection stores are turned into a csv
+        from det_store import DetStore, write_submission
+        write_submission([DetStore(args.leaf_store), DetStore(args.parent_store)], args.out_csv)
+    else:    
+
+        csv_pattern1 = 'LB_csv/LB_avg3_2scale_flip_NMS_G8k_2scale_flip_thr0_0.5_*of25.csv'
+        csv_pattern2 = 'LB_csv/LB_avg3_2scale_flip_thr0_120_*of25.csv'
     
-    assert len(csv_lst1)==25 and len(csv_lst2)==25
-        
-    for i in tqdm(range(25)):
-        sub1 = pd.read_csv(csv_lst1[i])
-        sub2 = pd.read_csv(csv_lst2[i])
-        assert sub1.ImageID.equals(sub2.ImageID)
-        assert sub2.PredictionString.count()==sub2.shape[0]         
-        sub2['tmp'] = sub1.PredictionString.fillna('')
-        sub2.PredictionString = sub2.apply(lambda x: 
-            (x.PredictionString+' '+x.tmp).strip(' '),axis=1 )
-
-        if i==0:
-            sub = sub2.copy()
-        else:
-            sub = pd.concat([sub,sub2.copy()])
-            
-    print('-----sub.count()-----\n',sub.count())
     
-    sub_name = os.path.basename(csv_lst1[0].replace('_0of25','')).replace('.csv','').replace('LB_','') +\
-                '_AND_' +\
-                os.path.basename(csv_lst2[0].replace('_0of25','')).replace('.csv','').replace('LB_','')
+        csv_lst1 = sorted(glob(csv_pattern1))
+        csv_lst2 = sorted(glob(csv_pattern2))    
     
-    sub.drop(columns='tmp').to_csv(\
-             'subs/' + \
-             sub_name + '.csv',chunksize=10000,index=False)
+        assert len(csv_lst1)==25 and len(csv_lst2)==25
+
+        from submission import image_ids, merge_submissions, read_submission, write_submission
+
+        # the shards of both sets hold the same images, and every image of the
+        # leaf set (csv_lst2) has detections
+        for i in tqdm(range(25)):
+            assert list(image_ids(csv_lst1[i])) == list(image_ids(csv_lst2[i])), csv_lst1[i]
+            assert all(row[3] for row in read_submission(csv_lst2[i])), csv_lst2[i]
+
+        # streaming k-way merge over the 50 csvs, the leaf detections (csv_lst2)
+        # of an image come first, in the order of the images of csv_lst2
+        rows = merge_submissions(csv_lst2 + csv_lst1, image_ids(csv_lst2))
+
+        sub_name = os.path.basename(csv_lst1[0].replace('_0of25','')).replace('.csv','').replace('LB_','') +\
+                    '_AND_' +\
+                    os.path.basename(csv_lst2[0].replace('_0of25','')).replace('.csv','').replace('LB_','')
     
-    
\ No newline at end of file
+        num_rows = write_submission('subs/' + sub_name + '.csv', rows)
+        print(f'{num_rows} rows written')
@@ -0,0 +1,184 @@
+"""Compile the annotation sets of the datasets (see
+mmdet/datasets/ann_columns.py) from the challenge csvs.
+
+The segmentation csv is sorted once by ImageID, and the annotations of each
+image are a contiguous range of rows found by ``searchsorted``, so that the
+set is built by a few array operations instead of a DataFrame lookup per
+image. It is written as flat columns with per-image offsets:
+
+    python compile_ann.py leaf --out seg_train_275_leave_cls_ann.npz
+    python compile_ann.py parent --out seg_train_parent_23_ann.npz
+    python compile_ann.py test --out test_ann.npz --num_shards 25
+    python compile_ann.py convert --ann_files seg_val_2844_ann.pkl
+
+``convert`` turns pickled annotation files (e.g. the rebalanced ones) into
+columnar ones, next to them.
+"""
+import argparse
+import os.path as osp
+
+import mmcv
+import numpy as np
+import pandas as pd
+
+from class_hierarchy import ClassHierarchy, lookup
+from mmdet.datasets.ann_columns import (dump_ann_columns,
+                                        img_infos_to_columns,
+                                        load_img_infos)
+
+# 23 level 1 parents, in the order of OIDSegParentDataset.CLASSES
+PARENT_CLASSES = ('/m/0138tl', '/m/02crq1', '/m/01x3z', '/m/06msq',
+                  '/m/01mqdt', '/m/01g317', '/m/0dv77', '/m/0l515',
+                  '/m/0c9ph5', '/m/0k4j', '/m/0k5j', '/m/02dl1y',
+                  '/m/02wv6h6', '/m/0174n1', '/m/07mhn', '/m/0hf58v5',
+                  '/m/015p6', '/m/01dws', '/m/09dzg', '/m/0ch_cf',
+                  '/m/018xm', '/m/0dv9c', '/m/0271t')
+
+BOX_COLUMNS = ['BoxXMin', 'BoxYMin', 'BoxXMax', 'BoxYMax']
+CSV_COLUMNS = ['ImageID', 'LabelName', 'MaskPath'] + BOX_COLUMNS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compile annotation sets')
+    parser.add_argument('kind', choices=['leaf', 'parent', 'test', 'convert'])
+    parser.add_argument('--data_dir', default='open-images/data/')
+    parser.add_argument('--out', help='output .npz file')
+    parser.add_argument(
+        '--num_shards',
+        type=int,
+        default=0,
+        help='test: also split the set into shards of 4000 images')
+    parser.add_argument('--ann_files', nargs='+', help='convert: pkl files')
+    return parser.parse_args()
+
+
+def _index(keys, values):
+    """Index of each value in ``keys`` (not sorted), -1 if missing."""
+    order = np.argsort(keys, kind='stable')
+    inds = lookup(keys[order], values)
+    return np.where(inds >= 0, order[np.maximum(inds, 0)], -1)
+
+
+def image_sizes(ann_file):
+    """(filename, width, height) arrays of the images of an annotation file.
+    """
+    img_infos = load_img_infos(ann_file)
+    return tuple(
+        np.array([info[k] for info in img_infos])
+        for k in ('filename', 'width', 'height'))
+
+
+def compile_annotations(gt, classes, sizes, hierarchy=None):
+    """Columns of the annotation set of segmentation csv rows.
+
+    Args:
+        gt (DataFrame): rows of the segmentation csvs, with the
+            ``CSV_COLUMNS``.
+        classes (Sequence[str]): label names, the label of ``classes[i]`` is
+            ``i + 1``. The rows of other classes are dropped.
+        sizes (tuple): (filename, width, height) arrays of the images, the
+            images of unknown size are dropped.
+        hierarchy (ClassHierarchy, optional): the rows are repeated for each
+            ancestor of their class before they are selected.
+
+    Returns:
+        dict: the columns, images sorted by ImageID and their annotations in
+            the order of the csv.
+    """
+    image_ids = gt.ImageID.to_numpy(dtype=str)
+    rows = np.arange(len(gt))
+    if hierarchy is not None:
+        rows, label_names = hierarchy.expand_labels(
+            gt.LabelName.to_numpy(dtype=str))
+        image_ids = image_ids[rows]
+    else:
+        label_names = gt.LabelName.to_numpy(dtype=str)
+    labels = _index(np.array(classes, dtype=str), label_names) + 1
+    keep = labels > 0
+    rows, image_ids, labels = rows[keep], image_ids[keep], labels[keep]
+
+    # the rows of an image are contiguous once sorted
+    order = np.argsort(image_ids, kind='stable')
+    rows, image_ids, labels = rows[order], image_ids[order], labels[order]
+    is_first = np.ones(len(image_ids), dtype=bool)
+    is_first[1:] = image_ids[1:] != image_ids[:-1]
+    img_names = image_ids[is_first]
+    offsets = np.append(np.searchsorted(image_ids, img_names), len(rows))
+
+    filenames, widths, heights = sizes
+    size_inds = _index(np.asarray(filenames, dtype=str),
+                       np.char.add(img_names, '.jpg'))
+    has_size = size_inds >= 0
+    if not has_size.all():
+        print('{} images of unknown size dropped'.format(
+            (~has_size).sum()))
+    keep = np.repeat(has_size, np.diff(offsets))
+    rows, labels = rows[keep], labels[keep]
+    img_names, size_inds = img_names[has_size], size_inds[has_size]
+    counts = np.diff(offsets)[has_size]
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    w = np.asarray(widths)[size_inds]
+    h = np.asarray(heights)[size_inds]
+    scale = np.repeat(np.stack([w, h, w, h], axis=1), counts, axis=0)
+    bboxes = gt[BOX_COLUMNS].values[rows] * scale
+    return dict(
+        filename=np.char.add(img_names, '.jpg'),
+        width=w.astype(np.int32),
+        height=h.astype(np.int32),
+        ann_offsets=offsets,
+        bboxes=bboxes.astype(np.float32),
+        labels=labels.astype(np.int64),
+        MaskPath=gt.MaskPath.to_numpy(dtype=str)[rows])
+
+
+def read_csvs(paths):
+    return pd.concat(
+        [pd.read_csv(path, usecols=CSV_COLUMNS) for path in paths],
+        ignore_index=True)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    data_dir = args.data_dir
+    seg_dir = data_dir + 'seg_anno/'
+
+    if args.kind == 'convert':
+        for ann_file in args.ann_files:
+            out = osp.splitext(ann_file)[0] + '.npz'
+            dump_ann_columns(img_infos_to_columns(mmcv.load(ann_file)), out)
+            print(out)
+    elif args.kind == 'test':
+        test_imgs = pd.read_csv(data_dir + 'sample_empty_submission_seg.csv')
+        filenames = np.char.add(test_imgs.ImageID.to_numpy(dtype=str), '.jpg')
+        # the full list, for tools/ensemble_test.py --shard_size
+        dump_ann_columns(dict(filename=filenames), args.out)
+        # and shards for parallel inference
+        for i in range(args.num_shards):
+            dump_ann_columns(
+                dict(filename=filenames[4000 * i:4000 * (i + 1)]),
+                args.out.replace('.npz', '_{}_of_{}.npz'.format(
+                    i, args.num_shards)))
+    else:
+        # sizes of the OD annotations (incl all val width, height)
+        sizes = image_sizes(data_dir + 'mmdet_anno/train_bbox.pkl')
+        if args.kind == 'leaf':
+            classes = mmcv.load(seg_dir + 'list_of_275_leave_labels_seg.pkl')
+            gt = read_csvs(
+                [seg_dir + 'challenge-2019-train-segmentation-masks.csv'])
+            hierarchy = None
+        else:
+            classes = PARENT_CLASSES
+            gt = read_csvs([
+                seg_dir + 'challenge-2019-train-segmentation-masks.csv',
+                seg_dir + 'challenge-2019-validation-segmentation-masks.csv',
+                seg_dir + 'test-annotations-object-segmentation.csv'
+            ])
+            # child -> parents
+            hierarchy = ClassHierarchy.load(
+                data_dir + 'seg_all_keyed_child.pkl')
+        columns = compile_annotations(gt, classes, sizes, hierarchy)
+        print('{} images, {} annotations'.format(
+            len(columns['filename']), len(columns['labels'])))
+        dump_ann_columns(columns, args.out)
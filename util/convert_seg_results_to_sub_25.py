@@ -9,6 +9,7 @@ from tqdm import tqdm
 import gc
 import argparse
 import platform
+from class_hierarchy import ClassHierarchy
 
 pd.set_option('display.max_columns', 25)
 
@@ -19,6 +20,7 @@ if __name__ == '__main__':
     parser.add_argument('--expand')    
     parser.add_argument('--parent')    
     parser.add_argument('--eight_digit', action='store_true')
+    parser.add_argument('--out_store', help='write a detection store instead of csv')
     args = parser.parse_args()
         
     pkl_path = args.pkl_path
@@ -58,48 +60,13 @@ if __name__ == '__main__':
         from seg_275_leave_classes import CLASSES
         print('---- 275 classes -----')
 
-    all_keyed_child = mmcv.load(data_dir+'seg_all_keyed_child.pkl')
+    hierarchy = ClassHierarchy.load(data_dir+'seg_all_keyed_child.pkl')
     
     ################## convert to sub
 
-    ################## from Kaggle
-
-    import base64
-    from pycocotools import _mask as coco_mask
-    import typing as t
-    import zlib
-
-    def encode_binary_mask(mask: np.ndarray) -> t.Text:
-     """Converts a binary mask into OID challenge encoding ascii text."""
-     # check input mask --
-     if mask.dtype != np.bool:
-       raise ValueError(
-           "encode_binary_mask expects a binary mask, received dtype == %s" %
-           mask.dtype)
-
-     mask = np.squeeze(mask)
-     if len(mask.shape) != 2:
-       raise ValueError(
-           "encode_binary_mask expects a 2d mask, received shape == %s" %
-           mask.shape)
-
-     # convert input mask to expected COCO API input --
-     mask_to_encode = mask.reshape(mask.shape[0], mask.shape[1], 1)
-     mask_to_encode = mask_to_encode.astype(np.uint8)
-     mask_to_encode = np.asfortranarray(mask_to_encode)
-
-     # RLE encode mask --
-     encoded_mask = coco_mask.encode(mask_to_encode)[0]["counts"]
-
-     # compress and base64 encoding --
-     binary_str = zlib.compress(encoded_mask, zlib.Z_BEST_COMPRESSION)
-     base64_str = base64.b64encode(binary_str)
-     return base64_str
-
     ######## seg_results_pkl_to_sub
     from multiprocessing import Pool
     import funcy
-    import pycocotools.mask as maskUtils
             
     print(f'pkl_path = {pkl_path}')        
     results = mmcv.load(pkl_path)
@@ -115,98 +82,81 @@ if __name__ == '__main__':
                 set_index('ImageID').iloc[(4000*i):(4000*(i+1))]
     img_lst = sub.index.values        
 
-    # multi process 6 core, 8 min, 50k
-
-    i_lst = list(range(len(img_lst)))
-    def process_img(i_sublst):    
-        df = pd.DataFrame(columns=['ImageID','ImageWidth', 'ImageHeight', 'PredictionString']).set_index('ImageID')
-        for i in i_sublst:
-            cnt = 0
-    #        for i in tqdm(range(len(results))):
-            bb_result, segm_result = results[i]
-            bbs = mmcv.concat_list(bb_result)
-            scoring_flag = False
-            if len(segm_result)==2: ## mask scoring rcnn
-                scoring_flag = True
-                
-            if scoring_flag:
-                segms = mmcv.concat_list(segm_result[0])
-                probs = mmcv.concat_list(segm_result[1])
-            else:
-                segms = mmcv.concat_list(segm_result)   
-            labels = [
-                np.full(bbox.shape[0], i, dtype=np.int32)
-                for i, bbox in enumerate(bb_result)
-            ]
-            labels = [CLASSES[i] for i in np.concatenate(labels)]
-        
-            assert len(segms)==len(labels) and len(segms)==len(bbs)  
-            if scoring_flag: assert len(segms)==len(probs)
-            cnt += len(segms)
-            if len(segms)==0:
-                df.loc[sub.index.values[i]] = -1,-1,np.nan
-            else:
-                row = ""         
-                h,w = segms[0]['size']                
-                if scoring_flag:
-                    for proba,seg,label in zip(probs,segms,labels):                    
-                        prob = "{:.8f}".format(proba) if args.eight_digit else "{:.6f}".format(proba)
-                        mask = maskUtils.decode(seg).astype(np.bool)
-                        rle = encode_binary_mask(mask).decode("utf-8")
-                        row += (label+' '+prob+' '+rle+' ')
-                        if args.expand:
-                            for parent in all_keyed_child[label]:
-                                row += (parent+' '+prob+' '+rle+' ')                      
-                    
-    #                sub.loc[sub.index[i]] = w,h,row.strip(' ')
+    # scores are written with 8 or 6 decimals, in the csv or in the store
+    score_fmt = "{:.8f}" if args.eight_digit else "{:.6f}"
+    if args.out_store:
+        # the store keeps the RLE counts of the model output as they are, so
+        # no mask is decoded here; each shard is written as its own part
+        from det_store import DetStoreWriter
+        with DetStoreWriter(args.out_store, start_part=i) as writer:
+            for j in tqdm(range(len(results))):
+                bb_result, segm_result = results[j]
+                bbs = np.vstack(bb_result)
+                if len(segm_result)==2: ## mask scoring rcnn
+                    segms = mmcv.concat_list(segm_result[0])
+                    scores = np.array(mmcv.concat_list(segm_result[1]), dtype=np.float64)
                 else:
-                    for bb,seg,label in zip(bbs,segms,labels):                    
-                        prob = "{:.8f}".format(bb[4]) if args.eight_digit else "{:.6f}".format(bb[4])
-                        mask = maskUtils.decode(seg).astype(np.bool)
-                        rle = encode_binary_mask(mask).decode("utf-8")
-                        row += (label+' '+prob+' '+rle+' ')
-                        if args.expand:
-                            for parent in all_keyed_child[label]:
-                                row += (parent+' '+prob+' '+rle+' ')    
-                df.loc[sub.index.values[i]] = w,h,row.strip(' ')
-        return df
-
-
-    chunks = funcy.lchunks(int(len(i_lst)/100), i_lst)
-    p = Pool(processes=num_processes)
-    df_list = list(tqdm(p.imap(process_img, chunks, chunksize=1), total=len(chunks)))
-    p.close()
-    p.join()
-
-    print(f"len(df_list) = " +str(len(df_list)))
-
-    df_total = pd.concat(df_list)
-    print(f"df_total.shape = " +str(df_total.shape))
-
-    df_total.ImageWidth=df_total.ImageWidth.astype('int')
-    df_total.ImageHeight=df_total.ImageHeight.astype('int')
-       
-
-    df_total.reset_index().to_csv(pkl_path.replace('.pkl', '.csv').replace('LB_pkl','LB_csv'),index=False)
-
-
-    ## combining 25 csv
-    if i==24:            
-        del df_total, results, df_list
-        gc.collect()
+                    segms = mmcv.concat_list(segm_result)
+                    scores = bbs[:, 4]
+                labels = [CLASSES[k] for k, bbox in enumerate(bb_result) for _ in range(bbox.shape[0])]
+                assert len(segms)==len(labels) and len(segms)==len(bbs)
+                # rounded like the csv, so that both are thresholded alike
+                scores = np.array([float(score_fmt.format(s)) for s in scores])
+                bboxes = bbs[:, :4]
+                counts = [seg['counts'] for seg in segms]
+                if args.expand:
+                    rep, labels = hierarchy.expand_labels(np.array(labels, dtype=str))
+                    scores, bboxes = scores[rep], bboxes[rep]
+                    counts = [counts[k] for k in rep]
+                h, w = segms[0]['size'] if len(segms) else (-1, -1)
+                writer.add(img_lst[j], w, h, labels, scores, bboxes, counts)
+    else:
+        # the masks of the results are COCO RLEs already, so they are turned
+        # into the OID encoding without being decoded. The results are
+        # flattened into a few numpy arrays before forking: the workers only
+        # get index chunks and read these arrays from the (copy-on-write)
+        # memory of the parent, which, unlike millions of python objects,
+        # are never copied by refcounting.
+        from seg_results import flatten_results, prediction_string
+        columns = flatten_results(results)
+        del results
         gc.collect()
+
+        # parent label names of each class index
+        parents = hierarchy.relative_labels(CLASSES) if args.expand else None
+        i_lst = list(range(len(img_lst)))
+        def process_img(i_sublst):
+            rows = []
+            for j in i_sublst:
+                rows.append((img_lst[j], columns['width'][j], columns['height'][j],
+                             prediction_string(columns, j, CLASSES, score_fmt, parents)))
+            return rows
+
+        # rows are written as the chunks come back, in order
+        from submission import SubmissionWriter, merge_submissions, write_submission
+        csv_path = pkl_path.replace('.pkl', '.csv').replace('LB_pkl','LB_csv')
+        chunks = funcy.lchunks(max(len(i_lst)//100, 1), i_lst)
+        p = Pool(processes=num_processes)
+        with SubmissionWriter(csv_path) as writer:
+            for rows in tqdm(p.imap(process_img, chunks, chunksize=1), total=len(chunks)):
+                writer.write_rows(rows)
+        p.close()
+        p.join()
+        print(f"{writer.num_rows} rows written to {csv_path}")
+
+
+        ## combining 25 csv
+        if i==24:            
+            del columns
+            gc.collect()
+
+            # k-way merge of the 25 shards, in the order of the sample submission
+            csv_paths = [pkl_path.replace('_24of25',f'_{j}of25').replace('LB_pkl','LB_csv').replace('.pkl', '.csv') for j in range(25)]
+            order = pd.read_csv(data_dir+'sample_empty_submission_seg.csv', usecols=['ImageID']).ImageID.values
         
-        sub = None
-        for j in range(25):
-            df = pd.read_csv(pkl_path.replace('_24of25',f'_{j}of25').replace('LB_pkl','LB_csv').replace('.pkl', '.csv'))
-            if j==0:
-                sub = df.copy()
-            else:
-                sub = pd.concat([sub,df])
-        
-        sub_filename = pkl_path.split('/')[-2].replace('cascade_mask_rcnn','cmrcnn').replace('_fpn_1x','') + \
-                        os.path.basename(pkl_path).replace('LB_res','').replace('_24of25','').replace('.pkl', '.csv')
-        sub.to_csv(sub_dir + sub_filename,index=False)        
+            sub_filename = pkl_path.split('/')[-2].replace('cascade_mask_rcnn','cmrcnn').replace('_fpn_1x','') + \
+                            os.path.basename(pkl_path).replace('LB_res','').replace('_24of25','').replace('.pkl', '.csv')
+            write_submission(sub_dir + sub_filename, merge_submissions(csv_paths, order))        
         
     
     
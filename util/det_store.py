@@ -0,0 +1,320 @@
+"""Columnar store of instance segmentation detections.
+
+A store is a directory of parts, each part holding the detections of a
+disjoint set of images as plain ``.npy`` columns, one row per instance::
+
+    store/
+        part_00000/
+            image_id.npy      (num_imgs, ) bytes
+            width.npy         (num_imgs, ) int32, -1 if unknown
+            height.npy        (num_imgs, ) int32, -1 if unknown
+            offsets.npy       (num_imgs + 1, ) int64, rows of each image
+            label.npy         (num_dets, ) bytes
+            score.npy         (num_dets, ) float64
+            bbox.npy          (num_dets, 4) float32, x1, y1, x2, y2
+            rle_offsets.npy   (num_dets + 1, ) int64
+            rle.npy           (rle_offsets[-1], ) uint8, raw COCO RLE counts
+        part_00001/
+        ...
+
+Columns are opened with ``mmap_mode='r'``, so reading a column never copies
+it, and the rows of an image are a contiguous slice of every column. The
+scores are float64 so that the scores of a submission, rounded to its
+decimals, are kept as the csv would parse them and thresholded alike. The
+masks are kept as raw COCO RLE counts, the OID challenge encoding (zlib +
+base64) is only applied when the final submission is written.
+"""
+import os
+import os.path as osp
+import shutil
+from glob import glob
+
+import numpy as np
+
+from mask_nms import counts_to_oid
+from submission import SubmissionWriter, join_predictions
+
+IMAGE_COLUMNS = ('image_id', 'width', 'height', 'offsets')
+ROW_COLUMNS = ('label', 'score', 'bbox', 'rle_offsets', 'rle')
+
+
+def _part_dirs(path):
+    """Committed part directories of a store, without the ``.tmp`` ones of
+    an interrupted write, in order."""
+    return sorted(glob(osp.join(path, 'part_' + '[0-9]' * 5)))
+
+
+def _as_bytes(values):
+    values = [v.encode() if isinstance(v, str) else v for v in values]
+    return np.array(values, dtype=np.bytes_)
+
+
+class DetStoreWriter(object):
+    """Append images and their detections to a store.
+
+    Args:
+        path (str): store directory, created if it does not exist.
+        part_size (int, optional): number of images per part, by default a
+            part is written on every :meth:`flush` (or :meth:`close`).
+        start_part (int, optional): index of the first part to write, by
+            default the parts are appended after the existing ones.
+    """
+
+    def __init__(self, path, part_size=None, start_part=None):
+        self.path = path
+        self.part_size = part_size
+        os.makedirs(path, exist_ok=True)
+        if start_part is None:
+            part_dirs = _part_dirs(path)
+            start_part = (int(part_dirs[-1].rsplit('_', 1)[-1]) + 1
+                          if part_dirs else 0)
+        self.part_idx = start_part
+        self._reset()
+
+    def _reset(self):
+        self._images = []
+        self._labels = []
+        self._scores = []
+        self._bboxes = []
+        self._counts = []
+
+    def add(self, image_id, width, height, labels=(), scores=(), bboxes=None,
+            counts=()):
+        """Add one image with all its detections.
+
+        Args:
+            image_id (str): image id.
+            width (int): image width.
+            height (int): image height.
+            labels (Sequence[str]): label of each detection.
+            scores (Sequence[float]): score of each detection.
+            bboxes (ndarray, optional): shape (n, 4)
+            counts (Sequence[bytes]): COCO RLE counts of each detection.
+        """
+        num = len(labels)
+        assert len(scores) == num and len(counts) == num
+        if bboxes is None:
+            bboxes = np.zeros((num, 4), dtype=np.float32)
+        self._images.append((image_id, width, height, num))
+        self._labels.extend(labels)
+        self._scores.append(np.asarray(scores, dtype=np.float64))
+        self._bboxes.append(
+            np.asarray(bboxes, dtype=np.float32).reshape(num, 4))
+        self._counts.extend(counts)
+        if self.part_size is not None and len(self._images) >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        if not self._images:
+            return
+        image_ids, widths, heights, nums = zip(*self._images)
+        counts = [c.encode() if isinstance(c, str) else c
+                  for c in self._counts]
+        rle_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in counts], out=rle_offsets[1:])
+        offsets = np.zeros(len(nums) + 1, dtype=np.int64)
+        np.cumsum(nums, out=offsets[1:])
+        columns = dict(
+            image_id=_as_bytes(image_ids),
+            width=np.array(widths, dtype=np.int32),
+            height=np.array(heights, dtype=np.int32),
+            offsets=offsets,
+            label=_as_bytes(self._labels),
+            score=np.concatenate(self._scores),
+            bbox=np.concatenate(self._bboxes),
+            rle_offsets=rle_offsets,
+            rle=np.frombuffer(b''.join(counts), dtype=np.uint8))
+        # write to a tmp dir first so that a part is either complete or absent
+        part_dir = osp.join(self.path, 'part_{:05d}'.format(self.part_idx))
+        tmp_dir = part_dir + '.tmp'
+        if osp.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, value in columns.items():
+            np.save(osp.join(tmp_dir, name + '.npy'), value)
+        if osp.exists(part_dir):
+            shutil.rmtree(part_dir)
+        os.rename(tmp_dir, part_dir)
+        self.part_idx += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class DetStorePart(object):
+    """A single part of a store, columns are memory mapped on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = osp.basename(path)
+        self._columns = {}
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                osp.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    def __len__(self):
+        return self['image_id'].shape[0]
+
+    @property
+    def num_dets(self):
+        return int(self['offsets'][-1])
+
+    def counts(self, start=0, end=None):
+        """RLE counts (list of bytes) of the rows in [start, end)."""
+        end = self.num_dets if end is None else end
+        rle_offsets = np.asarray(self['rle_offsets'][start:end + 1])
+        rle = self['rle'][rle_offsets[0]:rle_offsets[-1]].tobytes()
+        rle_offsets = rle_offsets - rle_offsets[0]
+        return [
+            rle[rle_offsets[i]:rle_offsets[i + 1]] for i in range(end - start)
+        ]
+
+    def image(self, idx):
+        """Detections of the idx-th image of the part, as a dict."""
+        start, end = int(self['offsets'][idx]), int(self['offsets'][idx + 1])
+        return dict(
+            image_id=self['image_id'][idx].decode(),
+            width=int(self['width'][idx]),
+            height=int(self['height'][idx]),
+            labels=self['label'][start:end],
+            scores=self['score'][start:end],
+            bboxes=self['bbox'][start:end],
+            counts=self.counts(start, end))
+
+    def rows(self):
+        """All the rows of the part with per-row image info, as a dict."""
+        nums = np.diff(self['offsets'])
+        return dict(
+            image_id=np.repeat(self['image_id'], nums),
+            width=np.repeat(self['width'], nums),
+            height=np.repeat(self['height'], nums),
+            label=np.asarray(self['label']),
+            score=np.asarray(self['score']),
+            bbox=np.asarray(self['bbox']),
+            counts=self.counts())
+
+
+class DetStore(object):
+    """Read-only view of a store.
+
+    Args:
+        path (str): store directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parts = [DetStorePart(d) for d in _part_dirs(path)]
+        self._index = None
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    @property
+    def part_names(self):
+        return [part.name for part in self.parts]
+
+    def part(self, name):
+        return self.parts[self.part_names.index(name)]
+
+    def column(self, name):
+        """Concatenate a column over all parts.
+
+        Use ``store.parts[i][name]`` for a zero-copy view of a single part.
+        """
+        return np.concatenate([part[name] for part in self.parts])
+
+    def read_image(self, image_id):
+        """Detections of a single image, looked up by its id."""
+        if self._index is None:
+            self._index = {}
+            for part in self.parts:
+                for i, img in enumerate(part['image_id']):
+                    self._index[img.decode()] = (part, i)
+        part, idx = self._index[image_id]
+        return part.image(idx)
+
+    def iter_images(self):
+        for part in self.parts:
+            for i in range(len(part)):
+                yield part.image(i)
+
+
+def write_rows(path, images, rows, part_idx=None):
+    """Write the rows of a set of images as a single part.
+
+    Args:
+        path (str): store directory.
+        images (dict): ``image_id``, ``width`` and ``height`` arrays of all
+            the images of the part (including those without any row), in
+            the order they are written.
+        rows (dict): per-row ``image_id``, ``label``, ``score``, ``bbox``
+            and ``counts``.
+        part_idx (int, optional): index of the part to write.
+    """
+    img_inds = {img: i for i, img in enumerate(images['image_id'])}
+    row_img_inds = np.array([img_inds[img] for img in rows['image_id']],
+                            dtype=np.int64)
+    order = np.argsort(row_img_inds, kind='mergesort')
+    offsets = np.searchsorted(row_img_inds[order],
+                              np.arange(len(img_inds) + 1))
+    labels = np.asarray(rows['label'])[order]
+    scores = np.asarray(rows['score'])[order]
+    bboxes = np.asarray(rows['bbox']).reshape(-1, 4)[order]
+    counts = [rows['counts'][i] for i in order]
+    with DetStoreWriter(path, start_part=part_idx) as writer:
+        for i, img in enumerate(images['image_id']):
+            start, end = offsets[i], offsets[i + 1]
+            writer.add(
+                img.decode() if isinstance(img, bytes) else img,
+                images['width'][i], images['height'][i],
+                labels[start:end], scores[start:end], bboxes[start:end],
+                counts[start:end])
+
+
+def part_images(part):
+    """Image table of a part, the first argument of :func:`write_rows`."""
+    return dict(
+        image_id=np.asarray(part['image_id']),
+        width=np.asarray(part['width']),
+        height=np.asarray(part['height']))
+
+
+def prediction_string(image, score_fmt='{:.6f}'):
+    """Format the detections of an image as a submission PredictionString."""
+    tokens = []
+    for label, score, counts in zip(image['labels'], image['scores'],
+                                    image['counts']):
+        tokens.append(label.decode())
+        tokens.append(score_fmt.format(score))
+        tokens.append(counts_to_oid(counts))
+    return ' '.join(tokens)
+
+
+def write_submission(stores, csv_path, score_fmt='{:.6f}'):
+    """Write the Kaggle submission csv of one or more stores.
+
+    The stores must hold the same images, the detections of an image are
+    written in the order of ``stores``.
+    """
+    if not isinstance(stores, (list, tuple)):
+        stores = [stores]
+    with SubmissionWriter(csv_path) as writer:
+        for image in stores[0].iter_images():
+            strings = [prediction_string(image, score_fmt)]
+            for store in stores[1:]:
+                strings.append(
+                    prediction_string(
+                        store.read_image(image['image_id']), score_fmt))
+            writer.write(image['image_id'], image['width'], image['height'],
+                         join_predictions(strings))
@@ -0,0 +1,137 @@
+"""Content-addressed on-disk cache of evaluation intermediates.
+
+An entry is a dict of named values (arrays, lists of RLE counts...) pickled
+to ``<dir>/<key[:2]>/<key>.pkl``, where the key is the hash of everything
+the arrays were computed from (:meth:`EvalCache.key`): the detections and
+ground truth of an image, the parameters and a version tag of the
+computation. A changed input is thus a new key and never a stale entry, and
+an unchanged image is not recomputed when the settings of the other images
+change.
+
+Entries are written to a temporary file and renamed, so that concurrent
+processes (e.g. the workers of a pool) share a cache safely. A read entry
+is touched, and the least recently used entries are evicted when the cache
+exceeds ``max_bytes``. The size of the cache is counted once, then kept in
+shared memory by all the processes, so that the directory is only scanned
+again to evict.
+"""
+import hashlib
+import multiprocessing
+import os
+import os.path as osp
+import pickle
+from glob import glob
+
+import numpy as np
+
+
+def _update(h, obj):
+    if isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        h.update('{}{}'.format(obj.dtype.str, obj.shape).encode())
+        h.update(obj.tobytes())
+    elif isinstance(obj, bytes):
+        h.update(b'b%d:' % len(obj))
+        h.update(obj)
+    elif isinstance(obj, str):
+        _update(h, obj.encode())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l%d:' % len(obj))
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, dict):
+        _update(h, sorted(obj.items()))
+    else:
+        h.update(repr(obj).encode())
+
+
+class EvalCache(object):
+    """A directory of cached entries, evicted least recently used first.
+
+    The cache is given to other processes when they start (e.g. by the
+    initializer of a ``Pool``), not with each task: its size counter is
+    shared memory, which is only inherited.
+
+    Args:
+        cache_dir (str): cache directory, created if needed.
+        max_bytes (int): size above which the oldest entries are removed,
+            down to 3/4 of it.
+    """
+
+    def __init__(self, cache_dir, max_bytes=8 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = multiprocessing.Value('q', self._scan_size())
+
+    @staticmethod
+    def key(*parts):
+        """Hash of arrays, bytes, str, numbers and nested lists of them."""
+        h = hashlib.sha1()
+        _update(h, parts)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return osp.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """The values of an entry as a dict, None if missing."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                values = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, or evicted meanwhile by another process
+            return None
+        return values
+
+    def put(self, key, **values):
+        path = self._path(key)
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = osp.getsize(tmp_path)
+        # under the lock, so that the entry replaced is counted out once
+        with self._size.get_lock():
+            try:
+                size -= osp.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._size.value += size
+            if self._size.value > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        entries = []
+        for path in glob(osp.join(self.cache_dir, '*', '*.pkl')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_bytes=None):
+        """Remove the least recently used entries, down to
+        ``target_bytes`` (3/4 of ``max_bytes`` by default)."""
+        if target_bytes is None:
+            target_bytes = self.max_bytes * 3 // 4
+        # one process at a time, the others wait for the new size
+        with self._size.get_lock():
+            entries = sorted(self._entries())
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, path in entries:
+                if size <= target_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                size -= entry_size
+            self._size.value = size
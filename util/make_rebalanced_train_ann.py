@@ -10,6 +10,7 @@ import mmcv
 import matplotlib.pyplot as plt
 import json
 import gc
+from mmdet.datasets.ann_columns import load_img_infos
 gc.collect()    
 
 if __name__ == '__main__':
@@ -161,7 +162,7 @@ if __name__ == '__main__':
     ### generating the list of 450757 imgs
     
     
-    tr_ann = mmcv.load(data_dir + 'mmdet_anno/seg_train_275_leave_cls_ann.pkl')
+    tr_ann = list(load_img_infos(data_dir + 'mmdet_anno/seg_train_275_leave_cls_ann.npz'))
     val_ann=mmcv.load(data_dir + 'mmdet_anno/seg_val_275_leave_cls_ann.pkl')
     tr_ann = tr_ann + val_ann
     len(tr_ann)
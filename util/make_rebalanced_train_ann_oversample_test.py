@@ -10,6 +10,7 @@ import mmcv
 import matplotlib.pyplot as plt
 import json
 import gc
+from mmdet.datasets.ann_columns import load_img_infos
 gc.collect()    
 
 if __name__ == '__main__':
@@ -198,7 +199,7 @@ if __name__ == '__main__':
     lst_all = mmcv.load(data_dir + 'mmdet_anno/seg_oversample_test_rnd9to15_filenames_3147572.pkl')
     
     
-    all_ann = mmcv.load(data_dir + 'mmdet_anno/seg_train_275_leave_cls_ann.pkl') +\
+    all_ann = list(load_img_infos(data_dir + 'mmdet_anno/seg_train_275_leave_cls_ann.npz')) +\
               mmcv.load(data_dir + 'mmdet_anno/seg_val_275_leave_cls_ann.pkl') +\
               mmcv.load(data_dir + 'mmdet_anno/seg_test_leaves_ann.pkl')
     
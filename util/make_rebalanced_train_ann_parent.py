@@ -9,6 +9,7 @@ import mmcv
 import argparse
 import platform
 from glob import glob 
+from class_hierarchy import ClassHierarchy
 
 if __name__ == '__main__':
     
@@ -17,36 +18,12 @@ if __name__ == '__main__':
     sub_dir = '/Users/bo_liu/Documents/open-images/subs/'
     
     
-    all_keyed_child = mmcv.load(data_dir+'seg_all_keyed_child.pkl') # child -> parents
-    all_keyed_child = {k:v for (k,v) in all_keyed_child.items() if len(v)>0}
-    all_keyed_child_1 = {k:v for (k,v) in all_keyed_child.items() if len(v)==1}
-    all_keyed_child_2 = {k:v for (k,v) in all_keyed_child.items() if len(v)==2}
-    all_keyed_child_3 = {k:v for (k,v) in all_keyed_child.items() if len(v)==3}
+    hierarchy = ClassHierarchy.load(data_dir+'seg_all_keyed_child.pkl') # child -> parents
     
-    
-    all_keyed_parent = mmcv.load(data_dir+'seg_all_keyed_parent.pkl') # parent -> children
-    
-    
-    def expand_parent_labels(train_gt):
-        df1 = train_gt.set_index('LabelName').loc[all_keyed_child_1.keys()].reset_index().copy()
-        df1.LabelName = df1.LabelName.apply(lambda x:all_keyed_child_1[x][0])
-        
-        df2a = train_gt.set_index('LabelName').loc[all_keyed_child_2.keys()].reset_index().copy()
-        df2b = train_gt.set_index('LabelName').loc[all_keyed_child_2.keys()].reset_index().copy()
-        df2a.LabelName = df2a.LabelName.apply(lambda x:all_keyed_child_2[x][0])
-        df2b.LabelName = df2b.LabelName.apply(lambda x:all_keyed_child_2[x][1])
-        
-        df3a = train_gt.set_index('LabelName').loc[all_keyed_child_3.keys()].reset_index().copy()
-        df3b = train_gt.set_index('LabelName').loc[all_keyed_child_3.keys()].reset_index().copy()
-        df3c = train_gt.set_index('LabelName').loc[all_keyed_child_3.keys()].reset_index().copy()
-        df3a.LabelName = df3a.LabelName.apply(lambda x:all_keyed_child_3[x][0])
-        df3b.LabelName = df3b.LabelName.apply(lambda x:all_keyed_child_3[x][1])
-        df3c.LabelName = df3c.LabelName.apply(lambda x:all_keyed_child_3[x][2])
-        
-        train_gt = pd.concat([train_gt,df1,df2a,df2b,df3a,df3b,df3c])
-        return train_gt
-    
-    all_parents = [k for (k,v) in all_keyed_parent.items() if len(v)>0]
+    # the classes with children
+    all_parents = [label for label, children in
+                   zip(hierarchy.classes, hierarchy.relative_labels(hierarchy.classes, 'descendants'))
+                   if len(children)>0]
     
     val_seg_3841 = mmcv.load(data_dir + 'seg_anno/list_of_val_seg_3841.pkl')
     
@@ -61,7 +38,9 @@ if __name__ == '__main__':
     train_gt = train_gt.loc[~train_gt.ImageID.isin(val_seg_3841)].copy()
     
     
-    train_gt = expand_parent_labels(train_gt)
+    # every annotation is repeated for each ancestor of its class
+    item_inds, labels = hierarchy.expand_labels(train_gt.LabelName.values)
+    train_gt = train_gt.iloc[item_inds].assign(LabelName=labels)
     
     
     # remove Carnivore and Reptile
@@ -0,0 +1,174 @@
+"""Greedy mask NMS (and mask voting) working directly on COCO RLEs.
+
+Detections are grouped once per (image, label) and every group is handled by
+:func:`mask_nms`, which never decodes a mask just to compare it: mask areas,
+boxes and IoUs all come from pycocotools on the encoded masks. Pairs whose
+boxes cannot reach ``iou_thr`` are skipped before any mask IoU is computed.
+"""
+import base64
+import zlib
+
+import numpy as np
+from pycocotools import mask as maskUtils
+
+# version of the cached NMS outputs, part of their keys
+NMS_VERSION = 'mask_nms.1'
+
+
+def oid_to_counts(oid_mask):
+    """Convert an OID challenge mask string (zlib + base64) to RLE counts."""
+    return zlib.decompress(base64.b64decode(oid_mask))
+
+
+def counts_to_oid(counts):
+    """Convert RLE counts to the OID challenge mask string (zlib + base64)."""
+    if isinstance(counts, str):
+        counts = counts.encode()
+    binary_str = zlib.compress(counts, zlib.Z_BEST_COMPRESSION)
+    return base64.b64encode(binary_str).decode()
+
+
+def iou_upper_bound(boxes, areas):
+    """Upper bound of the pairwise mask IoU from boxes and mask areas.
+
+    The intersection of two masks can not exceed the intersection of their
+    boxes nor the smaller mask, and their union is at least the larger mask.
+
+    Args:
+        boxes (ndarray): shape (n, 4), [x, y, w, h] as given by
+            ``pycocotools.mask.toBbox``.
+        areas (ndarray): shape (n, ), mask areas.
+
+    Returns:
+        ndarray: shape (n, n)
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    iw = np.minimum(x2[:, None], x2[None, :]) - np.maximum(
+        x1[:, None], x1[None, :])
+    ih = np.minimum(y2[:, None], y2[None, :]) - np.maximum(
+        y1[:, None], y1[None, :])
+    inter = np.maximum(iw, 0) * np.maximum(ih, 0)
+    inter = np.minimum(inter, np.minimum(areas[:, None], areas[None, :]))
+    union = np.maximum(np.maximum(areas[:, None], areas[None, :]), 1)
+    return inter / union
+
+
+def mask_nms(rles, scores, iou_thr=0.5, mask_voting=False):
+    """Greedy NMS of the masks of a single (image, label) group.
+
+    A mask suppresses every mask with a strictly lower score whose IoU with
+    it is no less than ``iou_thr``. Empty masks are always suppressed. With
+    ``mask_voting``, a kept mask that suppressed at least 2 masks whose score
+    sum exceeds its own is replaced by the score-weighted vote of all of them.
+
+    Args:
+        rles (list[dict]): COCO RLEs with ``size`` and ``counts``.
+        scores (ndarray): shape (n, )
+        iou_thr (float): mask IoU threshold.
+        mask_voting (bool): whether to vote the kept masks.
+
+    Returns:
+        tuple: (keep, voted), ``keep`` is a bool array of shape (n, ) and
+            ``voted`` maps the index of a voted mask to its new RLE counts.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    num = len(rles)
+    areas = maskUtils.area(rles).astype(np.float64)
+    keep = areas > 0
+    voted = {}
+    if num < 2:
+        return keep, voted
+
+    boxes = maskUtils.toBbox(rles)
+    candidates = iou_upper_bound(boxes, areas) >= iou_thr
+    # only strictly lower scored masks can be suppressed
+    candidates &= scores[:, None] > scores[None, :]
+    candidates &= keep[:, None] & keep[None, :]
+
+    order = np.argsort(-scores, kind='mergesort')
+    for i in order:
+        if not keep[i]:
+            continue
+        cand_inds = np.where(candidates[i] & keep)[0]
+        if cand_inds.size == 0:
+            continue
+        ious = maskUtils.iou([rles[i]], [rles[j] for j in cand_inds],
+                             [0] * cand_inds.size)[0]
+        sup_inds = cand_inds[ious >= iou_thr]
+        keep[sup_inds] = False
+        if (mask_voting and sup_inds.size >= 2
+                and scores[sup_inds].sum() > scores[i]):
+            vote_inds = np.concatenate([[i], sup_inds])
+            masks = maskUtils.decode([rles[j] for j in vote_inds])
+            sum_msk = (masks * scores[vote_inds]).sum(axis=-1)
+            wt_avg_msk = sum_msk / scores[vote_inds].sum() > 0.5
+            voted[i] = maskUtils.encode(
+                np.asfortranarray(wt_avg_msk.astype(np.uint8)))['counts']
+    return keep, voted
+
+
+def group_indices(image_ids, labels):
+    """Group detection indices by (image, label) with a single sort.
+
+    Args:
+        image_ids (ndarray): shape (n, )
+        labels (ndarray): shape (n, )
+
+    Returns:
+        list[ndarray]: indices of each (image, label) group.
+    """
+    image_ids = np.asarray(image_ids)
+    labels = np.asarray(labels)
+    if image_ids.size == 0:
+        return []
+    order = np.lexsort((labels, image_ids))
+    sorted_imgs = image_ids[order]
+    sorted_lbls = labels[order]
+    starts = np.flatnonzero((sorted_imgs[1:] != sorted_imgs[:-1])
+                            | (sorted_lbls[1:] != sorted_lbls[:-1])) + 1
+    return np.split(order, starts)
+
+
+def nms_groups(groups, iou_thr=0.5, mask_voting=False, cache=None):
+    """Run :func:`mask_nms` on a list of groups.
+
+    Args:
+        groups (list[tuple]): each is (inds, counts, scores, height, width)
+            of a single (image, label) group.
+        iou_thr (float): mask IoU threshold.
+        mask_voting (bool): whether to vote the kept masks.
+        cache (EvalCache, optional): cache of the NMS of the groups, keyed
+            by their masks, scores and the settings (not by ``inds``), e.g.
+            with the groups of an image per call.
+
+    Returns:
+        tuple: (suppressed, voted), the suppressed indices and a dict from
+            the indices of voted masks to their new RLE counts.
+    """
+    outputs = None
+    if cache is not None:
+        key = cache.key(NMS_VERSION, iou_thr, mask_voting,
+                        [(list(counts), np.asarray(scores), int(h), int(w))
+                         for _, counts, scores, h, w in groups])
+        outputs = cache.get(key)
+    if outputs is None:
+        outputs = dict(keeps=[], voted=[])
+        for _, counts, scores, h, w in groups:
+            rles = [{'size': [int(h), int(w)], 'counts': c} for c in counts]
+            keep, group_voted = mask_nms(rles, scores, iou_thr, mask_voting)
+            outputs['keeps'].append(keep)
+            outputs['voted'].append(group_voted)
+        if cache is not None:
+            cache.put(key, **outputs)
+
+    suppressed = []
+    voted = {}
+    for (inds, _, _, _, _), keep, group_voted in zip(groups, outputs['keeps'],
+                                                     outputs['voted']):
+        suppressed.extend(np.asarray(inds)[~keep].tolist())
+        for i, new_counts in group_voted.items():
+            voted[inds[i]] = new_counts
+    return suppressed, voted
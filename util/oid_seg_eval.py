@@ -0,0 +1,663 @@
+"""Open Images 2019 instance segmentation metric, on a detection store.
+
+A local copy of the challenge metric (the ``OpenImagesChallengeEvaluator``
+of the TF object detection API with ``evaluate_masks``), for tuning score
+thresholds, NMS and fusion settings on the validation images without a
+Kaggle submission:
+
+* the ground truth instances are expanded to all their ancestors in the
+  class hierarchy, the positive image-level labels to their ancestors and
+  the negative ones to their descendants. The predictions are not expanded,
+  like in the challenge they must hold the parent classes themselves.
+* only the detections of the classes verified in an image (an image-level
+  label or an instance) are evaluated, the others are ignored.
+* a detection is a true positive if its mask IoU with the ground truth mask
+  it overlaps most is >= 0.5 and no higher scored detection matched it. The
+  detections lying (mask IoA >= 0.5) in a group-of instance are ignored,
+  and every group-of instance they hit is a single true positive scored by
+  the best of them. The instances without a mask (e.g. the group-of boxes
+  of the boxes csv) are matched by box IoU / IoA, and their detections
+  ignored, they do not count as ground truth.
+* the AP of a class is the area under its interpolated precision / recall
+  curve, the mAP the mean over the classes with ground truth.
+
+The matching of an image is vectorized (all the mask IoUs of a class in an
+image come from a single pycocotools call on the RLEs, none is decoded) and
+the images are evaluated in parallel. Several score thresholds are evaluated
+from a single matching, and with ``--cache_dir`` the overlaps and true /
+false positives of every image are cached (see ``eval_cache.py``), so that
+a run on a store whose images are mostly unchanged (e.g. new NMS settings
+for some classes) only matches the changed images::
+
+    GT=seg_anno/challenge-2019
+    python util/oid_seg_eval.py --store stores/val_L1 \\
+        --segm_csv $GT-validation-masks.csv \\
+        --labels_csv $GT-validation-segmentation-labels.csv \\
+        --hierarchy $GT-label300-segmentable-hierarchy.json \\
+        --image_list list_of_val_seg_2844.pkl --num_processes 8 \\
+        --score_thr 0 0.01 0.05 --cache_dir eval_cache --out val_L1_ap.csv
+
+The ground truth masks are either OID encoded in a ``Mask`` column (with
+``ImageWidth`` and ``ImageHeight``), as in the challenge evaluation csv, or
+read from the png files of a ``MaskPath`` column under ``--mask_dir``
+(resized to the size of the image in the store).
+"""
+import argparse
+import os
+import os.path as osp
+from multiprocessing import Pool
+
+import mmcv
+import numpy as np
+import pandas as pd
+from pycocotools import mask as maskUtils
+
+from class_hierarchy import ClassHierarchy, lookup
+from det_store import DetStore
+from eval_cache import EvalCache
+from mask_nms import oid_to_counts
+
+BOX_COLUMNS = ['XMin', 'XMax', 'YMin', 'YMax']
+# max detections of a class in an image, as in the challenge
+MAX_DETS = 10000
+# versions of the cached intermediates, part of their keys
+OVERLAPS_VERSION = 'oid_seg_eval.overlaps.1'
+TPFP_VERSION = 'oid_seg_eval.tpfp.1'
+PNG_VERSION = 'oid_seg_eval.png.1'
+
+# the EvalCache of this process, set by _set_cache (the initializer of the
+# pools), so that it is not pickled with every task
+_cache = None
+
+
+def _set_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def _read_png_mask(args):
+    path, height, width = args
+    cache = _cache
+    if cache is not None:
+        stat = os.stat(path)
+        key = cache.key(PNG_VERSION, osp.abspath(path), stat.st_size,
+                        stat.st_mtime_ns, height, width)
+        rle = cache.get(key)
+        if rle is not None:
+            return rle
+    mask = mmcv.imread(path, flag='grayscale')
+    if height > 0 and mask.shape != (height, width):
+        mask = mmcv.imresize(mask, (width, height), interpolation='nearest')
+    mask = np.asfortranarray((mask > 0).astype(np.uint8))
+    rle = maskUtils.encode(mask)
+    if cache is not None:
+        cache.put(key, **rle)
+    return rle
+
+
+def load_groundtruth(segm_csv,
+                     labels_csv,
+                     classes,
+                     hierarchy,
+                     boxes_csv=None,
+                     image_ids=None,
+                     mask_dir=None,
+                     image_sizes=None,
+                     num_processes=1,
+                     cache=None):
+    """Load and expand the challenge ground truth.
+
+    Args:
+        segm_csv (str): instance csv with the masks, box columns ``XMin``...
+            or ``BoxXMin``...
+        labels_csv (str): image-level labels csv (``Confidence`` 0 or 1).
+        classes (list[str]): the labels evaluated, others are dropped.
+        hierarchy (ClassHierarchy): class hierarchy.
+        boxes_csv (str, optional): box csv with ``IsGroupOf``, merged with
+            the instances of ``segm_csv`` (on the image, label and box), its
+            boxes without a mask are matched by box.
+        image_ids (Sequence[str], optional): evaluate these images only.
+        mask_dir (str, optional): directory of the ``MaskPath`` pngs.
+        image_sizes (dict, optional): (height, width) of the images, to
+            resize the pngs.
+        num_processes (int): processes reading the pngs.
+        cache (EvalCache, optional): cache of the png masks.
+
+    Returns:
+        dict: sorted ``image_ids``, per instance ``img``, ``cls``,
+            ``group_of``, ``has_mask``, ``box`` (normalized x1, y1, x2, y2)
+            and ``rle`` (None without a mask), and the sorted keys
+            ``img * num_classes + cls`` of the verified classes.
+    """
+    hierarchy = hierarchy.subset(classes)
+    segm = pd.read_csv(segm_csv).rename(
+        columns={'Box' + c: c
+                 for c in BOX_COLUMNS})
+    if 'IsGroupOf' not in segm:
+        segm['IsGroupOf'] = 0
+    if boxes_csv is not None:
+        boxes = pd.read_csv(
+            boxes_csv, usecols=['ImageID', 'LabelName', 'IsGroupOf'] +
+            BOX_COLUMNS)
+        # exact float keys, both csvs come from the same boxes
+        instances = pd.merge(
+            boxes,
+            segm,
+            how='outer',
+            on=['ImageID', 'LabelName', 'IsGroupOf'] + BOX_COLUMNS)
+    else:
+        instances = segm
+    labels = pd.read_csv(
+        labels_csv, usecols=['ImageID', 'LabelName', 'Confidence'])
+    if image_ids is not None:
+        image_ids = set(image_ids)
+        instances = instances[instances.ImageID.isin(image_ids)]
+        labels = labels[labels.ImageID.isin(image_ids)]
+    instances = instances[instances.LabelName.isin(classes)].reset_index(
+        drop=True)
+    labels = labels[labels.LabelName.isin(classes)].reset_index(drop=True)
+
+    num_classes = len(classes)
+    all_ids = np.unique(
+        np.concatenate([instances.ImageID.values,
+                        labels.ImageID.values]).astype(str))
+
+    mask_column = 'Mask' if 'Mask' in instances else 'MaskPath'
+    has_mask = instances[mask_column].notnull().values
+    rles = [None] * len(instances)
+    if mask_column == 'Mask':
+        for i, h, w, mask in zip(
+                np.flatnonzero(has_mask),
+                instances.ImageHeight.values[has_mask],
+                instances.ImageWidth.values[has_mask],
+                instances.Mask.values[has_mask]):
+            rles[i] = dict(size=[int(h), int(w)], counts=oid_to_counts(mask))
+    else:
+        assert mask_dir is not None, 'the png masks need a --mask_dir'
+        image_sizes = image_sizes or {}
+        inds = np.flatnonzero(has_mask)
+        jobs = [(osp.join(mask_dir, instances.MaskPath.iloc[i]), ) +
+                tuple(image_sizes.get(instances.ImageID.iloc[i], (-1, -1)))
+                for i in inds]
+        _set_cache(cache)
+        if num_processes > 1:
+            with Pool(num_processes, _set_cache, (cache, )) as pool:
+                encoded = pool.map(_read_png_mask, jobs, chunksize=64)
+        else:
+            encoded = [_read_png_mask(job) for job in jobs]
+        for i, rle in zip(inds, encoded):
+            rles[i] = rle
+
+    # instances and positive labels up, negative labels down the hierarchy
+    inds, cls = hierarchy.expand(
+        hierarchy.index(instances.LabelName.values), 'ancestors')
+    gt = dict(
+        image_ids=all_ids,
+        img=lookup(all_ids, instances.ImageID.values.astype(str))[inds],
+        cls=cls,
+        group_of=instances.IsGroupOf.values.astype(bool)[inds],
+        has_mask=has_mask[inds],
+        box=instances[['XMin', 'YMin', 'XMax',
+                       'YMax']].values.astype(np.float64)[inds],
+        rle=[rles[i] for i in inds])
+    label_img = lookup(all_ids, labels.ImageID.values.astype(str))
+    label_cls = hierarchy.index(labels.LabelName.values)
+    positive = labels.Confidence.values > 0
+    pos_inds, pos_cls = hierarchy.expand(label_cls[positive], 'ancestors')
+    neg_inds, neg_cls = hierarchy.expand(label_cls[~positive],
+                                         'descendants')
+    gt['verified'] = np.unique(
+        np.concatenate([
+            gt['img'] * num_classes + gt['cls'],
+            label_img[positive][pos_inds] * num_classes + pos_cls,
+            label_img[~positive][neg_inds] * num_classes + neg_cls
+        ]))
+    return gt
+
+
+def _row_counts(part, rows):
+    """RLE counts of the given rows of a store part."""
+    rle_offsets = np.asarray(part['rle_offsets'])
+    rle = part['rle'][:].tobytes()
+    return [rle[rle_offsets[i]:rle_offsets[i + 1]] for i in rows]
+
+
+def load_predictions(store, gt, classes, score_fmt='{:.6f}'):
+    """Detections of a store on the verified classes of the gt images.
+
+    The scores are rounded like in the submission (``score_fmt``), so that
+    the ties are those of the submitted csv. The detections with an empty
+    mask are kept, as false positives: their mask overlaps and box IoUs are
+    0, and their box IoAs NaN, which never match.
+
+    Returns:
+        dict: per detection ``img``, ``cls``, ``score``, ``box`` (normalized
+            x1, y1, x2, y2) and ``rle``, sorted by image, class, then in the
+            order of the store.
+    """
+    class_keys = np.array(classes).astype(np.bytes_)
+    image_keys = gt['image_ids'].astype(np.bytes_)
+    num_classes = len(classes)
+    img, cls, score, rles = [], [], [], []
+    for part in store.parts:
+        nums = np.diff(np.asarray(part['offsets']))
+        part_img = np.repeat(
+            lookup(image_keys, np.asarray(part['image_id'])), nums)
+        part_cls = lookup(class_keys, np.asarray(part['label']))
+        part_score = np.asarray(part['score'])
+        keep = (part_img >= 0) & (part_cls >= 0)
+        keep[keep] = np.isin(part_img[keep] * num_classes + part_cls[keep],
+                             gt['verified'])
+        rows = np.flatnonzero(keep)
+        heights = np.repeat(np.asarray(part['height']), nums)[rows]
+        widths = np.repeat(np.asarray(part['width']), nums)[rows]
+        for counts, h, w in zip(_row_counts(part, rows), heights, widths):
+            rles.append(dict(size=[int(h), int(w)], counts=counts))
+        img.append(part_img[rows])
+        cls.append(part_cls[rows])
+        score.append(part_score[rows])
+    img = np.concatenate(img) if img else np.zeros(0, dtype=np.int64)
+    cls = np.concatenate(cls) if cls else np.zeros(0, dtype=np.int64)
+    score = np.array([float(score_fmt.format(s)) for s in
+                      np.concatenate(score)]) if score else np.zeros(0)
+
+    boxes = maskUtils.toBbox(rles) if rles else np.zeros((0, 4))
+    order = np.lexsort((np.arange(len(img)), cls, img))
+    sizes = np.array([rle['size'] for rle in rles],
+                     dtype=np.float64).reshape(-1, 2)
+    boxes[:, 2:] += boxes[:, :2]
+    boxes /= sizes[:, [1, 0, 1, 0]]
+    return dict(
+        img=img[order],
+        cls=cls[order],
+        score=score[order],
+        box=boxes[order],
+        rle=[rles[i] for i in order])
+
+
+def _box_overlaps(det_boxes, gt_boxes):
+    """Box IoUs and IoAs (intersection over detection area), (D, G)."""
+    iw = np.minimum(det_boxes[:, None, 2], gt_boxes[None, :, 2]) - \
+        np.maximum(det_boxes[:, None, 0], gt_boxes[None, :, 0])
+    ih = np.minimum(det_boxes[:, None, 3], gt_boxes[None, :, 3]) - \
+        np.maximum(det_boxes[:, None, 1], gt_boxes[None, :, 1])
+    inter = np.maximum(iw, 0) * np.maximum(ih, 0)
+    det_areas = (det_boxes[:, 2] - det_boxes[:, 0]) * (
+        det_boxes[:, 3] - det_boxes[:, 1])
+    gt_areas = (gt_boxes[:, 2] - gt_boxes[:, 0]) * (
+        gt_boxes[:, 3] - gt_boxes[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (det_areas[:, None] + gt_areas[None, :] - inter)
+        ioa = inter / det_areas[:, None]
+    return iou, ioa
+
+
+def _match_iou(iou, tp, matched, iou_thr):
+    """Match the detections (sorted by score) to the non group-of gts.
+
+    Each detection is compared with the gt it overlaps most only, the first
+    of the detections of a gt above ``iou_thr`` matches it. Returns the
+    detections matched.
+    """
+    gt_inds = iou.argmax(1)
+    overlaps = iou[np.arange(len(gt_inds)), gt_inds]
+    inds = np.flatnonzero(~tp & ~matched & (overlaps >= iou_thr))
+    _, first = np.unique(gt_inds[inds], return_index=True)
+    inds = inds[first]
+    tp[inds] = True
+    return inds
+
+
+def _match_ioa(ioa, scores, tp, matched, iou_thr):
+    """Match the detections not matched yet to the group-of gts.
+
+    Returns:
+        tuple: (detections matched, best score of each group-of gt, 0 for
+            those without a detection).
+    """
+    gt_inds = ioa.argmax(1)
+    overlaps = ioa[np.arange(len(gt_inds)), gt_inds]
+    hit = ~tp & ~matched & (overlaps >= iou_thr)
+    matched |= hit
+    group_scores = np.zeros(ioa.shape[1])
+    np.maximum.at(group_scores, gt_inds[hit], scores[hit])
+    return np.flatnonzero(hit), group_scores
+
+
+def image_overlaps(det_boxes, det_rles, gt_boxes, gt_rles, gt_group_of,
+                   gt_has_mask):
+    """Overlaps of the detections of a class in an image with its gts.
+
+    Returns:
+        tuple: the mask IoUs (IoAs for the group-of gts) with the masked
+            gts, then the box IoUs and IoAs with the others, (D, G) each.
+    """
+    masked = np.flatnonzero(gt_has_mask)
+    mask_overlaps = np.zeros((len(det_rles), len(masked)))
+    if len(det_rles) and len(masked):
+        mask_overlaps = maskUtils.iou(det_rles, [gt_rles[i] for i in masked],
+                                      gt_group_of[masked].astype(np.uint8))
+    box_iou, box_ioa = _box_overlaps(det_boxes, gt_boxes[~gt_has_mask])
+    return mask_overlaps, box_iou, box_ioa
+
+
+def tpfp_image(scores,
+               overlaps,
+               gt_group_of,
+               gt_has_mask,
+               iou_thr=0.5,
+               group_of_weight=1.):
+    """True / false positives of the detections of a class in an image.
+
+    The detections are matched in 4 stages, by decreasing score in each:
+    to the masked non group-of gts (mask IoU), the masked group-of gts
+    (mask IoA), then the same by box for the gts without a mask. A
+    detection is only matched against higher scored ones, so the output
+    for a higher score threshold is that of its detections (up to the order
+    of equal scores, arbitrary in the challenge metric too).
+
+    Args:
+        scores (ndarray): (D, ) scores of the detections.
+        overlaps (tuple): output of :func:`image_overlaps`.
+
+    Returns:
+        tuple: (scores, tp labels) of the evaluated detections, and one
+            entry (weighted by ``group_of_weight``) per group-of gt hit.
+    """
+    order = np.argsort(scores)[::-1][:MAX_DETS]
+    scores = scores[order]
+    num_dets = len(order)
+    if len(gt_group_of) == 0:
+        return scores, np.zeros(num_dets)
+    mask_overlaps, box_iou, box_ioa = [o[order] for o in overlaps]
+    tp = np.zeros(num_dets, dtype=bool)
+    # matched to a group-of, or to a gt without mask: ignored
+    matched = np.zeros(num_dets, dtype=bool)
+    ignored = np.zeros(num_dets, dtype=bool)
+    group_scores = np.zeros(0)
+
+    group_of = gt_group_of[gt_has_mask]
+    if (~group_of).any():
+        _match_iou(mask_overlaps[:, ~group_of], tp, matched, iou_thr)
+    if group_of.any():
+        _, group_scores = _match_ioa(mask_overlaps[:, group_of], scores, tp,
+                                     matched, iou_thr)
+    group_of = gt_group_of[~gt_has_mask]
+    if (~group_of).any():
+        ignored[_match_iou(box_iou[:, ~group_of], tp, matched,
+                           iou_thr)] = True
+    if group_of.any():
+        hit, _ = _match_ioa(box_ioa[:, group_of], scores, tp, matched,
+                            iou_thr)
+        ignored[hit] = True
+
+    valid = ~matched & ~ignored
+    keep = group_scores > 0 if group_of_weight > 0 else np.zeros(
+        len(group_scores), dtype=bool)
+    return (np.concatenate([scores[valid], group_scores[keep]]),
+            np.concatenate([
+                tp[valid].astype(np.float64),
+                np.full(keep.sum(), group_of_weight)
+            ]))
+
+
+def average_precision(scores, tp, num_gt):
+    """Area under the interpolated precision / recall curve, nan without
+    ground truth."""
+    if num_gt == 0:
+        return np.nan
+    tp = tp[np.argsort(scores)[::-1]]
+    cum_tp = np.cumsum(tp)
+    cum_fp = np.cumsum((tp <= 0).astype(np.float64))
+    precision = np.concatenate([[0], cum_tp / (cum_tp + cum_fp), [0]])
+    recall = np.concatenate([[0], cum_tp / num_gt, [1]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    inds = np.flatnonzero(recall[1:] != recall[:-1]) + 1
+    return np.sum((recall[inds] - recall[inds - 1]) * precision[inds])
+
+
+def _bounds(sorted_values, values):
+    """[start, end) of each of ``values`` in ``sorted_values``."""
+    return (np.searchsorted(sorted_values, values, 'left'),
+            np.searchsorted(sorted_values, values, 'right'))
+
+
+def _rles_key(rles):
+    """Sizes and counts of RLEs (None for no mask) as a few flat arrays,
+    cheap to hash."""
+    sizes = np.array([rle['size'] if rle is not None else (-1, -1)
+                      for rle in rles],
+                     dtype=np.int64).reshape(-1, 2)
+    counts = [rle['counts'] if rle is not None else b'' for rle in rles]
+    return sizes, np.array([len(c) for c in counts]), b''.join(counts)
+
+
+def eval_image(task):
+    """True / false positives of the detections of an image.
+
+    ``task`` holds the detections and gts of the image (sorted by class)
+    and the matching settings, the :class:`EvalCache` of the process is
+    that of :func:`_set_cache`, if any. The overlaps
+    are cached by the content of the masks and boxes, the outputs by that
+    of the overlaps, the scores and the settings, so that new scores only
+    redo the matching and an unchanged image nothing.
+
+    Returns:
+        dict: ``cls`` (k, ) the classes of the detections, ``offsets``
+            (k + 1, ) and the concatenated ``scores`` and ``tp`` of the
+            classes (see :func:`tpfp_image`).
+    """
+    dets, gts, iou_thr, group_of_weight = task
+    cache = _cache
+    cls = np.unique(dets['cls'])
+    det_starts, det_ends = _bounds(dets['cls'], cls)
+    gt_starts, gt_ends = _bounds(gts['cls'], cls)
+    cached = None
+    if cache is not None:
+        overlaps_key = cache.key(OVERLAPS_VERSION, dets['cls'], dets['box'],
+                                 _rles_key(dets['rle']), gts['cls'],
+                                 gts['box'], gts['group_of'],
+                                 gts['has_mask'], _rles_key(gts['rle']))
+        tpfp_key = cache.key(TPFP_VERSION, overlaps_key, dets['score'],
+                             iou_thr, group_of_weight)
+        result = cache.get(tpfp_key)
+        if result is not None:
+            return result
+        cached = cache.get(overlaps_key)
+    if cached is not None:
+        overlaps = cached['overlaps']
+    else:
+        overlaps = [
+            image_overlaps(dets['box'][d], dets['rle'][d], gts['box'][g],
+                           gts['rle'][g], gts['group_of'][g],
+                           gts['has_mask'][g])
+            for d, g in ((slice(det_starts[k], det_ends[k]),
+                          slice(gt_starts[k], gt_ends[k]))
+                         for k in range(len(cls)))
+        ]
+        if cache is not None:
+            cache.put(overlaps_key, overlaps=overlaps)
+
+    all_scores, all_tp = [np.zeros(0)], [np.zeros(0)]
+    offsets = np.zeros(len(cls) + 1, dtype=np.int64)
+    for k in range(len(cls)):
+        g = slice(gt_starts[k], gt_ends[k])
+        scores, tp = tpfp_image(dets['score'][det_starts[k]:det_ends[k]],
+                                overlaps[k], gts['group_of'][g],
+                                gts['has_mask'][g], iou_thr, group_of_weight)
+        all_scores.append(scores)
+        all_tp.append(tp)
+        offsets[k + 1] = offsets[k] + len(scores)
+    result = dict(
+        cls=cls,
+        offsets=offsets,
+        scores=np.concatenate(all_scores),
+        tp=np.concatenate(all_tp))
+    if cache is not None:
+        cache.put(tpfp_key, **result)
+    return result
+
+
+def _select(columns, inds):
+    return {
+        k: [v[i] for i in inds] if isinstance(v, list) else v[inds]
+        for k, v in columns.items()
+    }
+
+
+def evaluate(dets,
+             gt,
+             num_classes,
+             iou_thr=0.5,
+             group_of_weight=1.,
+             score_thrs=(0., ),
+             num_processes=1,
+             cache=None):
+    """Per class AP of the outputs of :func:`load_predictions` and
+    :func:`load_groundtruth`.
+
+    The detections are matched once, the APs of every score threshold come
+    from the same true / false positives (see :func:`tpfp_image`).
+
+    Args:
+        score_thrs (Sequence[float]): min scores of the detections.
+        num_processes (int): processes matching the images.
+        cache (EvalCache, optional): cache of the intermediates.
+
+    Returns:
+        list[list[dict]]: for each score threshold, ``ap``, ``num_gt``,
+            ``num_dets`` and ``num_tp`` of each class.
+    """
+    gt_keys = ('img', 'cls', 'group_of', 'has_mask', 'box', 'rle')
+    gt_order = np.lexsort((gt['cls'], gt['img']))
+    gt = _select({k: gt[k] for k in gt_keys}, gt_order)
+    img_inds = np.unique(dets['img'])
+    det_starts, det_ends = _bounds(dets['img'], img_inds)
+    gt_starts, gt_ends = _bounds(gt['img'], img_inds)
+    tasks = ((_select(dets, np.arange(det_starts[k], det_ends[k])),
+              _select(gt, np.arange(gt_starts[k], gt_ends[k])), iou_thr,
+              group_of_weight) for k in range(len(img_inds)))
+
+    # per class outputs, in the order of the images
+    class_scores = [[] for _ in range(num_classes)]
+    class_tp = [[] for _ in range(num_classes)]
+
+    def add(result):
+        for k, c in enumerate(result['cls']):
+            s, e = result['offsets'][k], result['offsets'][k + 1]
+            class_scores[c].append(result['scores'][s:e])
+            class_tp[c].append(result['tp'][s:e])
+
+    _set_cache(cache)
+    if num_processes > 1:
+        with Pool(num_processes, _set_cache, (cache, )) as pool:
+            for result in pool.imap(eval_image, tasks, chunksize=16):
+                add(result)
+    else:
+        for task in tasks:
+            add(eval_image(task))
+
+    num_gt = np.bincount(
+        gt['cls'][gt['has_mask']],
+        weights=np.where(gt['group_of'], group_of_weight,
+                         1.)[gt['has_mask']],
+        minlength=num_classes)
+    results = [[] for _ in score_thrs]
+    for c in range(num_classes):
+        scores = np.concatenate(class_scores[c] or [np.zeros(0)])
+        tp = np.concatenate(class_tp[c] or [np.zeros(0)])
+        det_scores = dets['score'][dets['cls'] == c]
+        for results_thr, score_thr in zip(results, score_thrs):
+            keep = scores >= score_thr
+            results_thr.append(
+                dict(
+                    ap=average_precision(scores[keep], tp[keep], num_gt[c]),
+                    num_gt=num_gt[c],
+                    num_dets=np.sum(det_scores >= score_thr),
+                    num_tp=tp[keep].sum()))
+    return results
+
+
+def load_classes(hierarchy, classes_csv=None):
+    """Labels evaluated, those of a class description csv (without header)
+    or all the classes of the hierarchy."""
+    if classes_csv is not None:
+        return pd.read_csv(
+            classes_csv, header=None, names=['LabelName', 'DisplayName'])[
+                'LabelName'].tolist()
+    return hierarchy.classes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Open Images 2019 instance segmentation metric')
+    parser.add_argument('--store', required=True, help='detection store')
+    parser.add_argument('--segm_csv', required=True)
+    parser.add_argument('--labels_csv', required=True)
+    parser.add_argument('--hierarchy', required=True)
+    parser.add_argument('--boxes_csv', help='boxes csv with IsGroupOf')
+    parser.add_argument('--classes_csv', help='class description csv')
+    parser.add_argument('--mask_dir', help='directory of the png masks')
+    parser.add_argument(
+        '--image_list', help='pkl / json list of the images to evaluate')
+    parser.add_argument('--iou_thr', type=float, default=0.5)
+    parser.add_argument(
+        '--score_thr',
+        type=float,
+        nargs='+',
+        default=[0.],
+        help='one or more min scores, evaluated from the same matching')
+    parser.add_argument('--group_of_weight', type=float, default=1.)
+    parser.add_argument('--num_processes', type=int, default=1)
+    parser.add_argument(
+        '--cache_dir', help='cache of the overlaps and tp / fp of the images')
+    parser.add_argument(
+        '--cache_size', type=float, default=8., help='max cache size in GB')
+    parser.add_argument('--out', help='per class AP csv')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cache = EvalCache(args.cache_dir, int(args.cache_size * 2**30)
+                      ) if args.cache_dir else None
+    hierarchy = ClassHierarchy.load(args.hierarchy)
+    classes = load_classes(hierarchy, args.classes_csv)
+    store = DetStore(args.store)
+    image_sizes = {}
+    for part in store.parts:
+        for image_id, h, w in zip(part['image_id'], part['height'],
+                                  part['width']):
+            image_sizes[image_id.decode()] = (int(h), int(w))
+    image_ids = mmcv.load(args.image_list) if args.image_list else None
+
+    gt = load_groundtruth(args.segm_csv, args.labels_csv, classes, hierarchy,
+                          args.boxes_csv, image_ids, args.mask_dir,
+                          image_sizes, args.num_processes, cache)
+    missing = len(set(gt['image_ids']) - set(image_sizes))
+    if missing:
+        print('{} images have no prediction in {}'.format(
+            missing, args.store))
+    dets = load_predictions(store, gt, classes)
+    results = evaluate(dets, gt, len(classes), args.iou_thr,
+                       args.group_of_weight, args.score_thr,
+                       args.num_processes, cache)
+
+    tables = []
+    for score_thr, results_thr in zip(args.score_thr, results):
+        aps = np.array([r['ap'] for r in results_thr])
+        print('score_thr {}: {} images, {} classes with gt, {} detections, '
+              'mAP@{}: {:.5f}'.format(
+                  score_thr, len(gt['image_ids']), np.sum(~np.isnan(aps)),
+                  sum(r['num_dets'] for r in results_thr), args.iou_thr,
+                  np.nanmean(aps)))
+        table = pd.DataFrame(results_thr)
+        table.insert(0, 'LabelName', classes)
+        table.insert(1, 'score_thr', score_thr)
+        tables.append(table)
+    if args.out:
+        pd.concat(tables).to_csv(args.out, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Pack the train masks into a mask pack (see mmdet/datasets/mask_pack.py).
+
+Every mask png of the annotation files is read once, thresholded, resized to
+the size of its image and RLE encoded, then the masks of each image are
+written as one record. Train with ``mask_pack=<out_dir>`` in the dataset
+config to read them from the pack instead of the pngs:
+
+    python pack_train_masks.py \
+        --ann_files seg_train_275_leave_cls_ann.npz seg_train_parent_23_ann.npz \
+        --mask_prefix gs://oid2019/data/train_masks/ --out_dir train_mask_pack
+"""
+import argparse
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import cv2
+import funcy
+import mmcv
+import numpy as np
+import pycocotools.mask as maskUtils
+from tqdm import tqdm
+
+from mmdet.datasets.ann_columns import load_img_infos
+from mmdet.datasets.file_client import file_client_from_prefix
+from mmdet.datasets.mask_pack import MaskPackWriter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack train masks')
+    parser.add_argument('--ann_files', nargs='+')
+    parser.add_argument('--mask_prefix')
+    parser.add_argument('--out_dir')
+    parser.add_argument('--shard_mb', type=int, default=1024)
+    parser.add_argument('--num_processes', type=int, default=12)
+    parser.add_argument('--chunk_size', type=int, default=200)
+    return parser.parse_args()
+
+
+_shared = {}
+
+
+def process_chunk(images):
+    """Records of a chunk of images, [(filename, w, h, names, counts)]."""
+    file_client = _shared['file_client']
+    records = []
+    for filename, w, h, names in images:
+        values = file_client.get_many(
+            [_shared['mask_prefix'] + name for name in names])
+        counts = []
+        for mask_bytes in values:
+            msk = cv2.imdecode(
+                np.frombuffer(mask_bytes, dtype=np.uint8),
+                cv2.IMREAD_UNCHANGED)
+            msk = (msk > 0).astype('uint8')
+            # same resizing as OIDSegDataset.load_ann
+            msk = mmcv.imresize(msk, (w, h))
+            rle = maskUtils.encode(np.asfortranarray(msk))
+            counts.append(rle['counts'])
+        records.append((filename, w, h, names, counts))
+    return records
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # the masks of every image over all the annotation files, an image may
+    # appear several times (e.g. rebalanced files), its masks are packed once
+    images = OrderedDict()
+    for ann_file in args.ann_files:
+        for img_info in load_img_infos(ann_file):
+            key = img_info['filename']
+            if key not in images:
+                images[key] = (img_info['width'], img_info['height'],
+                               OrderedDict())
+            w, h, names = images[key]
+            assert (w, h) == (img_info['width'], img_info['height']), key
+            names.update((name, None) for name in img_info['ann']['MaskPath'])
+    images = [(filename, w, h, list(names))
+              for filename, (w, h, names) in images.items()]
+    print('{} images, {} masks'.format(
+        len(images), sum(len(x[3]) for x in images)))
+
+    _shared['file_client'] = file_client_from_prefix(args.mask_prefix)
+    _shared['mask_prefix'] = args.mask_prefix
+
+    chunks = funcy.lchunks(args.chunk_size, images)
+    p = Pool(processes=args.num_processes)
+    with MaskPackWriter(args.out_dir, args.shard_mb * 2**20) as writer:
+        for records in tqdm(p.imap(process_chunk, chunks), total=len(chunks)):
+            for record in records:
+                writer.add(*record)
+    p.close()
+    p.join()
@@ -9,11 +9,14 @@ import mmcv
 import argparse
 import platform
 from glob import glob 
+from funcy import chunks
+from class_hierarchy import ClassHierarchy
 
 if __name__ == '__main__':
     
     parser = argparse.ArgumentParser()
     parser.add_argument('--sub_csv_pattern')
+    parser.add_argument('--store', help='detection store to expand instead of csv files')
     parser.add_argument('--parents_only', type=int,default=0)   
     parser.add_argument('--no_expand',type=int,default=0)
     parser.add_argument('--thres', type=float)    
@@ -24,64 +27,63 @@ if __name__ == '__main__':
     repo_dir = '/Users/bo_liu/Documents/open-images/open-images/'
     sub_dir = '/Users/bo_liu/Documents/open-images/subs/'
     
-    all_keyed_child = mmcv.load(data_dir+'seg_all_keyed_child.pkl')
-        
-    sub_csvs = sorted(glob(args.sub_csv_pattern))
-
-    for sub_csv in sub_csvs:
-        assert 'of25.csv' in sub_csv or 'of25_msk_vote' in sub_csv
-        if 'of25_msk_vote' in sub_csv: 
-            k = int(sub_csv.split('of25_msk_vote')[-2].split('_')[-1])
-        else: 
-            k = int(sub_csv.replace('of25.csv','').split('_')[-1])
-        assert k>=0 and k<=24
+    hierarchy = None if args.no_expand else ClassHierarchy.load(data_dir+'seg_all_keyed_child.pkl')
 
-        import gc;gc.collect()
-        sub=pd.read_csv(sub_csv)
-        
-        thres = args.thres #0.001659
-        
-        prob_lst = []
-        
-        for i in tqdm(range(len(sub))):
-            string = sub.loc[i,'PredictionString']
-            if type(string) is float and np.isnan(string): continue
-            new_string = ''
-            lst = string.split(' ')
-            assert len(lst)%3==0
-            for j in range(len(lst)//3):
-        #        prob_lst.append(float(lst[3*j+1]))
-                if float(lst[3*j+1]) < thres:
-                    continue
-                if not args.parents_only: new_string += (' ' + lst[3*j] + ' ' + lst[3*j+1] + ' ' + lst[3*j+2])
-                if not args.no_expand:
-                    for parent in all_keyed_child[lst[3*j]]:
-                       new_string +=  (' ' + parent + ' ' + lst[3*j+1] + ' ' + lst[3*j+2])
-            sub.loc[i,'PredictionString'] = new_string.strip(' ')            
-                
-        sub_filename = sub_csv[:-4] + ('' if args.no_expand else '_expand') +f'_thr{args.thres}.csv'
+    if args.store:
+        from det_store import DetStore, write_rows, part_images
+        out_store = args.store.rstrip('/') + ('' if args.no_expand else '_expand') + f'_thr{args.thres}'
         if args.parents_only:
-            sub_filename = sub_filename.replace('.csv','_25cls.csv')   
-        sub.to_csv( sub_filename,index=False)        
-
+            out_store += '_25cls'
+        store = DetStore(args.store)
+        for part in tqdm(store.parts):
+            rows = part.rows()
+            keep = np.where(rows['score'] >= args.thres)[0]
+            if args.no_expand:
+                rep = keep[:0] if args.parents_only else keep
+                new_labels = rows['label'][rep]
+            else:
+                item_inds, new_labels = hierarchy.expand_labels(
+                    rows['label'][keep], with_self=not args.parents_only)
+                rep = keep[item_inds]
+            rows = dict(image_id=rows['image_id'][rep], label=new_labels,
+                        score=rows['score'][rep], bbox=rows['bbox'][rep],
+                        counts=[rows['counts'][j] for j in rep])
+            write_rows(out_store, part_images(part), rows, part_idx=int(part.name.split('_')[-1]))
+    else:
+        from submission import (SubmissionWriter, expand_predictions, image_ids,
+                                merge_submissions, read_submission, write_submission)
+        sub_csvs = sorted(glob(args.sub_csv_pattern))
+        out_csvs = []
 
-    ## combining 25 csv
-    assert len(sub_csvs)==25    
-    if k==9:            
-        gc.collect()
-        gc.collect()
-        
-        sub = None
         for sub_csv in sub_csvs:
-            df = pd.read_csv(sub_csv[:-4] + ('' if args.no_expand else '_expand') + f'_thr{args.thres}' + ('_25cls.csv' if args.parents_only else '.csv' ))
-            if sub is None:
-                sub = df.copy()
-            else:
-                sub = pd.concat([sub,df])
-          
-        sub_filename = os.path.basename(sub_csv).replace('_9of25','')[:-4] + ('' if args.no_expand else '_expand') + f'_thr{args.thres}.csv'
-        if args.parents_only:
-            sub_filename = sub_filename.replace('.csv','_25cls.csv')
-        sub.to_csv(sub_dir + sub_filename,index=False)  
+            assert 'of25.csv' in sub_csv or 'of25_msk_vote' in sub_csv
+            if 'of25_msk_vote' in sub_csv: 
+                k = int(sub_csv.split('of25_msk_vote')[-2].split('_')[-1])
+            else: 
+                k = int(sub_csv.replace('of25.csv','').split('_')[-1])
+            assert k>=0 and k<=24
+
+            thres = args.thres #0.001659
+
+            sub_filename = sub_csv[:-4] + ('' if args.no_expand else '_expand') +f'_thr{args.thres}.csv'
+            if args.parents_only:
+                sub_filename = sub_filename.replace('.csv','_25cls.csv')   
+            out_csvs.append(sub_filename)
+
+            with SubmissionWriter(sub_filename) as writer:
+                # the predictions of 1000 images are expanded at once
+                for rows in chunks(1000, tqdm(read_submission(sub_csv))):
+                    strings = expand_predictions([row[3] for row in rows], hierarchy, thres,
+                                                 with_self=not args.parents_only)
+                    writer.write_rows((image_id, w, h, string)
+                                      for (image_id, w, h, _), string in zip(rows, strings))
 
 
+        ## combining 25 csv
+        assert len(sub_csvs)==25    
+        if k==9:            
+            # streaming k-way merge, in the order of sub_csvs as before
+            sub_filename = os.path.basename(sub_csv).replace('_9of25','')[:-4] + ('' if args.no_expand else '_expand') + f'_thr{args.thres}.csv'
+            if args.parents_only:
+                sub_filename = sub_filename.replace('.csv','_25cls.csv')
+            write_submission(sub_dir + sub_filename, merge_submissions(out_csvs, image_ids(out_csvs)))
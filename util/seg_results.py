@@ -0,0 +1,146 @@
+"""Conversion of mmdet ``(bbox_result, segm_result)`` outputs to the OID
+challenge submission format.
+
+The masks in ``segm_result`` are already COCO RLEs (see
+``FCNMaskHead.get_seg_masks``), and the OID challenge encoding of a mask is
+nothing but zlib + base64 of those RLE counts, so no mask ever needs to be
+decoded here.
+"""
+import base64
+import typing as t
+import zlib
+
+import numpy as np
+from pycocotools import _mask as coco_mask
+
+from mask_nms import counts_to_oid
+
+
+def encode_binary_mask(mask: np.ndarray) -> t.Text:
+    """Converts a binary mask into OID challenge encoding ascii text.
+
+    This is the reference implementation from Kaggle, which needs the
+    decoded mask.
+    """
+    # check input mask --
+    if mask.dtype != bool:
+        raise ValueError(
+            "encode_binary_mask expects a binary mask, received dtype == %s" %
+            mask.dtype)
+
+    mask = np.squeeze(mask)
+    if len(mask.shape) != 2:
+        raise ValueError(
+            "encode_binary_mask expects a 2d mask, received shape == %s" %
+            mask.shape)
+
+    # convert input mask to expected COCO API input --
+    mask_to_encode = mask.reshape(mask.shape[0], mask.shape[1], 1)
+    mask_to_encode = mask_to_encode.astype(np.uint8)
+    mask_to_encode = np.asfortranarray(mask_to_encode)
+
+    # RLE encode mask --
+    encoded_mask = coco_mask.encode(mask_to_encode)[0]["counts"]
+
+    # compress and base64 encoding --
+    binary_str = zlib.compress(encoded_mask, zlib.Z_BEST_COMPRESSION)
+    base64_str = base64.b64encode(binary_str)
+    return base64_str
+
+
+def flatten_results(results):
+    """Flatten a list of per-image results into flat columns.
+
+    Only numpy arrays are returned, so that forked workers can read them
+    without touching (and copying) millions of python objects.
+
+    Args:
+        results (list[tuple]): ``(bbox_result, segm_result)`` of each image,
+            ``segm_result`` is ``(segms, mask_scores)`` for mask scoring
+            rcnn.
+
+    Returns:
+        dict: ``img_offsets`` (num_imgs + 1, ), ``height`` and ``width``
+            (num_imgs, ), -1 for images without detections, and per
+            detection ``label`` (0-based class index), ``score`` (float64,
+            so that float32 scores are formatted exactly as before),
+            ``bbox``, ``rle_offsets`` (num_dets + 1, ) and ``rle`` (raw RLE
+            counts).
+    """
+    nums = []
+    heights = []
+    widths = []
+    labels = []
+    scores = []
+    bboxes = []
+    counts = []
+    for bb_result, segm_result in results:
+        bbs = np.vstack(bb_result)
+        if len(segm_result) == 2:  # mask scoring rcnn
+            segms = [s for cls_segms in segm_result[0] for s in cls_segms]
+            scores.append(
+                np.array([p for cls_probs in segm_result[1]
+                          for p in cls_probs], dtype=np.float64))
+        else:
+            segms = [s for cls_segms in segm_result for s in cls_segms]
+            scores.append(bbs[:, 4].astype(np.float64))
+        assert len(segms) == bbs.shape[0]
+        labels.append(
+            np.concatenate([
+                np.full(bbox.shape[0], i, dtype=np.int32)
+                for i, bbox in enumerate(bb_result)
+            ]))
+        bboxes.append(bbs[:, :4].astype(np.float32))
+        counts.extend(seg['counts'] for seg in segms)
+        h, w = segms[0]['size'] if segms else (-1, -1)
+        heights.append(h)
+        widths.append(w)
+        nums.append(len(segms))
+    img_offsets = np.zeros(len(nums) + 1, dtype=np.int64)
+    np.cumsum(nums, out=img_offsets[1:])
+    rle_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in counts], out=rle_offsets[1:])
+    return dict(
+        img_offsets=img_offsets,
+        height=np.array(heights, dtype=np.int32),
+        width=np.array(widths, dtype=np.int32),
+        label=np.concatenate(labels) if labels else np.zeros(0, np.int32),
+        score=np.concatenate(scores) if scores else np.zeros(0, np.float64),
+        bbox=np.concatenate(bboxes) if bboxes else np.zeros((0, 4),
+                                                            np.float32),
+        rle_offsets=rle_offsets,
+        rle=np.frombuffer(b''.join(counts), dtype=np.uint8))
+
+
+def prediction_string(columns, idx, classes, score_fmt='{:.6f}',
+                      parents=None):
+    """PredictionString of the idx-th image of flattened results.
+
+    Args:
+        columns (dict): output of :func:`flatten_results`.
+        idx (int): image index.
+        classes (Sequence[str]): label names.
+        score_fmt (str): format of the scores.
+        parents (Sequence[list[str]], optional): parent label names of each
+            class (e.g. :meth:`ClassHierarchy.relative_labels` of
+            ``classes``), every detection is repeated for its parents if
+            given.
+
+    Returns:
+        str: the PredictionString, empty if there is no detection.
+    """
+    start, end = columns['img_offsets'][idx:idx + 2]
+    rle_offsets = columns['rle_offsets']
+    rle = columns['rle']
+    tokens = []
+    for j in range(start, end):
+        class_ind = columns['label'][j]
+        label = classes[class_ind]
+        prob = score_fmt.format(columns['score'][j])
+        oid_mask = counts_to_oid(
+            rle[rle_offsets[j]:rle_offsets[j + 1]].tobytes())
+        tokens += [label, prob, oid_mask]
+        if parents is not None:
+            for parent in parents[class_ind]:
+                tokens += [parent, prob, oid_mask]
+    return ' '.join(tokens)
@@ -0,0 +1,195 @@
+"""Streaming reader / writer of Kaggle submission csv files.
+
+Rows are ``(image_id, width, height, prediction_string)`` tuples that are
+read and written one at a time, so that the memory used by the util scripts
+does not grow with the number of images. Paths ending with ``.gz`` are
+transparently gzipped.
+
+Shards of a submission (e.g. the 25 csvs of the test set) are assembled by
+:func:`merge_submissions`, a k-way merge that only keeps the current row of
+every shard in memory.
+"""
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import sys
+from operator import itemgetter
+
+import numpy as np
+
+HEADER = ('ImageID', 'ImageWidth', 'ImageHeight', 'PredictionString')
+
+# a PredictionString easily exceeds the default limit of 128KB
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+
+def open_text(path, mode='r', buffer_size=1 << 20):
+    """Open a (possibly gzipped) text file for csv reading or writing."""
+    assert mode in ('r', 'w')
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(
+            io.BufferedWriter(gzip.open(path, 'wb'), buffer_size)
+            if mode == 'w' else gzip.open(path, 'rb'),
+            newline='')
+    return open(path, mode, buffering=buffer_size, newline='')
+
+
+class SubmissionWriter(object):
+    """Write the rows of a submission one by one.
+
+    Args:
+        path (str): output csv, gzipped if it ends with ``.gz``.
+        buffer_size (int): size of the write buffer in bytes.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self._file = open_text(path, 'w', buffer_size)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(HEADER)
+        self.num_rows = 0
+
+    def write(self, image_id, width, height, prediction_string=''):
+        """Write a row, an empty (or None) string means no detection."""
+        self._writer.writerow(
+            [image_id, width, height, prediction_string or ''])
+        self.num_rows += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(*row)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_submission(path, rows):
+    """Write an iterable of rows to a submission csv.
+
+    Returns:
+        int: number of rows written.
+    """
+    with SubmissionWriter(path) as writer:
+        writer.write_rows(rows)
+    return writer.num_rows
+
+
+def read_submission(path):
+    """Iterate over the rows of a submission csv.
+
+    The width and height are yielded as they are written (str), an image
+    without detection has an empty PredictionString.
+    """
+    with open_text(path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        assert tuple(header) == HEADER, \
+            '{} is not a submission csv: {}'.format(path, header)
+        for image_id, width, height, string in reader:
+            yield image_id, width, height, string
+
+
+def image_ids(paths):
+    """Iterate over the ImageIDs of one or more submission csvs, in order."""
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        for row in read_submission(path):
+            yield row[0]
+
+
+def iter_predictions(string):
+    """Iterate over the (label, score, mask) triples of a PredictionString,
+    the score is left as a str."""
+    if not string:
+        return
+    tokens = string.split(' ')
+    assert len(tokens) % 3 == 0
+    for k in range(0, len(tokens), 3):
+        yield tokens[k], tokens[k + 1], tokens[k + 2]
+
+
+def join_predictions(strings):
+    """Concatenate PredictionStrings, skipping the empty ones."""
+    return ' '.join(s for s in strings if s)
+
+
+def expand_predictions(strings, hierarchy=None, score_thr=None,
+                       with_self=True):
+    """Filter and expand the labels of PredictionStrings to their ancestors.
+
+    The (label, score, mask) triples of all the strings are processed at
+    once, each is followed by those of its ancestors, with its score and
+    mask (:meth:`ClassHierarchy.expand_labels`).
+
+    Args:
+        strings (Sequence[str]): PredictionStrings.
+        hierarchy (ClassHierarchy, optional): no expansion if None.
+        score_thr (float, optional): the triples of lower score are dropped.
+        with_self (bool): keep the triples themselves, else only those of
+            their ancestors.
+
+    Returns:
+        list[str]: the PredictionString of each input string.
+    """
+    tokens = [s.split(' ') if s else [] for s in strings]
+    assert all(len(t) % 3 == 0 for t in tokens)
+    triples = np.array([t for ts in tokens for t in ts],
+                       dtype=object).reshape(-1, 3)
+    img_inds = np.repeat(
+        np.arange(len(strings)), [len(t) // 3 for t in tokens])
+    if score_thr is not None:
+        keep = ~(triples[:, 1].astype(np.float64) < score_thr)
+        triples, img_inds = triples[keep], img_inds[keep]
+    if hierarchy is not None:
+        item_inds, labels = hierarchy.expand_labels(
+            triples[:, 0], with_self=with_self)
+        triples = np.column_stack([labels, triples[item_inds, 1:]])
+        img_inds = img_inds[item_inds]
+    elif not with_self:
+        triples, img_inds = triples[:0], img_inds[:0]
+    bounds = np.searchsorted(img_inds, np.arange(len(strings) + 1))
+    return [
+        ' '.join(triples[bounds[i]:bounds[i + 1]].ravel())
+        for i in range(len(strings))
+    ]
+
+
+def merge_submissions(paths, order=None):
+    """k-way streaming merge of submission csvs.
+
+    The rows of an image found in several inputs are combined into one,
+    with the width and height of the first of them and the detections of
+    all of them, in the order of ``paths``. Every input must be sorted in
+    the output order.
+
+    Args:
+        paths (Sequence[str]): input csvs.
+        order (Iterable[str], optional): all the ImageIDs, in output order.
+            By default the inputs must be sorted by ImageID.
+
+    Yields:
+        tuple: (image_id, width, height, prediction_string)
+    """
+    if order is None:
+        key = itemgetter(0)
+    else:
+        rank = {image_id: k for k, image_id in enumerate(order)}
+
+        def key(row):
+            return rank[row[0]]
+
+    merged = heapq.merge(*[read_submission(p) for p in paths], key=key)
+    # heapq.merge is stable, equal images come in the order of the inputs
+    for image_id, rows in itertools.groupby(merged, key=itemgetter(0)):
+        rows = list(rows)
+        width, height = rows[0][1], rows[0][2]
+        yield image_id, width, height, join_predictions(r[3] for r in rows)